@@ -57,7 +57,7 @@ setup (
         'python-graph-core==1.8.2',
         'pytz==2013b',
         'pyzabbix>=0.1',
-        'requests>=0.14.2',
+        'requests>=2.4.0',
         'RestKit==4.2.0',
         'rq>=0.3.7',
         'rq-scheduler==0.3.6',
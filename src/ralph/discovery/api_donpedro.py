@@ -37,6 +37,7 @@ from ralph.discovery.models import (
 )
 from ralph.discovery.models_component import CPU_VIRTUAL_LIST
 from ralph.util import Eth
+from ralph.util.repricing import batched
 from ralph.discovery.models_history import DiscoveryWarning
 
 
@@ -338,7 +339,8 @@ class WindowsDeviceResource(MResource):
         ip = remote_addr(bundle.request)
         logger.debug('Got json data: %s' % bundle.data.get('data'))
         try:
-            return save_device_data(bundle.data.get('data'), ip)
+            with batched():
+                return save_device_data(bundle.data.get('data'), ip)
         except Exception:
             logger.error(traceback.format_exc())
             raise
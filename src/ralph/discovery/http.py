@@ -5,11 +5,27 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
-import urllib2
+from multiprocessing.pool import ThreadPool
+import cookielib
+import os
 import threading
-import httplib
+import urllib2
+
+from django.conf import settings
+import requests
+
+from ralph.util.network import TTLCache
 
 
+HTTP_CONNECT_TIMEOUT = getattr(settings, 'HTTP_CONNECT_TIMEOUT', 2)
+HTTP_READ_TIMEOUT = getattr(settings, 'HTTP_READ_TIMEOUT', 5)
+HTTP_WORKERS = getattr(settings, 'HTTP_WORKERS', 16)
+# only the beginning of a page is needed to tell its family
+HTTP_MAX_DOCUMENT_SIZE = 262144
+# the families of the servers that can only be told apart by their pages
+DOCUMENT_FAMILIES = {
+    'Apache', 'Unspecified', 'lighttpd', 'Thomas-Krenn', 'Mbedthis-Appweb',
+}
 FAMILIES = {
     'GoAhead-Webs': 'Thomas-Krenn',
     'Apache': 'Apache',
@@ -21,6 +37,7 @@ FAMILIES = {
     '': 'Unspecified',
 }
 
+
 class HTTPRedirectHandler(urllib2.HTTPRedirectHandler):
     def http_error_302(self, req, fp, code, msg, headers):
         return urllib2.HTTPRedirectHandler.http_error_302(self, req, fp,
@@ -28,43 +45,85 @@ class HTTPRedirectHandler(urllib2.HTTPRedirectHandler):
     http_error_301 = http_error_303 = http_error_307 = http_error_302
 
 
-def get_http_info(ip):
-    opener = urllib2.build_opener()
-    request = urllib2.Request("http://{}".format(ip))
-    try:
-        response = opener.open(request, timeout=5)
-    except urllib2.HTTPError as e:
-        response = e
-    except (urllib2.URLError, httplib.BadStatusLine, httplib.InvalidURL):
-        request = urllib2.Request("https://{}".format(ip))
-        try:
-            response = opener.open(request, timeout=5)
-        except urllib2.HTTPError as e:
-            response = e
-        except (urllib2.URLError, httplib.BadStatusLine, httplib.InvalidURL):
-            return {}, ''
-    def closer():
+_local = threading.local()
+# plugins scanning the same host shortly after share the answers
+_cache = TTLCache(max_size=1024, ttl=60, negative_ttl=60)
+
+
+def get_session():
+    """Returns the HTTP session of this thread. Its connections are kept
+    alive and reused by the following requests to the same hosts. The
+    session doesn't verify certificates and doesn't keep any cookies, pass
+    them explicitly."""
+
+    if getattr(_local, 'pid', None) != os.getpid():
+        session = requests.Session()
+        session.verify = False
+        session.cookies.set_policy(
+            cookielib.DefaultCookiePolicy(allowed_domains=[]),
+        )
+        _local.session = session
+        _local.pid = os.getpid()
+    return _local.session
+
+
+def get_timeout(read_timeout=HTTP_READ_TIMEOUT):
+    return HTTP_CONNECT_TIMEOUT, read_timeout
+
+
+def _request(method, ip):
+    for url in ('http://{}'.format(ip), 'https://{}'.format(ip)):
         try:
-            response.close()
-        except:
-            pass
-    threading.Timer(5, closer).start()
+            return get_session().request(
+                method,
+                url,
+                timeout=get_timeout(),
+                allow_redirects=True,
+                stream=True,
+            )
+        except requests.RequestException:
+            continue
+    return None
+
+
+def _read_document(response):
+    chunks = []
+    size = 0
     try:
-        document = response.read().decode('utf-8', 'ignore')
+        for chunk in response.iter_content(8192):
+            chunks.append(chunk)
+            size += len(chunk)
+            if size >= HTTP_MAX_DOCUMENT_SIZE:
+                break
+    except requests.RequestException:
+        pass
     finally:
-        try:
-            response.close()
-        except:
-            pass
-    headers = response.headers
-    return headers, document
+        response.close()
+    return b''.join(chunks).decode('utf-8', 'ignore')
 
-def guess_family(headers, document):
+
+def get_http_info(ip):
+    found, info = _cache.get(('info', ip))
+    if found:
+        return info
+    response = _request('GET', ip)
+    if response is None:
+        info = {}, ''
+    else:
+        info = response.headers, _read_document(response)
+    _cache.set(('info', ip), info)
+    return info
+
+
+def _get_server_family(headers):
     server = headers.get('Server', '')
     if '/' in server:
         server = server.split('/', 1)[0]
-    family = FAMILIES.get(server, server)
+    return FAMILIES.get(server, server)
 
+
+def guess_family(headers, document):
+    family = _get_server_family(headers)
     if family in ('Apache', 'Unspecified'):
         if '<div id="copyright">Copyright &copy; IBM Corporation' in document:
             family = 'IBM'
@@ -97,7 +156,36 @@ def guess_family(headers, document):
 
 
 def get_http_family(ip):
-    headers, document = get_http_info(ip)
-    family = guess_family(headers, document)
+    """Tells the family of the HTTP server. Asks for the headers first and
+    fetches the page only when they are not enough."""
+
+    found, family = _cache.get(('family', ip))
+    if found:
+        return family
+    response = _request('HEAD', ip)
+    if response is None:
+        family = guess_family({}, '')
+    else:
+        response.close()
+        family = _get_server_family(response.headers)
+        if response.status_code in (405, 501) or family in DOCUMENT_FAMILIES:
+            headers, document = get_http_info(ip)
+            family = guess_family(headers, document)
+    _cache.set(('family', ip), family)
     return family
 
+
+def get_http_families(ips):
+    """Returns a dict mapping every one of `ips` to its HTTP family. The
+    addresses are probed in parallel by `HTTP_WORKERS` threads."""
+
+    ips = list(ips)
+    if len(ips) < 2 or HTTP_WORKERS < 2:
+        return {ip: get_http_family(ip) for ip in ips}
+    pool = ThreadPool(min(HTTP_WORKERS, len(ips)))
+    try:
+        families = pool.map(get_http_family, ips)
+    finally:
+        pool.close()
+        pool.join()
+    return dict(zip(ips, families))
@@ -6,6 +6,7 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import io
 import re
 
 import jpath
@@ -47,6 +48,11 @@ _text_translation_pairs = set([
     ('setting', 'value'),
 ])
 
+# nodes of these classes are kept whole by `iterparse_lshw`
+LSHW_NODE_CLASSES = frozenset(['memory', 'processor', 'disk', 'network'])
+
+_WHOLE, _FIELDS, _NODES = range(3)
+
 
 def _nullify(value):
     if value is not None:
@@ -54,36 +60,90 @@ def _nullify(value):
     return Null
 
 
-def parse_lshw(as_string):
-    parser = ET.ETCompatXMLParser(recover=True)
-    response = ET.fromstring(as_string, parser=parser)
-    if response.tag is None or response.tag.upper() != 'NODE':
-        return None, as_string
-    for element in response.findall('.//'):
-        for k in element.attrib.keys():
+def _translate_element(element):
+    for k in element.attrib.keys():
+        try:
+            v = element.attrib[k]
+        except UnicodeDecodeError:
+            continue   # value has bytes not possible to decode with UTF-8
+        if (element.tag, k) in _tag_translation_pairs:
             try:
-                v = element.attrib[k]
-            except UnicodeDecodeError:
-                continue   # value has bytes not possible to decode with UTF-8
-            if (element.tag, k) in _tag_translation_pairs:
-                try:
-                    element.tag = v
-                except ValueError:
-                    pass
+                element.tag = v
+            except ValueError:
+                pass
+            continue
+        if (element.tag, k) in _text_translation_pairs:
+            element.text = v
+            continue
+        if k == 'units':
+            value = ET.Element(b'value')
+            value.text = element.text
+            element.text = ''
+            element.append(value)
+        child = ET.Element(k)
+        child.text = v
+        element.append(child)
+
+
+def iterparse_lshw(as_string, classes=LSHW_NODE_CLASSES):
+    """Stream the lshw XML and return only the parts that are used.
+
+    Nodes of the given `classes` are kept with their whole subtrees, bus
+    nodes keep their own fields, and everything else is dropped as soon
+    as the parser leaves it, so memory stays bounded by the interesting
+    nodes instead of the whole document. Returns None if the document
+    isn't an lshw node.
+    """
+    if isinstance(as_string, unicode):
+        as_string = as_string.encode('utf-8')
+    modes = []
+    root = None
+    try:
+        for event, element in ET.iterparse(
+            io.BytesIO(as_string),
+            events=('start', 'end'),
+            recover=True,
+            remove_comments=True,
+        ):
+            if event == 'start':
+                if root is None:
+                    root = element
+                    if element.tag.upper() != 'NODE':
+                        return None
+                    modes.append(_FIELDS)
+                elif element.tag == 'node':
+                    if modes[-1] == _WHOLE or element.get('class') in classes:
+                        modes.append(_WHOLE)
+                    elif element.get('class') == 'bus':
+                        modes.append(_FIELDS)
+                    else:
+                        modes.append(_NODES)
                 continue
-            if (element.tag, k) in _text_translation_pairs:
-                element.text = v
+            if element is root:
+                break
+            parent = element.getparent()
+            if element.tag != 'node':
+                if modes[-1] != _NODES:
+                    _translate_element(element)
+                elif parent.tag == 'node':
+                    parent.remove(element)
                 continue
-            if k == 'units':
-                value = ET.Element(b'value')
-                value.text = element.text
-                element.text = ''
-                element.append(value)
-            child = ET.Element(k)
-            child.text = v
-            element.append(child)
+            if modes.pop() != _NODES:
+                _translate_element(element)
+            elif len(element):
+                # only the subnodes we need are left, skip the fields
+                try:
+                    element.tag = element.get('class')
+                except (TypeError, ValueError):
+                    pass
+            else:
+                parent.remove(element)
+    except ET.XMLSyntaxError:
+        return None
+    if root is None:
+        return None
     return nullify(
-        etree_to_dict(response, _converters=[
+        etree_to_dict(root, _converters=[
             _nullify,
             int,
             float,
@@ -92,6 +152,13 @@ def parse_lshw(as_string):
         ]))[1]
 
 
+def parse_lshw(as_string, classes=LSHW_NODE_CLASSES):
+    lshw = iterparse_lshw(as_string, classes)
+    if lshw is None:
+        return None, as_string
+    return lshw
+
+
 def handle_lshw(data, is_virtual=False, sn=None, priority=0):
     lshw = parse_lshw(as_string=data)
     prod_name = lshw['product']
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import datetime
+import textwrap
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ralph.discovery.models_history import rebuild_daily_costs
+
+
+class Command(BaseCommand):
+    """
+    Compute the rollup of the daily costs used by the ventures report again
+    from the cost history, e.g. after the types of device models changed.
+    """
+
+    help = textwrap.dedent(__doc__).strip()
+    requires_model_validation = True
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--start',
+            dest='start',
+            default=None,
+            help='The first day, YYYY-MM-DD (default 30 days ago).',
+        ),
+        make_option(
+            '--end',
+            dest='end',
+            default=None,
+            help='The day after the last one, YYYY-MM-DD (default today).',
+        ),
+    )
+
+    def handle(self, *args, **options):
+        today = datetime.date.today()
+        try:
+            start, end = (
+                datetime.datetime.strptime(value, '%Y-%m-%d').date()
+                if value else default
+                for value, default in (
+                    (options['start'], today - datetime.timedelta(days=30)),
+                    (options['end'], today),
+                )
+            )
+        except ValueError as e:
+            raise CommandError(e)
+        rebuild_daily_costs(start, end)
@@ -17,6 +17,7 @@ from django.core.management.base import BaseCommand
 from ipaddr import IPNetwork
 
 from ralph.discovery.models import Network
+from ralph.discovery.schedule import start_scheduler
 from ralph.discovery.tasks import (
     discover_address,
     discover_all,
@@ -64,6 +65,13 @@ class Command(BaseCommand):
             default=None,
             help='Run only the discovery on networks on the specified '
                  'queues.'),
+        make_option(
+            '--schedule',
+            action='store_true',
+            dest='schedule',
+            default=False,
+            help='Instead of running the discovery now, make rq-scheduler '
+                 'rediscover the known addresses when they are due.'),
     )
 
     requires_model_validation = False
@@ -71,6 +79,9 @@ class Command(BaseCommand):
     def handle(self, *args, **options):
         """Dispatches the request to either direct, interactive execution
         or to asynchronous processing using the queue."""
+        if options['schedule']:
+            start_scheduler()
+            return
         interactive = not options['remote']
         discover = OptionBag()
         discover.all = partial(discover_all, interactive=interactive)
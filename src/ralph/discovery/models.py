@@ -52,6 +52,7 @@ from ralph.discovery.models_component import (
     Storage,
 )
 from ralph.discovery.models_history import (
+    DailyCost,
     DiscoveryValue,
     DiscoveryWarning,
     HistoryChange,
@@ -108,6 +109,7 @@ __all__ = [
 
     'HistoryChange',
     'HistoryCost',
+    'DailyCost',
     'DiscoveryValue',
     'DiscoveryWarning',
 
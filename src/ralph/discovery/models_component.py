@@ -8,6 +8,7 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import copy
 import datetime
 from decimal import Decimal
 
@@ -18,9 +19,21 @@ from lck.django.common.models import (TimeTrackable, Named,
 from lck.django.choices import Choices
 from django.utils.html import escape
 
+from ralph.discovery.models_pricing import get_formulas
 from ralph.discovery.models_util import SavingUser
-
-
+from ralph.util.cache import VersionedCache
+
+
+# the groups providing the prices of the components that weren't detected
+FALLBACK_GROUP_NAMES = (
+    'OS Detected CPU',
+    'Default CPU',
+    'OS Detected Memory',
+    'Default Memory',
+    'OS Detected Storage',
+    'Default Disk',
+)
+FALLBACK_GROUPS_VERSION_KEY = 'ralph.discovery.fallback_groups_version'
 MAC_PREFIX_BLACKLIST = set([
     '505054', '33506F', '009876', '000000', '00000C', '204153', '149120',
     '020054', 'FEFFFF', '1AF920', '020820', 'DEAD2C', 'FEAD4D',
@@ -154,6 +167,48 @@ class ComponentModelGroup(Named, TimeTrackable, SavingUser):
                 GenericComponent, Software))
 
 
+class FallbackGroups(VersionedCache):
+    """A process-local cache of the component model groups named in
+    `FALLBACK_GROUP_NAMES`, which every pricing of a device without
+    detected components looks up."""
+
+    def __init__(self, model):
+        super(FallbackGroups, self).__init__(
+            FALLBACK_GROUPS_VERSION_KEY,
+            self._build,
+        )
+        self.model = model
+
+    def get(self, name):
+        """Returns the group named `name` or None."""
+
+        group = super(FallbackGroups, self).get().get(name)
+        return copy.copy(group) if group else None
+
+    def _build(self):
+        return {
+            group.name: group
+            for group in self.model.objects.filter(
+                name__in=FALLBACK_GROUP_NAMES,
+            )
+        }
+
+
+ComponentModelGroup.fallbacks = FallbackGroups(ComponentModelGroup)
+
+
+def invalidate_fallback_groups(sender, instance, **kwargs):
+    ComponentModelGroup.fallbacks.invalidate()
+db.signals.post_save.connect(
+    invalidate_fallback_groups,
+    sender=ComponentModelGroup,
+)
+db.signals.post_delete.connect(
+    invalidate_fallback_groups,
+    sender=ComponentModelGroup,
+)
+
+
 class ComponentModel(SavePrioritized, WithConcurrentGetOrCreate, SavingUser):
     name = db.CharField(verbose_name=_("name"), max_length=255)
     speed = db.PositiveIntegerField(verbose_name=_("speed (MHz)"),
@@ -302,17 +357,9 @@ class Component(SavePrioritized, WithConcurrentGetOrCreate):
         """
         Find a custom formula for this component's price for specified date.
         """
-        if not (self.model and self.model.group):
+        if not (self.model and self.model.group_id):
             return None
-        if date is None:
-            date = datetime.date.today()
-        month = datetime.date(date.year, date.month, 1)
-        for formula in self.model.group.pricingformula_set.filter(
-            group__date=month,
-            group__devices=self.device,
-        ):
-            return formula
-        return None
+        return get_formulas(date).get((self.model.group_id, self.device_id))
 
     def get_price(self):
         if not self.model:
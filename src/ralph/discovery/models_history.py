@@ -8,7 +8,8 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
-from datetime import datetime, date
+import collections
+from datetime import datetime, date, timedelta
 
 from django.conf import settings
 from django.db import models as db
@@ -19,7 +20,8 @@ from django.utils.translation import ugettext_lazy as _
 
 from ralph.cmdb.integration.splunk import log_change_to_splunk
 from ralph.discovery.models_device import (Device, DeprecationKind,
-                                           DeviceModel, DeviceModelGroup)
+                                           DeviceModel, DeviceModelGroup,
+                                           DeviceType)
 from ralph.discovery.models_device import LoadBalancerMember
 from ralph.discovery.models_device import LoadBalancerVirtualServer
 from ralph.discovery.models_component import (
@@ -160,6 +162,16 @@ def device_related_pre_save(sender, instance, raw, using, **kwargs):
     A hook for creating ``HistoryChange`` entry when a component is changed.
     """
 
+    for change in get_component_changes(instance):
+        change.save()
+
+
+def get_component_changes(instance):
+    """
+    Returns the unsaved ``HistoryChange`` entries describing the changes made
+    to a component.
+    """
+
     try:
         device = instance.device
     except Device.DoesNotExist:
@@ -173,7 +185,7 @@ def device_related_pre_save(sender, instance, raw, using, **kwargs):
         'number',
         'snmp_community',
     }
-    for field, orig, new in _field_changes(instance, ignore=ignore):
+    return [
         HistoryChange(
             device=device,
             field_name=field,
@@ -183,7 +195,20 @@ def device_related_pre_save(sender, instance, raw, using, **kwargs):
             component=unicode(instance),
             component_id=instance.id,
             plugin=device.saving_plugin if device else '',
-        ).save()
+        )
+        for field, orig, new in _field_changes(instance, ignore=ignore)
+    ]
+
+
+def save_history_changes(changes):
+    """
+    Saves many ``HistoryChange`` entries with a single query.
+    """
+
+    HistoryChange.objects.bulk_create(changes)
+    if SPLUNK_HOST:
+        for change in changes:
+            log_change_to_splunk(change, 'CHANGE_HISTORY')
 
 
 @receiver(pre_delete, sender=Memory, dispatch_uid='ralph.history')
@@ -316,6 +341,284 @@ class HistoryCost(db.Model):
         return query
 
 
+class DailyCost(db.Model):
+    """
+    A rollup of the ``HistoryCost`` spans: the daily costs, the numbers of
+    spans and the cores summed up for every day, venture, device type, extra
+    cost and whether the device is deleted. The device type and deletion are
+    the current ones of the device, just like in the reports. Changes of the
+    spans add the differences to the rows of the days that changed, or add
+    the rows if there are none yet. A value is the sum of all the rows with
+    the same key. Only the days between the first and the last day in the
+    table are kept up to date, the missing ones are added with
+    ``fill_daily_costs``.
+    """
+
+    day = db.DateField(db_index=True)
+    venture = db.ForeignKey('business.Venture', null=True, blank=True,
+                            default=None, on_delete=db.SET_NULL)
+    device_type = db.PositiveIntegerField(choices=DeviceType(), null=True,
+                                          blank=True, default=None)
+    extra = db.ForeignKey('business.VentureExtraCost', null=True, blank=True,
+                          default=None, on_delete=db.SET_NULL)
+    deleted = db.BooleanField(default=False)
+    cost = db.FloatField(default=0)
+    spans = db.IntegerField(default=0)
+    cores = db.IntegerField(default=0)
+
+
+def _get_rollup_days():
+    days = DailyCost.objects.aggregate(first=db.Min('day'), last=db.Max('day'))
+    return days['first'], days['last']
+
+
+def _get_device_state(device_id):
+    """Returns the type and the deletion of the device, the parts of the
+    keys of ``DailyCost`` that come from the device."""
+
+    for device_type, deleted in Device.admin_objects.filter(
+        id=device_id,
+    ).values_list('model__type', 'deleted'):
+        return device_type, deleted
+    return None, False
+
+
+def _get_model_type(model_id):
+    if model_id is None:
+        return None
+    for device_type, in DeviceModel.objects.filter(
+        id=model_id,
+    ).values_list('type'):
+        return device_type
+
+
+# keeps the number of query parameters below the limits of the databases
+DAILY_COST_CHUNK_SIZE = 500
+
+
+def _add_span(changes, span, sign=1, device_state=None, days=None):
+    """Adds the costs of the ``span`` to the ``changes`` of the days in
+    ``DailyCost``, or subtracts them if ``sign`` is -1. ``days`` are the
+    first and the last day in ``DailyCost``, if known."""
+
+    first, last = days or _get_rollup_days()
+    field = HistoryCost._meta.get_field('start')
+    start = field.to_python(span.start)
+    end = field.to_python(span.end)
+    if first is None or start is None or end is None:
+        return
+    start = max(start, first)
+    end = min(end, last + timedelta(days=1))
+    if device_state is None:
+        device_state = _get_device_state(span.device_id)
+    device_type, deleted = device_state
+    key = span.venture_id, device_type, span.extra_id, deleted
+    for i in xrange((end - start).days):
+        values = changes[key, start + timedelta(days=i)]
+        values[0] += sign * span.daily_cost
+        values[1] += sign
+        values[2] += sign * span.cores
+
+
+def _save_changes(changes):
+    """Writes the ``changes`` of the days to ``DailyCost``, leaving out the
+    days that didn't change. The days with the same key and changes are
+    written together."""
+
+    days = collections.defaultdict(list)
+    for (key, day), values in changes.iteritems():
+        if any(values):
+            days[key, tuple(values)].append(day)
+    for (key, values), key_days in days.iteritems():
+        for index in xrange(0, len(key_days), DAILY_COST_CHUNK_SIZE):
+            _update_days(
+                key,
+                values,
+                key_days[index:index + DAILY_COST_CHUNK_SIZE],
+            )
+
+
+def _update_days(key, values, days):
+    """Adds the ``values`` to the rows of the ``days`` with the ``key`` in
+    ``DailyCost``, or adds the rows of the days that have none."""
+
+    venture_id, device_type, extra_id, deleted = key
+    cost, spans, cores = values
+    # the locks keep the others from adding the same rows in the meantime
+    rows = dict(DailyCost.objects.select_for_update().filter(
+        day__in=days,
+        venture=venture_id,
+        device_type=device_type,
+        extra=extra_id,
+        deleted=deleted,
+    ).values_list('day', 'id'))
+    if rows:
+        DailyCost.objects.filter(id__in=rows.values()).update(
+            cost=db.F('cost') + cost,
+            spans=db.F('spans') + spans,
+            cores=db.F('cores') + cores,
+        )
+    DailyCost.objects.bulk_create([
+        DailyCost(
+            day=day,
+            venture_id=venture_id,
+            device_type=device_type,
+            extra_id=extra_id,
+            deleted=deleted,
+            cost=cost,
+            spans=spans,
+            cores=cores,
+        )
+        for day in days if day not in rows
+    ])
+
+
+def _add_daily_costs(span, sign=1, device_state=None):
+    """Adds the costs of the ``span`` to the days in ``DailyCost``, or
+    subtracts them if ``sign`` is -1."""
+
+    changes = collections.defaultdict(lambda: [0, 0, 0])
+    _add_span(changes, span, sign, device_state)
+    _save_changes(changes)
+
+
+def _move_daily_costs(device, old_state, new_state):
+    """Moves the costs of the spans of the ``device`` in ``DailyCost`` from
+    the old type and deletion of the device to the new ones."""
+
+    if old_state == new_state:
+        return
+    changes = collections.defaultdict(lambda: [0, 0, 0])
+    days = _get_rollup_days()
+    for span in device.historycost_set.all():
+        _add_span(changes, span, -1, old_state, days)
+        _add_span(changes, span, 1, new_state, days)
+    _save_changes(changes)
+
+
+def fill_daily_costs(start, end):
+    """Adds the days between ``start`` and ``end`` (exclusive) that are
+    missing in ``DailyCost``, together with the days between them and the
+    ones already there, computing them from the ``HistoryCost`` spans."""
+
+    first, last = _get_rollup_days()
+    if first is None:
+        days = [(start, end)]
+    else:
+        days = [(start, first), (last + timedelta(days=1), end)]
+    for start, end in days:
+        _fill_days(start, end)
+
+
+def rebuild_daily_costs(start, end):
+    """Computes the days between ``start`` and ``end`` (exclusive) in
+    ``DailyCost`` from the ``HistoryCost`` spans again."""
+
+    DailyCost.objects.filter(day__gte=start, day__lt=end).delete()
+    _fill_days(start, end)
+
+
+def _fill_days(start, end):
+    """Adds the days between ``start`` and ``end`` (exclusive) to
+    ``DailyCost``, reading the spans overlapping them at once. The sums are
+    carried from day to day, changed only on the days where spans start or
+    end."""
+
+    if start >= end:
+        return
+    changes = collections.defaultdict(
+        lambda: collections.defaultdict(lambda: [0, 0, 0]),
+    )
+    for row in HistoryCost.objects.filter(
+        start__lt=end,
+        end__gt=start,
+    ).values_list(
+        'start',
+        'end',
+        'venture_id',
+        'device__model__type',
+        'extra_id',
+        'device__deleted',
+        'daily_cost',
+        'cores',
+    ):
+        span_start, span_end, venture_id, device_type, extra_id = row[:5]
+        deleted, daily_cost, cores = row[5:]
+        key = venture_id, device_type, extra_id, bool(deleted)
+        for day, sign in ((max(span_start, start), 1), (span_end, -1)):
+            values = changes[day][key]
+            values[0] += sign * daily_cost
+            values[1] += sign
+            values[2] += sign * cores
+    sums = collections.defaultdict(lambda: [0, 0, 0])
+    rows = []
+    for i in xrange((end - start).days):
+        day = start + timedelta(days=i)
+        for key, values in changes.pop(day, {}).iteritems():
+            key_sums = sums[key]
+            for index, value in enumerate(values):
+                key_sums[index] += value
+            if not key_sums[1]:
+                # no spans left, drop the rounding errors of the cost
+                del sums[key]
+        rows.extend(
+            DailyCost(
+                day=day,
+                venture_id=venture_id,
+                device_type=device_type,
+                extra_id=extra_id,
+                deleted=deleted,
+                cost=cost,
+                spans=spans,
+                cores=cores,
+            )
+            for (venture_id, device_type, extra_id, deleted),
+            (cost, spans, cores) in sums.iteritems()
+        )
+        if len(rows) >= DAILY_COST_CHUNK_SIZE:
+            DailyCost.objects.bulk_create(rows)
+            rows = []
+    if rows:
+        DailyCost.objects.bulk_create(rows)
+
+
+@receiver(pre_save, sender=HistoryCost, dispatch_uid='ralph.dailycost')
+def daily_cost_pre_save(sender, instance, raw, using, **kwargs):
+    """
+    A hook that remembers the old values of a span, subtracted from
+    ``DailyCost`` after it's saved.
+    """
+
+    instance._saved_span = None
+    if instance.id:
+        for span in HistoryCost.objects.filter(id=instance.id):
+            instance._saved_span = span
+
+
+@receiver(post_save, sender=HistoryCost, dispatch_uid='ralph.dailycost')
+def daily_cost_post_save(sender, instance, raw, using, **kwargs):
+    """
+    A hook that replaces the old values of a span with the new ones in
+    ``DailyCost``, writing only the days that changed.
+    """
+
+    changes = collections.defaultdict(lambda: [0, 0, 0])
+    days = _get_rollup_days()
+    if getattr(instance, '_saved_span', None):
+        _add_span(changes, instance._saved_span, -1, days=days)
+    _add_span(changes, instance, days=days)
+    _save_changes(changes)
+
+
+@receiver(post_delete, sender=HistoryCost, dispatch_uid='ralph.dailycost')
+def daily_cost_post_delete(sender, instance, using, **kwargs):
+    """
+    A hook that subtracts a deleted span from ``DailyCost``.
+    """
+
+    _add_daily_costs(instance, -1)
+
+
 def update_core_count(device):
     old_cores = 0
     for span in device.historycost_set.order_by('-end'):
@@ -349,6 +652,18 @@ def cost_post_save(sender, instance, raw, using, **kwargs):
     changes on a device, or a device is soft-deleted/undeleted.
     """
 
+    if {'deleted', 'model_id'} & set(instance.dirty_fields):
+        # before the spans are changed
+        _move_daily_costs(
+            instance,
+            (
+                _get_model_type(instance.dirty_fields.get(
+                    'model_id', instance.model_id,
+                )),
+                bool(instance.dirty_fields.get('deleted', instance.deleted)),
+            ),
+            (_get_model_type(instance.model_id), instance.deleted),
+        )
     if instance.deleted:
         HistoryCost.end_span(device=instance)
         return
@@ -373,6 +688,12 @@ def cost_pre_delete(sender, instance, using, **kwargs):
     """
 
     HistoryCost.end_span(device=instance)
+    # the spans are left without the device
+    _move_daily_costs(
+        instance,
+        (_get_model_type(instance.model_id), instance.deleted),
+        (None, False),
+    )
 
 
 class HistoryModelChange(db.Model):
@@ -8,17 +8,23 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import bisect
+import copy
+
 import ipaddr
 
 from django.core.exceptions import ValidationError
 from django.db import models as db
 from django.db import IntegrityError
 from django.utils.translation import ugettext_lazy as _
+import django_rq
 from lck.django.common.models import (
     TimeTrackable, Named, WithConcurrentGetOrCreate, SavePrioritized,
 )
 
 from ralph.util import network
+from ralph.util.cache import VersionedCache
+from ralph.util.jobs import enqueue_once
 from ralph.discovery.models_util import LastSeen
 
 
@@ -33,6 +39,66 @@ class NetworkKind(Named):
         ordering = ('name',)
 
 
+UNRESOLVED_HOSTNAMES_KEY = 'ralph:discovery:unresolved_hostnames'
+HOSTNAMES_IN_FLIGHT_KEY = 'ralph:in-flight:hostnames'
+NETWORK_INDEX_VERSION_KEY = 'ralph.discovery.network_index_version'
+
+
+class NetworkIndex(VersionedCache):
+    """A process-local index answering which networks contain an IP address
+    without querying the database.
+
+    Networks are address blocks, so any two of them are either disjoint or one
+    contains the other. Sorted by their smallest addresses, every network
+    remembers the closest network enclosing it. A lookup is a binary search
+    followed by a short walk up the enclosing networks.
+
+    The index is rebuilt whenever the version stored in the cache changes, so
+    all the processes sharing the cache pick up the changes. Processes which
+    don't share it, e.g. with the default ``LocMemCache``, may use stale
+    networks for up to a minute.
+    """
+
+    def __init__(self, model):
+        super(NetworkIndex, self).__init__(
+            NETWORK_INDEX_VERSION_KEY,
+            self._build,
+        )
+        self.model = model
+
+    def all_from_ip(self, ip):
+        """Returns all networks containing `ip`, the smallest first."""
+
+        min_ips, networks, parents = self.get()
+        ip_int = int(ipaddr.IPAddress(ip))
+        index = bisect.bisect_right(min_ips, ip_int) - 1
+        result = []
+        while index >= 0:
+            network = networks[index]
+            if network.max_ip >= ip_int:
+                result.append(copy.copy(network))
+            index = parents[index]
+        return result
+
+    def _build(self):
+        networks = sorted(
+            self.model.objects.filter(
+                min_ip__isnull=False,
+                max_ip__isnull=False,
+            ).select_related('queue', 'data_center'),
+            key=lambda network: (network.min_ip, -network.max_ip),
+        )
+        parents = []
+        enclosing = []
+        for index, network in enumerate(networks):
+            while enclosing and networks[enclosing[-1]].max_ip < network.min_ip:
+                enclosing.pop()
+            parents.append(enclosing[-1] if enclosing else -1)
+            enclosing.append(index)
+        min_ips = [network.min_ip for network in networks]
+        return min_ips, networks, parents
+
+
 class AbstractNetwork(db.Model):
     address = db.CharField(
         _("network address"),
@@ -152,14 +218,9 @@ class AbstractNetwork(db.Model):
 
     @classmethod
     def all_from_ip(cls, ip):
-        """Find all networks for this IP."""
+        """Find all networks for this IP, the smallest first."""
 
-        ip_int = int(ipaddr.IPAddress(ip))
-        nets = cls.objects.filter(
-            min_ip__lte=ip_int,
-            max_ip__gte=ip_int
-        ).order_by('-min_ip', 'max_ip')
-        return nets
+        return cls.index.all_from_ip(ip)
 
     @property
     def network(self):
@@ -190,6 +251,8 @@ class Network(Named, AbstractNetwork, TimeTrackable,
     def __unicode__(self):
         return "{} ({})".format(self.name, self.address)
 
+Network.index = NetworkIndex(Network)
+
 
 class NetworkTerminator(Named):
     class Meta:
@@ -237,6 +300,16 @@ def validate_network_address(sender, instance, **kwargs):
 db.signals.pre_save.connect(validate_network_address, sender=Network)
 
 
+def invalidate_network_index(sender, instance, **kwargs):
+    Network.index.invalidate()
+db.signals.post_save.connect(invalidate_network_index, sender=Network)
+db.signals.post_delete.connect(invalidate_network_index, sender=Network)
+db.signals.post_save.connect(invalidate_network_index, sender=DiscoveryQueue)
+db.signals.post_delete.connect(invalidate_network_index, sender=DiscoveryQueue)
+db.signals.post_save.connect(invalidate_network_index, sender=DataCenter)
+db.signals.post_delete.connect(invalidate_network_index, sender=DataCenter)
+
+
 class IPAddress(LastSeen, TimeTrackable, WithConcurrentGetOrCreate):
     address = db.IPAddressField(
         _("IP address"), help_text=_("Presented as string."), unique=True,
@@ -290,6 +363,10 @@ class IPAddress(LastSeen, TimeTrackable, WithConcurrentGetOrCreate):
     last_plugins = db.TextField(_("last plugins"),  blank=True)
     dead_ping_count = db.IntegerField(_("dead ping count"), default=0)
     is_buried = db.BooleanField(_("Buried from autoscan"), default=False)
+    next_discovery = db.DateTimeField(
+        _("next discovery"), null=True, blank=True, default=None,
+        db_index=True,
+    )
     scan_summary = db.ForeignKey(
         'scan.ScanSummary',
         on_delete=db.SET_NULL,
@@ -305,12 +382,20 @@ class IPAddress(LastSeen, TimeTrackable, WithConcurrentGetOrCreate):
         return "{} ({})".format(self.hostname, self.address)
 
     def save(self, allow_device_change=True, *args, **kwargs):
+        """If the `defer_hostname` keyword argument is True, a missing
+        hostname is resolved later by a background task instead of blocking
+        on DNS."""
+        defer_hostname = kwargs.pop('defer_hostname', False)
         if not allow_device_change:
             self.assert_same_device()
         if not self.address:
             self.address = network.hostname(self.hostname, reverse=True)
+        resolve_hostname = False
         if not self.hostname:
-            self.hostname = network.hostname(self.address)
+            if defer_hostname:
+                resolve_hostname = True
+            else:
+                self.hostname = network.hostname(self.address)
         self.number = int(ipaddr.IPAddress(self.address))
         try:
             self.network = Network.from_ip(self.address)
@@ -319,6 +404,8 @@ class IPAddress(LastSeen, TimeTrackable, WithConcurrentGetOrCreate):
         if self.network and self.network.ignore_addresses:
             self.device = None
         super(IPAddress, self).save(*args, **kwargs)
+        if resolve_hostname:
+            queue_hostname_resolution([self.address])
 
     def assert_same_device(self):
         if not self.id or 'device_id' not in self.dirty_fields:
@@ -338,6 +425,30 @@ class IPAddress(LastSeen, TimeTrackable, WithConcurrentGetOrCreate):
         )
 
 
+def queue_hostname_resolution(addresses):
+    """Queues resolving the hostnames of `addresses` in the background.
+    The addresses are gathered in a set in Redis, so the task resolves
+    everything that is pending at once."""
+
+    addresses = list(addresses)
+    if addresses:
+        django_rq.get_connection().sadd(UNRESOLVED_HOSTNAMES_KEY, *addresses)
+        enqueue_hostname_resolution()
+
+
+def enqueue_hostname_resolution():
+    """Enqueues the task resolving the queued hostnames, unless it's already
+    waiting in the queue or running."""
+
+    enqueue_once(
+        django_rq.get_queue(),
+        HOSTNAMES_IN_FLIGHT_KEY,
+        'ralph.discovery.tasks.resolve_hostnames',
+        timeout=3600,
+        result_ttl=0,
+    )
+
+
 class IPAlias(SavePrioritized, WithConcurrentGetOrCreate):
     address = db.ForeignKey("IPAddress", related_name="+")
     hostname = db.CharField(_("hostname"), max_length=255)
@@ -5,11 +5,15 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import datetime
+
 from django.db import models as db
 
 from lck.django.choices import Choices
 from lck.django.common import nested_commit_on_success
 
+from ralph.util.cache import VersionedCache
+
 
 class PricingAggregate(Choices):
     """The way to aggregate values of a variable."""
@@ -22,6 +26,87 @@ class PricingAggregate(Choices):
     max = _("Maximum") << {'function': db.Max}
 
 
+PRICING_VERSION_KEY = 'ralph.discovery.pricing_version'
+# the compiled formulas, by their source
+_compiled_formulas = {}
+MAX_COMPILED_FORMULAS = 1000
+# the formulas by month and the values of the variables by group id, read
+# from the database when needed
+_pricing = VersionedCache(PRICING_VERSION_KEY, lambda: ({}, {}))
+
+
+def invalidate_pricing_cache():
+    """Forgets the cached formulas and values of the variables of all the
+    pricing groups."""
+
+    _pricing.invalidate()
+
+
+def get_formulas(date=None):
+    """Returns the formulas of the pricing groups of the month of `date` as a
+    dict keyed by `(component model group id, device id)`. If a device is in
+    many groups with a formula for the same component model group, the one of
+    the first group wins."""
+
+    if date is None:
+        date = datetime.date.today()
+    month = datetime.date(date.year, date.month, 1)
+    formulas_by_month, variables = _pricing.get()
+    formulas = formulas_by_month.get(month)
+    if formulas is not None:
+        return formulas
+    groups = {}
+    for group_id, device_id in PricingGroup.devices.through.objects.filter(
+        pricinggroup__date=month,
+    ).values_list('pricinggroup_id', 'device_id'):
+        groups.setdefault(group_id, []).append(device_id)
+    formulas = {}
+    # in the reversed order of the groups, so that the first one wins
+    for formula in PricingFormula.objects.filter(
+        group__date=month,
+    ).order_by('-group__name', '-group__date'):
+        for device_id in groups.get(formula.group_id, ()):
+            formulas[formula.component_group_id, device_id] = formula
+    formulas_by_month[month] = formulas
+    return formulas
+
+
+def get_variables(group_ids):
+    """Returns the values of the variables of the pricing groups with the
+    given ids, as a dict of dicts: `{group id: {variable name: value}}`."""
+
+    formulas_by_month, cached = _pricing.get()
+    group_ids = set(group_ids)
+    variables = {
+        group_id: cached[group_id]
+        for group_id in group_ids if group_id in cached
+    }
+    missing = group_ids - set(variables)
+    if not missing:
+        return variables
+    # all the aggregates of all the variables in a single query, without the
+    # default ordering, which would split the rows of the variables
+    aggregates = {
+        row['variable_id']: row
+        for row in PricingValue.objects.filter(
+            variable__group_id__in=missing,
+        ).order_by().values('variable_id').annotate(**{
+            choice.name: choice.function('value')
+            for choice in PricingAggregate(item=lambda choice: choice)
+        })
+    }
+    for group_id in missing:
+        variables[group_id] = {}
+    for variable in PricingVariable.objects.filter(group_id__in=missing):
+        row = aggregates.get(variable.id, {})
+        variables[variable.group_id][variable.name] = row.get(
+            PricingAggregate.from_id(variable.aggregate).name,
+        )
+    for group_id in missing:
+        cached[group_id] = variables[group_id]
+    return variables
+
+
 class PricingGroup(db.Model):
     """
     A group of devices that are priced according to common rules for the
@@ -65,6 +150,12 @@ class PricingGroup(db.Model):
                     device=value.device,
                 ).save()
 
+    def get_variables(self):
+        """Returns the values of the variables of this group by their
+        names."""
+
+        return dict(get_variables([self.id])[self.id])
+
     def __unicode__(self):
         return self.name
 
@@ -84,6 +175,18 @@ class PricingFormula(db.Model):
     def __unicode__(self):
         return self.formula
 
+    @staticmethod
+    def compile_formula(formula):
+        """Returns the code object of the `formula`, compiled only once."""
+
+        code = _compiled_formulas.get(formula)
+        if code is None:
+            code = compile(formula, '<formula>', 'eval')
+            if len(_compiled_formulas) >= MAX_COMPILED_FORMULAS:
+                _compiled_formulas.clear()
+            _compiled_formulas[formula] = code
+        return code
+
     @staticmethod
     def eval_formula(formula, variables):
         builtins = {
@@ -92,15 +195,13 @@ class PricingFormula(db.Model):
             'min': min,
         }
         return eval(
-            formula,
+            PricingFormula.compile_formula(formula),
             {'__builtins__': builtins},
             variables,
         )
 
     def get_value(self, **kwargs):
-        variables = {}
-        for variable in self.group.pricingvariable_set.all():
-            variables[variable.name] = variable.get_value()
+        variables = dict(get_variables([self.group_id])[self.group_id])
         variables.update(kwargs)
         return PricingFormula.eval_formula(self.formula, variables)
 
@@ -148,3 +249,13 @@ class PricingValue(db.Model):
     def __unicode__(self):
         return unicode(self.value)
 
+
+def invalidate_pricing(sender, instance, **kwargs):
+    invalidate_pricing_cache()
+for model in (PricingGroup, PricingFormula, PricingVariable, PricingValue):
+    db.signals.post_save.connect(invalidate_pricing, sender=model)
+    db.signals.post_delete.connect(invalidate_pricing, sender=model)
+db.signals.m2m_changed.connect(
+    invalidate_pricing,
+    sender=PricingGroup.devices.through,
+)
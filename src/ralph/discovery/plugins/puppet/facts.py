@@ -249,7 +249,7 @@ def handle_facts_os(dev, facts, is_virtual=False):
                 except zlib.error:
                     pass
                 else:
-                    lshw = parse_lshw(as_string=lshw)
+                    lshw = parse_lshw(as_string=lshw, classes=('disk',))
                     mount_point, storages = get_storage_from_lshw(lshw, True)
                     storage_size = 0
                     for storage in storages:
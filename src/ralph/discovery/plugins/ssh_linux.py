@@ -6,6 +6,8 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import socket
+
 import paramiko
 
 from django.conf import settings
@@ -21,6 +23,20 @@ from ralph.discovery import guessmodel
 
 
 SAVE_PRIORITY=5
+# Run concurrently over one connection before the results are parsed.
+BATCHED_COMMANDS = (
+    "/sbin/ip addr show | /bin/grep 'link/ether'",
+    "/usr/bin/sudo /usr/sbin/dmidecode",
+    "multipath -l",
+    "pvs --noheadings --units M --separator '|'",
+    "lvs --noheadings --units M",
+    "/bin/uname -a",
+    "/bin/grep 'MemTotal:' '/proc/meminfo'",
+    "/bin/df -P -x tmpfs -x devtmpfs -x ecryptfs -x iso9660 -BM "
+    "| /bin/grep '^/'",
+    "/bin/grep '^processor' '/proc/cpuinfo'",
+    "/bin/hostname -f",
+)
 
 
 def get_ethernets(ssh):
@@ -137,6 +153,7 @@ def update_hostname(ssh, dev):
 
 
 def run_ssh_linux(ssh, ip):
+    ssh = network.BatchedSSH(ssh, BATCHED_COMMANDS)
     ethernets = get_ethernets(ssh)
     dev = run_dmidecode(ssh, ethernets)
     if dev:
@@ -167,7 +184,7 @@ def ssh_linux(**kwargs):
             if user is None or password is None:
                 continue
             try:
-                ssh = network.connect_ssh(ip, user, password)
+                ssh = network.SSH_POOL.connect(ip, user, password)
             except network.AuthError:
                 pass
             else:
@@ -175,7 +192,10 @@ def ssh_linux(**kwargs):
         else:
             return False, 'Authorization failed', kwargs
         name = run_ssh_linux(ssh, ip)
-    except (network.Error, paramiko.SSHException) as e:
+    except (network.Error, paramiko.SSHException, socket.error) as e:
         return False, str(e), kwargs
+    finally:
+        if ssh:
+            network.SSH_POOL.release(ssh)
     return True, name, kwargs
 
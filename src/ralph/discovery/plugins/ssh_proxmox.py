@@ -38,7 +38,7 @@ class NotProxmoxError(Error):
 
 
 def _connect_ssh(ip, username='root', password=''):
-    return network.connect_ssh(ip, 'root', settings.SSH_PASSWORD)
+    return network.SSH_POOL.connect(ip, 'root', settings.SSH_PASSWORD)
 
 
 def _get_local_disk_size(ssh, disk, parent, hypervisor_ip):
@@ -306,7 +306,7 @@ def run_ssh_proxmox(ip):
         member = _add_cluster_member(ssh, ip)
         _add_virtual_machines(ssh, member, master, ip)
     finally:
-        ssh.close()
+        network.SSH_POOL.release(ssh)
     return member.sn or member.name
 
 @plugin.register(chain='discovery', requires=['ping', 'http'])
@@ -33,7 +33,7 @@ class Error(Exception):
 
 
 def _connect_ssh(ip):
-    return network.connect_ssh(ip, XEN_USER, XEN_PASSWORD)
+    return network.SSH_POOL.connect(ip, XEN_USER, XEN_PASSWORD)
 
 
 def _ssh_lines(ssh, command):
@@ -159,7 +159,7 @@ def run_ssh_xen(ipaddr, parent):
         disks = get_disks(ssh)
         shares = hardware.get_disk_shares(ssh)
     finally:
-        ssh.close()
+        network.SSH_POOL.release(ssh)
 
     for dev in parent.child_set.exclude(
             sn__in=[vm_uuid for (vm_name, vm_uuid, vm_cores, vm_memory) in vms]
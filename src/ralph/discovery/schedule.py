@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+
+"""
+Adaptive scheduling of the rediscovery of known addresses.
+
+Instead of rediscovering every known address of every network each night,
+every address gets its own rediscovery interval. Addresses that are new or
+whose devices change often are rediscovered sooner, the ones that haven't
+changed for months or don't answer pings are backed off. A periodic job
+started with `start_scheduler` enqueues the addresses that are due, no more
+than the per-queue budget of jobs per hour allows.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import datetime
+
+from django.conf import settings
+from django.db.models import Count, Max, Q
+import django_rq
+
+from ralph.discovery.models import DiscoveryQueue, HistoryChange, IPAddress
+from ralph.discovery.tasks import discover_addresses
+
+
+DISCOVERY_INTERVAL = getattr(settings, 'DISCOVERY_INTERVAL', 86400)
+DISCOVERY_MIN_INTERVAL = getattr(settings, 'DISCOVERY_MIN_INTERVAL', 3600)
+DISCOVERY_MAX_INTERVAL = getattr(settings, 'DISCOVERY_MAX_INTERVAL', 2592000)
+DISCOVERY_HISTORY_DAYS = getattr(settings, 'DISCOVERY_HISTORY_DAYS', 90)
+DISCOVERY_JOBS_PER_HOUR = getattr(settings, 'DISCOVERY_JOBS_PER_HOUR', 1000)
+# overrides of `DISCOVERY_JOBS_PER_HOUR` for single queues
+DISCOVERY_QUEUE_JOBS_PER_HOUR = getattr(
+    settings, 'DISCOVERY_QUEUE_JOBS_PER_HOUR', {},
+)
+DISCOVERY_SCHEDULE_INTERVAL = getattr(
+    settings, 'DISCOVERY_SCHEDULE_INTERVAL', 600,
+)
+# every month without changes, or without being seen, doubles the interval
+QUIET_DAYS = 30
+
+
+def get_interval(ipaddress, changes, last_change, now):
+    """Returns the number of seconds after which `ipaddress` should be
+    rediscovered, given the number of `changes` of its device in the last
+    `DISCOVERY_HISTORY_DAYS` and the date of the `last_change`. Addresses
+    that don't answer pings or haven't been seen for months are backed off
+    first, whatever their history."""
+
+    unseen = now - (ipaddress.last_seen or now)
+    backoff = max(ipaddress.dead_ping_count, unseen.days // QUIET_DAYS)
+    if backoff:
+        interval = DISCOVERY_INTERVAL * 2 ** min(backoff, 8)
+    elif any((
+        ipaddress.created and
+        now - ipaddress.created < datetime.timedelta(days=1),
+        ipaddress.scan_summary_id and ipaddress.scan_summary.changed,
+    )):
+        interval = DISCOVERY_MIN_INTERVAL
+    else:
+        quiet = now - (last_change or ipaddress.created or now)
+        interval = (
+            DISCOVERY_INTERVAL * 2 ** min(quiet.days // QUIET_DAYS, 8) /
+            (1 + changes)
+        )
+    interval = min(interval, DISCOVERY_MAX_INTERVAL)
+    return int(max(interval, DISCOVERY_MIN_INTERVAL))
+
+
+def get_intervals(ipaddresses, now=None):
+    """Returns a dict mapping the ids of `ipaddresses` to their rediscovery
+    intervals. The history of all their devices is read at once."""
+
+    if now is None:
+        now = datetime.datetime.now()
+    device_ids = {ip.device_id for ip in ipaddresses if ip.device_id}
+    history = {}
+    if device_ids:
+        since = now - datetime.timedelta(days=DISCOVERY_HISTORY_DAYS)
+        for row in HistoryChange.objects.filter(
+            device_id__in=device_ids,
+            date__gte=since,
+        ).values('device_id').annotate(
+            changes=Count('id'),
+            last_change=Max('date'),
+        ):
+            history[row['device_id']] = row['changes'], row['last_change']
+    return {
+        ip.id: get_interval(ip, *history.get(ip.device_id, (0, None)), now=now)
+        for ip in ipaddresses
+    }
+
+
+def get_budget(queue_name):
+    """Returns how many addresses of the queue can be enqueued by a single
+    run of the scheduler."""
+
+    per_hour = DISCOVERY_QUEUE_JOBS_PER_HOUR.get(
+        queue_name, DISCOVERY_JOBS_PER_HOUR,
+    )
+    return max(1, int(per_hour * DISCOVERY_SCHEDULE_INTERVAL / 3600))
+
+
+def get_due_addresses(queue_name, limit, now=None):
+    """Returns up to `limit` addresses of the queue's networks that are due
+    for rediscovery: the never scheduled ones first, then the most
+    overdue."""
+
+    if now is None:
+        now = datetime.datetime.now()
+    addresses = IPAddress.objects.filter(
+        network__queue__name=queue_name,
+        is_buried=False,
+    ).select_related('scan_summary')
+    due = list(addresses.filter(next_discovery=None)[:limit])
+    if len(due) < limit:
+        due.extend(addresses.filter(
+            next_discovery__lte=now,
+        ).order_by('next_discovery')[:limit - len(due)])
+    return due
+
+
+def schedule_queue(queue_name, limit=None, now=None):
+    """Enqueues the discovery of the due addresses of the queue and sets
+    their next discovery dates. Returns the number of enqueued addresses."""
+
+    if now is None:
+        now = datetime.datetime.now()
+    if limit is None:
+        limit = get_budget(queue_name)
+    due = get_due_addresses(queue_name, limit, now)
+    # addresses with the same interval are updated together
+    by_interval = {}
+    for ip_id, interval in get_intervals(due, now).iteritems():
+        by_interval.setdefault(interval, []).append(ip_id)
+    for interval, ip_ids in by_interval.iteritems():
+        IPAddress.objects.filter(id__in=ip_ids).update(
+            next_discovery=now + datetime.timedelta(seconds=interval),
+        )
+    if due:
+        discover_addresses(
+            [ipaddress.address for ipaddress in due],
+            queue=queue_name,
+        )
+    return len(due)
+
+
+def schedule_discovery():
+    """The periodic job enqueueing the due addresses of all the queues."""
+
+    queues = DiscoveryQueue.objects.filter(
+        ~Q(name=''),
+        network__isnull=False,
+    ).distinct()
+    for queue in queues:
+        schedule_queue(queue.name)
+
+
+def start_scheduler():
+    """Registers `schedule_discovery` to be run by rq-scheduler every
+    `DISCOVERY_SCHEDULE_INTERVAL` seconds, replacing the previous
+    registration, if any."""
+
+    scheduler = django_rq.get_scheduler()
+    for job in scheduler.get_jobs():
+        if job.func_name == '{}.{}'.format(
+            schedule_discovery.__module__,
+            schedule_discovery.__name__,
+        ):
+            scheduler.cancel(job)
+    return scheduler.schedule(
+        scheduled_time=datetime.datetime.now(),
+        func=schedule_discovery,
+        interval=DISCOVERY_SCHEDULE_INTERVAL,
+    )
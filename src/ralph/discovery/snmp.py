@@ -6,37 +6,91 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import os
+import select
 import socket
+import threading
+import time
 
+from pyasn1.type import univ
+from pysnmp.carrier.asynsock.dispatch import AsynsockDispatcher
+from pysnmp.entity import engine
 from pysnmp.entity.rfc3413.oneliner import cmdgen
 from pysnmp.proto.rfc1902 import OctetString
 
 
+# the engine of a thread is replaced after that many requests, so that its
+# configuration tables don't grow forever
+SNMP_MAX_REQUESTS = 4096
+# how often the dispatcher checks for timeouts, in seconds
+SNMP_TIMER_RESOLUTION = 0.1
+SNMP_DISCOVERY_PACKET = (
+    b'0:\x02\x01\x030\x0f\x02\x02Ji\x02\x03\x00\xff\xe3\x04\x01'
+    b'\x04\x02\x01\x03\x04\x100\x0e\x04\x00\x02\x01\x00\x02\x01'
+    b'\x00\x04\x00\x04\x00\x04\x000\x12\x04\x00\x04\x00\xa0\x0c'
+    b'\x02\x027\xf0\x02\x01\x00\x02\x01\x000\x00'
+)
+
+_security_names = {}
+_security_names_lock = threading.Lock()
+
+
 def check_snmp_port(ip, port=161, timeout=1):
-    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    s.settimeout(timeout)
+    return check_snmp_ports([ip], port, timeout)[ip]
+
+
+def check_snmp_ports(ips, port=161, timeout=1):
+    """Sends the SNMP discovery packet to all the addresses at once and
+    returns a dict telling which of them replied within the timeout."""
+
+    results = dict.fromkeys(ips, False)
+    sockets = {}
     try:
-        s.connect((ip, port))
-        s.sendall(b'0:\x02\x01\x030\x0f\x02\x02Ji\x02\x03\x00\xff\xe3\x04\x01'\
-                  b'\x04\x02\x01\x03\x04\x100\x0e\x04\x00\x02\x01\x00\x02\x01'\
-                  b'\x00\x04\x00\x04\x00\x04\x000\x12\x04\x00\x04\x00\xa0\x0c'\
-                  b'\x02\x027\xf0\x02\x01\x00\x02\x01\x000\x00')
-        reply = s.recv(255)
-    except socket.error:
-        return False
+        for ip in results:
+            s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            s.setblocking(0)
+            sockets[s] = ip
+            try:
+                s.connect((ip, port))
+                s.send(SNMP_DISCOVERY_PACKET)
+            except socket.error:
+                del sockets[s]
+                s.close()
+        deadline = time.time() + timeout
+        waiting = set(sockets)
+        while waiting:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            readable, _, _ = select.select(list(waiting), [], [], remaining)
+            for s in readable:
+                waiting.discard(s)
+                try:
+                    results[sockets[s]] = bool(s.recv(255))
+                except socket.error:
+                    pass
     finally:
-        s.close()
-    return bool(reply)
+        for s in sockets:
+            s.close()
+    return results
+
+
+def _security_name(community):
+    # the engine tells the communities apart by their security names
+    with _security_names_lock:
+        if community not in _security_names:
+            _security_names[community] = 'ralph%d' % len(_security_names)
+        return _security_names[community]
 
 
 def user_data(auth, snmp_version):
     if snmp_version == '2c':
         community = auth
-        data = cmdgen.CommunityData('ralph', community, 1)
+        data = cmdgen.CommunityData(_security_name(community), community, 1)
     elif snmp_version in ('3', 3):
         # For snmpv3, auth is a tuple of user, password and encryption key
         snmp_v3_user, snmp_v3_auth, snmp_v3_priv = auth
-        data =  cmdgen.UsmUserData(
+        data = cmdgen.UsmUserData(
             snmp_v3_user,
             snmp_v3_auth,
             snmp_v3_priv,
@@ -45,32 +99,185 @@ def user_data(auth, snmp_version):
         )
     else:
         community = auth
-        data = cmdgen.CommunityData('ralph', community, 0)
+        data = cmdgen.CommunityData(_security_name(community), community, 0)
     return data
 
 
-def snmp_command(hostname, community, oid, snmp_version='2c', timeout=1, attempts=3):
-    transport = cmdgen.UdpTransportTarget((hostname, 161), attempts, timeout)
-    data = user_data(community, snmp_version)
-    gen = cmdgen.CommandGenerator()
-    error, status, index, vars = gen.getCmd(data, transport, oid)
-    if error:
-        return None
-    else:
-        return vars
+class _UdpTransportTarget(cmdgen.UdpTransportTarget):
+    """Targets are told apart also by their timeouts, so that requests with
+    different timeouts don't share the engine configuration."""
 
+    def _key(self):
+        return self.transportAddr, self.timeout, self.retries
 
-def snmp_bulk(hostname, community, oid, snmp_version='2c', timeout=1, attempts=3):
-    transport = cmdgen.UdpTransportTarget((hostname, 161), attempts, timeout)
-    data = user_data(community, snmp_version)
-    gen = cmdgen.CommandGenerator()
-    if snmp_version in ('2c', '3', 3):
-        error, status, index, vars = gen.bulkCmd(data, transport, 0, 25, oid)
-    else:
-        error, status, index, vars = gen.nextCmd(data, transport, oid)
-    if error:
-        return {}
-    return dict(i for i, in vars)
+    def __hash__(self):
+        return hash(self._key())
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, _UdpTransportTarget) and
+            self._key() == other._key()
+        )
+
+    def __ne__(self, other):
+        return not self == other
+
+
+class SNMPClient(object):
+    """Sends SNMP requests through one pysnmp engine per thread.
+
+    All the requests given in a single call are sent before waiting for any
+    of the replies, so asking many hosts, OIDs or communities takes about as
+    long as waiting for the slowest of them. Each request is a tuple of
+    `(hostname, auth, oids, snmp_version)`.
+    """
+
+    def __init__(self, max_requests=SNMP_MAX_REQUESTS):
+        self.max_requests = max_requests
+        self._local = threading.local()
+
+    def _generator(self, count):
+        local = self._local
+        if (
+            getattr(local, 'pid', None) != os.getpid() or
+            local.requests + count > self.max_requests
+        ):
+            dispatcher = AsynsockDispatcher()
+            dispatcher.setTimerResolution(SNMP_TIMER_RESOLUTION)
+            snmp_engine = engine.SnmpEngine()
+            snmp_engine.registerTransportDispatcher(dispatcher)
+            local.generator = cmdgen.AsynCommandGenerator(snmp_engine)
+            local.pid = os.getpid()
+            local.requests = 0
+        local.requests += count
+        return local.generator
+
+    def _dispatch(self, generator):
+        try:
+            generator.snmpEngine.transportDispatcher.runDispatcher(
+                SNMP_TIMER_RESOLUTION,
+            )
+        except Exception:
+            # the engine may have requests pending, don't use it again
+            self._local.pid = None
+            raise
+
+    def get_many(self, requests, timeout=1, attempts=3):
+        """Returns the var binds for each request, None for failed ones."""
+
+        requests = list(requests)
+        results = [None] * len(requests)
+        if not requests:
+            return results
+
+        def callback(handle, error, status, index, var_binds, i):
+            if not error:
+                results[i] = var_binds
+
+        generator = self._generator(len(requests))
+        for i, (hostname, auth, oids, snmp_version) in enumerate(requests):
+            generator.getCmd(
+                user_data(auth, snmp_version),
+                _UdpTransportTarget(
+                    (hostname, 161),
+                    timeout=timeout,
+                    retries=attempts,
+                ),
+                oids,
+                (callback, i),
+            )
+        self._dispatch(generator)
+        return results
+
+    def walk_many(self, requests, timeout=1, attempts=3):
+        """Returns a dict of the values under the given OIDs for each
+        request, empty for failed ones."""
+
+        requests = list(requests)
+        results = [{} for request in requests]
+        if not requests:
+            return results
+        tables = [[] for request in requests]
+
+        def callback(handle, error, status, index, var_bind_table, context):
+            i, heads, bulk = context
+            if error:
+                tables[i] = None
+                return
+            if status:
+                return
+            if bulk:
+                while (
+                    var_bind_table and
+                    len(var_bind_table[-1]) != len(heads)
+                ):
+                    # fix a possibly non-rectangular table
+                    del var_bind_table[-1]
+                tables[i].extend(var_bind_table)
+            last_row = var_bind_table[-1] if var_bind_table else []
+            for head, (name, value) in zip(heads, last_row):
+                if not isinstance(value, univ.Null) and head.isPrefixOf(name):
+                    break
+            else:
+                return
+            if not bulk:
+                tables[i].extend(var_bind_table)
+            return True  # continue the walk
+
+        generator = self._generator(len(requests))
+        for i, (hostname, auth, oids, snmp_version) in enumerate(requests):
+            data = user_data(auth, snmp_version)
+            transport = _UdpTransportTarget(
+                (hostname, 161),
+                timeout=timeout,
+                retries=attempts,
+            )
+            bulk = snmp_version in ('2c', '3', 3)
+            context = i, [univ.ObjectIdentifier(oid) for oid in oids], bulk
+            if bulk:
+                generator.bulkCmd(
+                    data, transport, 0, 25, oids, (callback, context),
+                )
+            else:
+                generator.nextCmd(data, transport, oids, (callback, context))
+        self._dispatch(generator)
+        for result, table in zip(results, tables):
+            for row in table or ():
+                result.update(row)
+        return results
+
+    def get(self, hostname, auth, oids, snmp_version='2c', timeout=1,
+            attempts=3):
+        return self.get_many(
+            [(hostname, auth, oids, snmp_version)],
+            timeout,
+            attempts,
+        )[0]
+
+    def walk(self, hostname, auth, oids, snmp_version='2c', timeout=1,
+             attempts=3):
+        return self.walk_many(
+            [(hostname, auth, oids, snmp_version)],
+            timeout,
+            attempts,
+        )[0]
+
+
+SNMP_CLIENT = SNMPClient()
+
+
+def snmp_command(hostname, community, oid, snmp_version='2c', timeout=1,
+                 attempts=3):
+    return SNMP_CLIENT.get(
+        hostname, community, [oid], snmp_version, timeout, attempts,
+    )
+
+
+def snmp_bulk(hostname, community, oid, snmp_version='2c', timeout=1,
+              attempts=3):
+    return SNMP_CLIENT.walk(
+        hostname, community, [oid], snmp_version, timeout, attempts,
+    )
 
 
 def snmp_macs(hostname, community, oid, snmp_version='2c', timeout=1, attempts=3):
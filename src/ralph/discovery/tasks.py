@@ -10,23 +10,51 @@ from __future__ import unicode_literals
 
 from datetime import datetime, timedelta
 from functools import partial
+from multiprocessing.pool import ThreadPool
 import random
 import re
+import sys
 import textwrap
 import traceback
 
 from django.conf import settings
 from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
+from django.db.models import Q
 import django_rq
 from ipaddr import IPv4Network, IPv6Network
+import rq
 
 from ralph.discovery.models import Network, IPAddress
-from ralph.util.network import ping
+from ralph.discovery.models_network import (
+    HOSTNAMES_IN_FLIGHT_KEY,
+    UNRESOLVED_HOSTNAMES_KEY,
+    enqueue_hostname_resolution,
+)
+from ralph.scan.metrics import (
+    Measurement,
+    get_network_name,
+    get_size,
+    record,
+)
+from ralph.scan.models import PluginRun
+from ralph.util.jobs import (
+    enqueue_many,
+    enqueue_once,
+    get_in_flight_key,
+    get_owned_keys,
+    release_keys,
+)
+from ralph.util.network import hostnames, ping
+from ralph.util.repricing import batched
 from ralph.util import output, plugin
 
 
 DNS_TXT_ATTRIBUTE_REGEX = re.compile(r'(?P<attribute>[^:]+): (?P<value>.*)')
+DISCOVERY_BATCH_SIZE = getattr(settings, 'DISCOVERY_BATCH_SIZE', 1)
+DISCOVERY_CHAINS = ('discovery', 'postprocess')
 MAX_RESTARTS = 3
+PLUGIN_WORKERS = settings.DISCOVERY_PLUGIN_WORKERS
 SANITY_CHECK_PING_ADDRESS = settings.SANITY_CHECK_PING_ADDRESS
 SINGLE_DISCOVERY_TIMEOUT = settings.SINGLE_DISCOVERY_TIMEOUT
 
@@ -123,6 +151,8 @@ def run_next_plugin(context, chains, requirements=None, interactive=False,
             run(context, chains[index:], plugin_name, requirements,
                 interactive, done_requirements, outputs)
             return
+    if not interactive:
+        _release_address(context)
 
 
 def run_chain(context, chain_name, requirements=None, interactive=False,
@@ -155,6 +185,8 @@ def run_plugin(context, chains, plugin_name,
     restarted = False
     if isinstance(chains, basestring):
         raise NotImplementedError("API changed.")
+    if not interactive:
+        _claim_address(context)
     chain = chains[0]
     try:
         _run_plugin(context, chain, plugin_name, requirements, interactive,
@@ -189,29 +221,100 @@ def _run_plugin(context, chain, plugin_name, requirements, interactive,
         stdout, stdout_verbose, stderr = outputs
     else:
         stdout = output.get(interactive)
-        stderr = output.get(interactive, err=True)
-
     message = "[{}] {}... ".format(plugin_name, _get_uid(context))
     stdout(message, end='')
-    new_context = {}
-    try:
-        is_up, message, new_context = plugin.run(chain, plugin_name,
-                                                 **context)
-    except plugin.Restart as e:
-        stdout('needs to be restarted: {}'.format(unicode(e)))
-        raise
-    except Exception:
-        stdout('', end='\r')
-        stderr(
-            "{}\nException in plugin '{}' for '{}'.".format(
-                traceback.format_exc(),
-                plugin_name,
-                _get_uid(context),
-            ),
-            end='\n',
-        )
-        raise
+    result = _execute_plugin(chain, plugin_name, context)
+    _handle_plugin_result(context, plugin_name, result, requirements,
+                          interactive, done_requirements, outputs)
+
+
+def _execute_plugin(chain, plugin_name, context, runs=None):
+    """Runs a single plugin and returns its outcome as a tuple of
+    `(is_up, message, new_context, exc_info)`. Never raises, so it's safe to
+    call from worker threads. The run is added to `runs`, to be recorded in
+    the plugin statistics together with the other runs of the job, or
+    recorded at once if not given."""
+
+    with Measurement() as measurement:
+        try:
+            # the devices changed by the plugin are repriced once
+            with batched():
+                is_up, message, new_context = plugin.run(chain, plugin_name,
+                                                         **context)
+        except Exception:
+            result = False, None, {}, sys.exc_info()
+        else:
+            result = is_up, message, new_context, None
+    run = _get_plugin_run(chain, plugin_name, context, result, measurement)
+    if runs is None:
+        _record_plugin_runs([run])
     else:
+        runs.append(run)
+    return result
+
+
+def _get_plugin_run(chain, plugin_name, context, result, measurement):
+    is_up, message, new_context, exc_info = result
+    if exc_info:
+        if isinstance(exc_info[1], plugin.Restart):
+            outcome = 'restart'
+        else:
+            outcome = 'exception'
+    else:
+        outcome = 'up' if is_up else 'down'
+    return PluginRun(
+        kind='discovery',
+        plugin=plugin_name,
+        chain=chain,
+        queue=context.get('queue', ''),
+        address=context.get('ip', ''),
+        started=measurement.started,
+        duration=measurement.duration,
+        outcome=outcome,
+        queries=measurement.queries,
+        size=None if exc_info else get_size(new_context),
+    )
+
+
+def _record_plugin_runs(runs):
+    """Records the plugin runs at once, looking up the network of every
+    address once."""
+
+    networks = {}
+    for run in runs:
+        if run.address and run.address not in networks:
+            networks[run.address] = get_network_name(run.address)
+        run.network = networks.get(run.address, '')
+    record(runs)
+
+
+def _handle_plugin_result(context, plugin_name, result, requirements,
+                          interactive, done_requirements, outputs=None):
+    """Reports the outcome of a plugin and updates the scheduling state.
+    Re-raises the exception the plugin failed with, if any."""
+
+    if outputs:
+        stdout, stdout_verbose, stderr = outputs
+    else:
+        stdout = output.get(interactive)
+        stderr = output.get(interactive, err=True)
+    is_up, message, new_context, exc_info = result
+    try:
+        if exc_info:
+            exc_type, e, tb = exc_info
+            if isinstance(e, plugin.Restart):
+                stdout('needs to be restarted: {}'.format(unicode(e)))
+            else:
+                stdout('', end='\r')
+                stderr(
+                    "{}\nException in plugin '{}' for '{}'.".format(
+                        ''.join(traceback.format_exception(*exc_info)),
+                        plugin_name,
+                        _get_uid(context),
+                    ),
+                    end='\n',
+                )
+            raise exc_type, e, tb
         if message:
             stdout(message, verbose=not is_up)
         if is_up:
@@ -222,6 +325,110 @@ def _run_plugin(context, chain, plugin_name, requirements, interactive,
         done_requirements.add(plugin_name)
 
 
+def _execute_plugin_in_thread(args):
+    chain, plugin_name, context, runs = args
+    try:
+        return _execute_plugin(chain, plugin_name, context, runs)
+    finally:
+        # every thread holds its own database connection
+        connection.close()
+
+
+def run_chains_concurrently(context, chains, requirements=None,
+                            interactive=False, done_requirements=None,
+                            restarts=MAX_RESTARTS, outputs=None, runs=None):
+    """Synchronously runs all the plugins from the specified `chains` using
+    a given `context` within a single task. Plugins that become runnable at
+    the same time don't depend on each other so they are run concurrently in
+    a pool of `DISCOVERY_PLUGIN_WORKERS` threads. Each of them gets a copy of
+    the context as it was before they started. The context updates are
+    applied in the order of plugin priorities, just as if the plugins were
+    run one by one.
+
+    Plugins that need to be restarted are rescheduled together with the rest
+    of the chain once everything that doesn't depend on them is done.
+
+    The plugin runs are recorded in the plugin statistics at the end, or
+    added to `runs` if given, for the caller to record.
+    """
+
+    if requirements is None:
+        requirements = set()
+    if done_requirements is None:
+        done_requirements = set()
+    if outputs:
+        stdout, stdout_verbose, stderr = outputs
+    else:
+        stdout = output.get(interactive)
+        stderr = output.get(interactive, err=True)
+    uid = _get_uid(context)
+    pool = None
+    first_exc_info = None
+    rescheduled = False
+    if not interactive:
+        _claim_address(context)
+    own_runs = runs is None
+    if own_runs:
+        runs = []
+    try:
+        for index, chain in enumerate(chains):
+            to_restart = set()
+            while True:
+                plugin_names = plugin.runnable(chain, requirements,
+                                               done_requirements)
+                if not plugin_names:
+                    break
+                args = [
+                    (chain, plugin_name, dict(context), runs)
+                    for plugin_name in plugin_names
+                ]
+                if len(args) > 1 and PLUGIN_WORKERS > 1:
+                    if pool is None:
+                        pool = ThreadPool(PLUGIN_WORKERS)
+                    results = pool.map(_execute_plugin_in_thread, args)
+                else:
+                    results = [_execute_plugin(*arg) for arg in args]
+                for plugin_name, result in zip(plugin_names, results):
+                    stdout("[{}] {}... ".format(plugin_name, uid), end='')
+                    try:
+                        _handle_plugin_result(context, plugin_name, result,
+                                              requirements, interactive,
+                                              done_requirements, outputs)
+                    except plugin.Restart:
+                        to_restart.add(plugin_name)
+                    except Exception:
+                        if not first_exc_info:
+                            first_exc_info = sys.exc_info()
+            if not to_restart:
+                continue
+            if restarts > 0:
+                done_requirements -= to_restart
+                after = timedelta(seconds=random.randint(30, 90))
+                run = _select_run_method(context, interactive,
+                                         run_chains_concurrently, after)
+                run(context, chains[index:], requirements, interactive,
+                    done_requirements, restarts=restarts - 1,
+                    outputs=outputs)
+                rescheduled = True
+                break
+            stderr(
+                "Exceeded allowed number of restarts in plugins '{}' for "
+                "'{}'.".format(', '.join(sorted(to_restart)), uid),
+                end='\n',
+            )
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        if own_runs:
+            _record_plugin_runs(runs)
+        # the rescheduled job releases the address when it's done
+        if not interactive and not rescheduled:
+            _release_address(context)
+    if first_exc_info:
+        raise first_exc_info[0], first_exc_info[1], first_exc_info[2]
+
+
 def _run_chain(context, chain_name, requirements=None, interactive=False,
                done_requirements=None, outputs=None):
     if requirements is None:
@@ -286,7 +493,36 @@ def _enqueue(queue, function, *args, **kwargs):
     )
 
 
+def resolve_hostnames(batch_size=256):
+    """Fills in the hostnames of the addresses queued by
+    `queue_hostname_resolution`, resolving them in parallel in batches."""
+
+    redis = django_rq.get_connection()
+    try:
+        while True:
+            addresses = redis.srandmember(UNRESOLVED_HOSTNAMES_KEY, batch_size)
+            if not addresses:
+                break
+            for address, name in hostnames(addresses).iteritems():
+                if name:
+                    IPAddress.objects.filter(
+                        Q(hostname=None) | Q(hostname=''),
+                        address=address,
+                    ).update(hostname=name)
+            # only removed when done, so that a failed job doesn't lose them
+            redis.srem(UNRESOLVED_HOSTNAMES_KEY, *addresses)
+    finally:
+        release_keys([HOSTNAMES_IN_FLIGHT_KEY])
+    # queued after the last batch, but before the key was released
+    if redis.scard(UNRESOLVED_HOSTNAMES_KEY):
+        enqueue_hostname_resolution()
+
+
 def discover_address(address, requirements=None, interactive=True, queue=None):
+    """Runs the remote discovery of `address`, asynchronously if
+    interactive=False is given. In that case returns the id of the job, or
+    of the one already discovering the address, if any."""
+
     if queue is None:
         try:
             net = Network.from_ip(address)
@@ -300,12 +536,145 @@ def discover_address(address, requirements=None, interactive=True, queue=None):
                 "The network {0} has no discovery queue.".format(net),
             )
         queue = net.queue.name
-    run_next_plugin(
-        {'ip': address, 'queue': queue},
-        ('discovery', 'postprocess'),
-        requirements=requirements,
-        interactive=interactive,
-    )
+    if not interactive:
+        call = _get_discovery_call(address, requirements or set(), queue)
+        if call is None:
+            return None
+        func, args, kwargs = call
+        job = enqueue_once(
+            django_rq.get_queue(queue),
+            _get_in_flight_key(address),
+            func,
+            args,
+            kwargs,
+            timeout=SINGLE_DISCOVERY_TIMEOUT,
+            result_ttl=0,
+        )
+        return job.id
+    context = {'ip': address, 'queue': queue}
+    chains = DISCOVERY_CHAINS
+    if PLUGIN_WORKERS > 1:
+        run_chains_concurrently(context, chains, requirements, interactive)
+    else:
+        run_next_plugin(
+            context,
+            chains,
+            requirements=requirements,
+            interactive=interactive,
+        )
+
+
+def _get_in_flight_key(address):
+    return get_in_flight_key('discovery', address, DISCOVERY_CHAINS)
+
+
+def _claim_address(context):
+    """Remembers the job that claimed the in-flight key of the address in
+    the `context`, which is handed over to the jobs running the next plugins
+    and the restarted ones. The first job of the discovery is the one that
+    claimed it."""
+
+    if 'in_flight_job_id' not in context:
+        job = rq.get_current_job()
+        if job is not None:
+            context['in_flight_job_id'] = job.id
+
+
+def _release_address(context):
+    """Releases the in-flight key of the address, once the last job of the
+    discovery is done."""
+
+    if 'ip' in context:
+        release_keys(
+            [_get_in_flight_key(context['ip'])],
+            job_id=context.get('in_flight_job_id'),
+        )
+
+
+def _get_discovery_call(address, requirements, queue):
+    """Returns the `(function, args, kwargs)` of the job that starts the
+    remote discovery of `address`, just as `discover_address` would enqueue
+    it, or None if there is nothing to run."""
+
+    context = {'ip': address, 'queue': queue}
+    chains = DISCOVERY_CHAINS
+    if PLUGIN_WORKERS > 1:
+        return run_chains_concurrently, (context, chains, requirements,
+                                         False), {}
+    for index, chain in enumerate(chains):
+        to_run = plugin.next(chain, requirements)
+        if to_run:
+            plugin_name = plugin.highest_priority(chain, to_run)
+            return run_plugin, (context, chains[index:], plugin_name,
+                                requirements, False, set(), None), {}
+    return None
+
+
+def discover_batch(addresses, requirements=None, queue=None):
+    """Discovers the `addresses` one after another within a single job.
+    Addresses that are being discovered by other jobs are skipped."""
+
+    stderr = output.get(False, err=True)
+    owned = set(get_owned_keys(
+        _get_in_flight_key(address) for address in addresses
+    ))
+    runs = []
+    try:
+        for address in addresses:
+            if _get_in_flight_key(address) not in owned:
+                continue
+            context = {'ip': address, 'queue': queue}
+            try:
+                run_chains_concurrently(context, DISCOVERY_CHAINS,
+                                        set(requirements or ()), runs=runs)
+            except Exception:
+                stderr(
+                    "{}\nDiscovery failed for '{}'.".format(
+                        traceback.format_exc(),
+                        address,
+                    ),
+                    end='\n',
+                )
+    finally:
+        _record_plugin_runs(runs)
+
+
+def discover_addresses(addresses, requirements=None, queue=None):
+    """Queues the remote discovery of all the `addresses` on the `queue`,
+    writing the jobs to Redis in pipelines. If `DISCOVERY_BATCH_SIZE` is
+    greater than 1, every job discovers that many addresses. Returns the
+    number of enqueued jobs. Addresses that are already being discovered
+    are skipped."""
+
+    if requirements is None:
+        requirements = set()
+    rq_queue = django_rq.get_queue(queue)
+    if DISCOVERY_BATCH_SIZE > 1:
+        addresses = list(addresses)
+        calls = (
+            (
+                discover_batch,
+                (addresses[i:i + DISCOVERY_BATCH_SIZE], requirements, queue),
+                {},
+                [
+                    _get_in_flight_key(address)
+                    for address in addresses[i:i + DISCOVERY_BATCH_SIZE]
+                ],
+            )
+            for i in xrange(0, len(addresses), DISCOVERY_BATCH_SIZE)
+        )
+        timeout = SINGLE_DISCOVERY_TIMEOUT * DISCOVERY_BATCH_SIZE
+    else:
+        calls = (
+            call + ([_get_in_flight_key(address)],)
+            for address, call in (
+                (address, _get_discovery_call(address, requirements, queue))
+                for address in addresses
+            ) if call
+        )
+        timeout = SINGLE_DISCOVERY_TIMEOUT
+    jobs = enqueue_many(rq_queue, calls, timeout=timeout, result_ttl=0)
+    return len(jobs)
 
 
 def discover_network(network, plugin_name='ping', requirements=None,
@@ -349,13 +718,17 @@ def discover_network(network, plugin_name='ping', requirements=None,
     queue_name = dbnet.queue.name
     stdout("Scanning network {} started.".format(net))
     if update_existing:
-        ip_address_queryset = IPAddress.objects.filter(
-            number__gt=int(net.ip), number__lt=int(net.broadcast))
-        hosts = (i.address for i in ip_address_queryset)
+        hosts = IPAddress.objects.filter(
+            number__gt=int(net.ip),
+            number__lt=int(net.broadcast),
+        ).values_list('address', flat=True)
+    else:
+        hosts = (unicode(host) for host in net.iterhosts())
+    if interactive:
+        for host in hosts:
+            discover_address(host, requirements, interactive, queue_name)
     else:
-        hosts = net.iterhosts()
-    for host in hosts:
-        discover_address(host, requirements, interactive, queue_name)
+        discover_addresses(hosts, requirements, queue_name)
     if interactive:
         stdout()
     else:
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from django.test import TestCase
+import mock
+import requests
+
+from ralph.discovery import http
+
+
+class HttpFamilyTest(TestCase):
+    def setUp(self):
+        http._cache.clear()
+        self.requests = []
+        self.responses = {}
+
+    def _request(self, method, url, **kwargs):
+        self.requests.append((method, url))
+        try:
+            headers, status_code, document = self.responses[method, url]
+        except KeyError:
+            raise requests.ConnectionError()
+        response = mock.Mock()
+        response.headers = headers
+        response.status_code = status_code
+        response.iter_content.return_value = [document]
+        return response
+
+    @mock.patch('ralph.discovery.http.get_session')
+    def test_headers_are_enough(self, get_session):
+        get_session.return_value.request.side_effect = self._request
+        self.responses['HEAD', 'http://127.0.0.1'] = (
+            {'Server': 'Sun-ILOM-Web-Server/1.0'}, 200, b'',
+        )
+        self.assertEqual(http.get_http_family('127.0.0.1'), 'Sun')
+        self.assertEqual(http.get_http_family('127.0.0.1'), 'Sun')
+        self.assertEqual(self.requests, [('HEAD', 'http://127.0.0.1')])
+
+    @mock.patch('ralph.discovery.http.get_session')
+    def test_document_is_fetched(self, get_session):
+        get_session.return_value.request.side_effect = self._request
+        self.responses['HEAD', 'https://127.0.0.1'] = (
+            {'Server': 'lighttpd'}, 200, b'',
+        )
+        self.responses['GET', 'https://127.0.0.1'] = (
+            {'Server': 'lighttpd'}, 200, b'<html><title>IMM</title></html>',
+        )
+        self.assertEqual(
+            http.get_http_families(['127.0.0.1', '127.0.0.2']),
+            {'127.0.0.1': 'IBM System X', '127.0.0.2': 'Unspecified'},
+        )
+        self.assertEqual(
+            http.get_http_info('127.0.0.1')[1],
+            '<html><title>IMM</title></html>',
+        )
+        self.assertEqual(
+            [r for r in self.requests if '127.0.0.1' in r[1]],
+            [
+                ('HEAD', 'http://127.0.0.1'),
+                ('HEAD', 'https://127.0.0.1'),
+                ('GET', 'http://127.0.0.1'),
+                ('GET', 'https://127.0.0.1'),
+            ],
+        )
@@ -7,13 +7,31 @@ from __future__ import unicode_literals
 
 import datetime
 
+from django.db import models as db
 from django.test import TestCase
 from django.contrib.auth.models import User
 from lck.django.tags.models import Tag, Taggable
 import mock
 
-from ralph.discovery.models import DeviceType, Device, UptimeSupport
-from ralph.discovery.models_history import HistoryChange
+from ralph.business.models import (
+    Venture,
+    VentureExtraCost,
+    VentureExtraCostType,
+)
+from ralph.discovery.models import (
+    DailyCost,
+    DataCenter,
+    Device,
+    DeviceType,
+    HistoryCost,
+    Network,
+    UptimeSupport,
+)
+from ralph.discovery.models_history import (
+    HistoryChange,
+    fill_daily_costs,
+    rebuild_daily_costs,
+)
 
 
 class ModelsTest(TestCase):
@@ -112,3 +130,167 @@ class TagUpdateTest(TestCase):
         last_mod = dev.modified
         dev = Device.objects.get(pk=dev.id)
         self.assertTrue(dev.modified > last_mod)
+
+
+class NetworkIndexTest(TestCase):
+    def setUp(self):
+        self.dc = DataCenter.objects.create(name='dc')
+        self.nets = {}
+        for name, address in (
+            ('big', '10.0.0.0/8'),
+            ('medium', '10.1.0.0/16'),
+            ('small', '10.1.1.0/24'),
+            ('other', '10.2.0.0/16'),
+            ('outside', '192.168.0.0/24'),
+        ):
+            self.nets[name] = Network.objects.create(
+                name=name,
+                address=address,
+                gateway=address.split('/')[0],
+                data_center=self.dc,
+            )
+
+    def test_from_ip(self):
+        with self.assertNumQueries(1):
+            Network.from_ip('10.1.1.5')
+        with self.assertNumQueries(0):
+            self.assertEqual(Network.from_ip('10.1.1.5').name, 'small')
+            self.assertEqual(Network.from_ip('10.1.2.5').name, 'medium')
+            self.assertEqual(Network.from_ip('10.2.2.5').name, 'other')
+            self.assertEqual(Network.from_ip('10.3.2.5').name, 'big')
+            self.assertEqual(Network.from_ip('192.168.0.1').name, 'outside')
+            with self.assertRaises(IndexError):
+                Network.from_ip('192.168.1.1')
+            with self.assertRaises(IndexError):
+                Network.from_ip('9.255.255.255')
+
+    def test_all_from_ip(self):
+        self.assertEqual(
+            [net.name for net in Network.all_from_ip('10.1.1.5')],
+            ['small', 'medium', 'big'],
+        )
+        self.assertEqual(
+            [net.name for net in Network.all_from_ip('10.1.5.5')],
+            ['medium', 'big'],
+        )
+
+    def test_invalidation(self):
+        Network.from_ip('10.1.1.5')
+        self.nets['small'].delete()
+        self.assertEqual(Network.from_ip('10.1.1.5').name, 'medium')
+        net = self.nets['other']
+        net.address = '10.1.1.0/25'
+        net.save()
+        self.assertEqual(Network.from_ip('10.1.1.5').name, 'other')
+
+
+class DailyCostTest(TestCase):
+    def setUp(self):
+        today = datetime.date.today()
+        self.start = today - datetime.timedelta(days=3)
+        self.end = today + datetime.timedelta(days=3)
+        self.venture = Venture(name='venture', symbol='venture')
+        self.venture.save()
+        self.other = Venture(name='other', symbol='other')
+        self.other.save()
+        self.devices = []
+        for i, model_type in enumerate((
+            DeviceType.rack_server,
+            DeviceType.virtual_server,
+            DeviceType.blade_server,
+        )):
+            dev = Device.create(
+                sn='device%d' % i,
+                model_type=model_type,
+                model_name='model%d' % i,
+            )
+            dev.venture = self.venture
+            dev.cached_cost = 304 * (i + 1)
+            dev.save()
+            # the history starts before the rollup
+            HistoryCost.objects.filter(device=dev).update(
+                start=self.start - datetime.timedelta(days=i),
+            )
+            self.devices.append(dev)
+        fill_daily_costs(self.start, self.end)
+
+    def get_costs(self):
+        return {
+            (
+                row['day'],
+                row['venture_id'],
+                row['device_type'],
+                row['extra_id'],
+                row['deleted'],
+            ): (
+                round(row['cost__sum'], 6),
+                row['spans__sum'],
+                row['cores__sum'],
+            )
+            for row in DailyCost.objects.values(
+                'day',
+                'venture_id',
+                'device_type',
+                'extra_id',
+                'deleted',
+            ).annotate(
+                db.Sum('cost'),
+                db.Sum('spans'),
+                db.Sum('cores'),
+            )
+            if round(row['cost__sum'], 6) or row['spans__sum']
+        }
+
+    def assert_up_to_date(self):
+        costs = self.get_costs()
+        rebuild_daily_costs(self.start, self.end)
+        self.assertEqual(costs, self.get_costs())
+
+    def test_fill(self):
+        costs = self.get_costs()
+        self.assertEqual(len(costs), 3 * 6)
+        self.assertEqual(
+            costs[
+                self.start,
+                self.venture.id,
+                DeviceType.virtual_server.id,
+                None,
+                False,
+            ],
+            (20, 1, 0),
+        )
+        # the days are only added once
+        fill_daily_costs(self.start, self.end)
+        self.assertEqual(costs, self.get_costs())
+
+    def test_writes_only_changed_days(self):
+        rack_server = self.devices[0]
+        rows = DailyCost.objects.count()
+        rack_server.cached_cost = 608
+        rack_server.save()
+        # the days before the change are left alone, the others updated
+        self.assertEqual(DailyCost.objects.count(), rows)
+        self.assert_up_to_date()
+
+    def test_changes(self):
+        rack_server, virtual_server, blade_server = self.devices
+        rack_server.cached_cost = 608
+        rack_server.save()
+        virtual_server.venture = self.other
+        virtual_server.save()
+        blade_server.deleted = True
+        blade_server.save()
+        self.assert_up_to_date()
+        virtual_server.model = rack_server.model
+        virtual_server.save()
+        blade_server.deleted = False
+        blade_server.save()
+        rack_server.delete()
+        extra_type = VentureExtraCostType(name='extra')
+        extra_type.save()
+        extra = VentureExtraCost(venture=self.venture, type=extra_type, cost=31)
+        extra.save()
+        self.assert_up_to_date()
+        extra.delete()
+        self.venture.delete()
+        self.assert_up_to_date()
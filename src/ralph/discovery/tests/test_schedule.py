@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import datetime
+
+from django.test import TestCase
+import mock
+
+from ralph.discovery.models import (
+    DataCenter,
+    Device,
+    DeviceType,
+    DiscoveryQueue,
+    HistoryChange,
+    IPAddress,
+    Network,
+)
+from ralph.discovery.schedule import (
+    DISCOVERY_INTERVAL,
+    DISCOVERY_MAX_INTERVAL,
+    DISCOVERY_MIN_INTERVAL,
+    get_intervals,
+    schedule_queue,
+)
+
+
+class ScheduleTest(TestCase):
+    def setUp(self):
+        self.now = datetime.datetime.now()
+        self.queue = DiscoveryQueue.objects.create(name='dc1')
+        Network.objects.create(
+            name='local',
+            address='127.0.0.0/24',
+            gateway='127.0.0.254',
+            data_center=DataCenter.objects.create(name='dc'),
+            queue=self.queue,
+        )
+        self.addresses = {}
+        for name, number in (
+            ('new', 1), ('stable', 2), ('changing', 3), ('dead', 4),
+        ):
+            device = Device.create(
+                sn='sn-{}'.format(name),
+                model_name='model',
+                model_type=DeviceType.unknown,
+            )
+            self.addresses[name], _ = IPAddress.concurrent_get_or_create(
+                address='127.0.0.{}'.format(number),
+            )
+            self.addresses[name].device = device
+            self.addresses[name].save()
+        HistoryChange.objects.all().delete()
+        IPAddress.objects.exclude(address='127.0.0.1').update(
+            created=self.now - datetime.timedelta(days=400),
+        )
+        IPAddress.objects.filter(address='127.0.0.4').update(
+            dead_ping_count=2,
+        )
+        for days in (1, 5, 10):
+            HistoryChange.objects.create(
+                device=self.addresses['changing'].device,
+                date=self.now - datetime.timedelta(days=days),
+                field_name='model',
+            )
+
+    def _intervals(self):
+        addresses = list(IPAddress.objects.all())
+        intervals = get_intervals(addresses, self.now)
+        return {ip.address: intervals[ip.id] for ip in addresses}
+
+    def test_get_intervals(self):
+        intervals = self._intervals()
+        self.assertEqual(intervals['127.0.0.1'], DISCOVERY_MIN_INTERVAL)
+        self.assertEqual(intervals['127.0.0.2'], DISCOVERY_MAX_INTERVAL)
+        self.assertEqual(intervals['127.0.0.3'], DISCOVERY_INTERVAL // 4)
+        self.assertEqual(intervals['127.0.0.4'], DISCOVERY_INTERVAL * 4)
+
+    def test_get_intervals_unseen(self):
+        IPAddress.objects.filter(address='127.0.0.3').update(
+            last_seen=self.now - datetime.timedelta(days=100),
+        )
+        intervals = self._intervals()
+        self.assertEqual(intervals['127.0.0.3'], DISCOVERY_INTERVAL * 8)
+        self.assertEqual(intervals['127.0.0.4'], DISCOVERY_INTERVAL * 4)
+
+    @mock.patch('ralph.discovery.schedule.discover_addresses')
+    def test_schedule_queue(self, discover_addresses):
+        self.assertEqual(schedule_queue('dc1', limit=3, now=self.now), 3)
+        self.assertEqual(len(discover_addresses.call_args[0][0]), 3)
+        self.assertEqual(
+            IPAddress.objects.filter(next_discovery=None).count(),
+            1,
+        )
+        self.assertEqual(schedule_queue('dc1', limit=3, now=self.now), 1)
+        self.assertEqual(len(discover_addresses.call_args[0][0]), 1)
+        # an hour later only the new address is due again
+        discover_addresses.reset_mock()
+        later = self.now + datetime.timedelta(seconds=DISCOVERY_MIN_INTERVAL)
+        self.assertEqual(schedule_queue('dc1', limit=3, now=later), 1)
+        discover_addresses.assert_called_once_with(['127.0.0.1'], queue='dc1')
+        self.assertEqual(schedule_queue('dc2', limit=3, now=later), 0)
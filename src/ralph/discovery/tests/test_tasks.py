@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from django.test import TestCase
+import mock
+
+from ralph.discovery import tasks
+from ralph.util import plugin
+
+
+CHAIN = 'test_concurrent'
+RUNS = []
+RESTARTS = []
+
+
+@plugin.register(chain=CHAIN)
+def root(**kwargs):
+    RUNS.append('root')
+    return True, 'up', {'root_seen': True}
+
+
+@plugin.register(chain=CHAIN, requires=['root'], priority=200)
+def first_probe(**kwargs):
+    RUNS.append('first_probe')
+    return True, 'found', {'family': 'first'}
+
+
+@plugin.register(chain=CHAIN, requires=['root'])
+def second_probe(**kwargs):
+    RUNS.append('second_probe')
+    return True, 'found', {'family': 'second'}
+
+
+@plugin.register(chain=CHAIN, requires=['root'], priority=50)
+def failing_probe(**kwargs):
+    RUNS.append('failing_probe')
+    return False, 'nothing here', {}
+
+
+@plugin.register(chain=CHAIN, requires=['failing_probe'])
+def never_run(**kwargs):
+    RUNS.append('never_run')
+    return True, '', {}
+
+
+@plugin.register(chain=CHAIN, requires=['first_probe', 'second_probe'])
+def restarting(**kwargs):
+    RUNS.append('restarting')
+    if not RESTARTS:
+        RESTARTS.append(kwargs['ip'])
+        raise plugin.Restart('try again')
+    return True, 'done', {}
+
+
+class RunChainsConcurrentlyTest(TestCase):
+    def setUp(self):
+        RUNS[:] = []
+        RESTARTS[:] = []
+
+    def _run(self, workers):
+        context = {'ip': '127.0.0.1'}
+        requirements = set()
+        with mock.patch('ralph.discovery.tasks.PLUGIN_WORKERS', workers):
+            tasks.run_chains_concurrently(
+                context,
+                (CHAIN,),
+                requirements,
+                interactive=True,
+                outputs=(lambda *a, **kw: None,) * 3,
+            )
+        return context, requirements
+
+    def test_dependencies(self):
+        for workers in (1, 4):
+            RUNS[:] = []
+            RESTARTS[:] = []
+            context, requirements = self._run(workers)
+            self.assertEqual(RUNS[0], 'root')
+            self.assertEqual(
+                set(RUNS[1:4]),
+                {'first_probe', 'second_probe', 'failing_probe'},
+            )
+            self.assertNotIn('never_run', RUNS)
+            self.assertEqual(RUNS[4:], ['restarting', 'restarting'])
+            self.assertEqual(
+                requirements,
+                {'root', 'first_probe', 'second_probe', 'restarting'},
+            )
+
+    def test_context_updates_in_priority_order(self):
+        context, requirements = self._run(4)
+        self.assertTrue(context['root_seen'])
+        # the lower priority plugin is applied last, like in serial runs
+        self.assertEqual(context['family'], 'second')
+        self.assertEqual(
+            context['successful_plugins'],
+            'first_probe, restarting, root, second_probe',
+        )
+
+
+class InFlightKeyTest(TestCase):
+    """Every plugin step and restart runs in a job of its own, the key
+    claimed by the first one is released by the last one."""
+
+    def setUp(self):
+        RUNS[:] = []
+        RESTARTS[:] = []
+        self.key = tasks._get_in_flight_key('127.0.0.1')
+        self.keys = {self.key: 'job-0'}
+        self.jobs = []
+        self.current_job = self._job()
+
+    def _job(self):
+        job = mock.Mock()
+        job.id = 'job-{}'.format(len(self.jobs))
+        job.connection.register_script.return_value.side_effect = (
+            self._release
+        )
+        self.jobs.append(job)
+        return job
+
+    def _release(self, keys, args):
+        for key in keys:
+            if self.keys.get(key) == args[0]:
+                del self.keys[key]
+
+    def _run_job(self, function, *args, **kwargs):
+        previous_job = self.current_job
+        self.current_job = self._job()
+        try:
+            function(*args, **kwargs)
+        finally:
+            self.current_job = previous_job
+
+    def _run(self, function, *args, **kwargs):
+        with mock.patch('rq.get_current_job', lambda: self.current_job):
+            with mock.patch('ralph.discovery.tasks.django_rq') as django_rq:
+                scheduler = django_rq.get_scheduler.return_value
+                scheduler.enqueue_in.side_effect = (
+                    lambda after, function, *args, **kwargs:
+                    self._run_job(function, *args, **kwargs)
+                )
+                with mock.patch(
+                    'ralph.discovery.tasks._enqueue',
+                    lambda queue, function, *args, **kwargs:
+                    self._run_job(function, *args, **kwargs),
+                ):
+                    function(*args, **kwargs)
+
+    @mock.patch('ralph.discovery.tasks.PLUGIN_WORKERS', 1)
+    def test_serial_chain(self):
+        # nothing to restart
+        RESTARTS.append('127.0.0.1')
+        self._run(
+            tasks.run_plugin,
+            {'ip': '127.0.0.1', 'queue': 'dc1'},
+            (CHAIN,),
+            'root',
+        )
+        self.assertIn('restarting', RUNS)
+        self.assertGreater(len(self.jobs), 2)
+        self.assertNotIn(self.key, self.keys)
+
+    @mock.patch('ralph.discovery.tasks.PLUGIN_WORKERS', 2)
+    def test_restarted_chain(self):
+        self._run(
+            tasks.run_chains_concurrently,
+            {'ip': '127.0.0.1', 'queue': 'dc1'},
+            (CHAIN,),
+        )
+        self.assertEqual(RUNS.count('restarting'), 2)
+        self.assertEqual(len(self.jobs), 2)
+        self.assertNotIn(self.key, self.keys)
+
+
+class DiscoverAddressesTest(TestCase):
+    def setUp(self):
+        self.calls = []
+
+    def _enqueue_many(self, queue, calls, **kwargs):
+        self.calls.extend(calls)
+        return self.calls
+
+    @mock.patch('ralph.discovery.tasks.DISCOVERY_CHAINS', (CHAIN,))
+    @mock.patch('ralph.discovery.tasks.PLUGIN_WORKERS', 1)
+    @mock.patch('ralph.discovery.tasks.django_rq')
+    @mock.patch('ralph.discovery.tasks.enqueue_many')
+    def test_discover_addresses(self, enqueue_many, django_rq):
+        enqueue_many.side_effect = self._enqueue_many
+        self.assertEqual(
+            tasks.discover_addresses(['127.0.0.1', '127.0.0.2'], queue='dc1'),
+            2,
+        )
+        django_rq.get_queue.assert_called_once_with('dc1')
+        self.assertEqual(self.calls[0], (
+            tasks.run_plugin,
+            ({'ip': '127.0.0.1', 'queue': 'dc1'}, (CHAIN,), 'root', set(),
+             False, set(), None),
+            {},
+            [tasks._get_in_flight_key('127.0.0.1')],
+        ))
+
+    @mock.patch('ralph.discovery.tasks.DISCOVERY_BATCH_SIZE', 2)
+    @mock.patch('ralph.discovery.tasks.django_rq')
+    @mock.patch('ralph.discovery.tasks.enqueue_many')
+    def test_discover_addresses_in_batches(self, enqueue_many, django_rq):
+        enqueue_many.side_effect = self._enqueue_many
+        addresses = ['127.0.0.1', '127.0.0.2', '127.0.0.3']
+        self.assertEqual(tasks.discover_addresses(addresses, queue='dc1'), 2)
+        self.assertEqual(
+            [(func, args[0]) for func, args, kwargs, keys in self.calls],
+            [
+                (tasks.discover_batch, ['127.0.0.1', '127.0.0.2']),
+                (tasks.discover_batch, ['127.0.0.3']),
+            ],
+        )
+
+    @mock.patch('ralph.discovery.tasks.PLUGIN_WORKERS', 2)
+    @mock.patch('ralph.discovery.tasks.django_rq')
+    @mock.patch('ralph.discovery.tasks.enqueue_once')
+    def test_discover_address_in_flight(self, enqueue_once, django_rq):
+        enqueue_once.return_value.id = 'job-in-flight'
+        self.assertEqual(
+            tasks.discover_address(
+                '127.0.0.1', interactive=False, queue='dc1',
+            ),
+            'job-in-flight',
+        )
+        queue, key, func, args, kwargs = enqueue_once.call_args[0]
+        self.assertEqual(key, tasks._get_in_flight_key('127.0.0.1'))
+        self.assertEqual(func, tasks.run_chains_concurrently)
+
+    @mock.patch('ralph.discovery.tasks.run_chains_concurrently')
+    @mock.patch('ralph.discovery.tasks.get_owned_keys')
+    def test_discover_batch_skips_addresses_in_flight(
+        self, get_owned_keys, run_chains_concurrently,
+    ):
+        get_owned_keys.side_effect = lambda keys: [
+            key for key in keys if '127.0.0.2' not in key
+        ]
+        tasks.discover_batch(['127.0.0.1', '127.0.0.2', '127.0.0.3'])
+        self.assertEqual(
+            [
+                args[0]['ip']
+                for args, kwargs in run_chains_concurrently.call_args_list
+            ],
+            ['127.0.0.1', '127.0.0.3'],
+        )
+
+
+class ResolveHostnamesTest(TestCase):
+    @mock.patch('ralph.discovery.tasks.enqueue_hostname_resolution')
+    @mock.patch('ralph.discovery.tasks.release_keys')
+    @mock.patch('ralph.discovery.tasks.hostnames')
+    @mock.patch('ralph.discovery.tasks.django_rq')
+    def test_failed_batch_is_kept(self, django_rq, hostnames, release_keys,
+                                  enqueue_hostname_resolution):
+        redis = django_rq.get_connection.return_value
+        redis.srandmember.return_value = ['127.0.0.1']
+        hostnames.side_effect = ValueError()
+        with self.assertRaises(ValueError):
+            tasks.resolve_hostnames()
+        self.assertFalse(redis.srem.called)
+        release_keys.assert_called_once_with([tasks.HOSTNAMES_IN_FLIGHT_KEY])
+        self.assertFalse(enqueue_hostname_resolution.called)
+
+    @mock.patch('ralph.discovery.tasks.enqueue_hostname_resolution')
+    @mock.patch('ralph.discovery.tasks.release_keys')
+    @mock.patch('ralph.discovery.tasks.hostnames')
+    @mock.patch('ralph.discovery.tasks.django_rq')
+    def test_resolved_batch_is_removed(self, django_rq, hostnames,
+                                       release_keys,
+                                       enqueue_hostname_resolution):
+        redis = django_rq.get_connection.return_value
+        redis.srandmember.side_effect = [['127.0.0.1', '127.0.0.2'], []]
+        redis.scard.return_value = 0
+        hostnames.return_value = {'127.0.0.1': 'localhost', '127.0.0.2': None}
+        tasks.resolve_hostnames()
+        redis.srem.assert_called_once_with(
+            tasks.UNRESOLVED_HOSTNAMES_KEY,
+            '127.0.0.1',
+            '127.0.0.2',
+        )
+        release_keys.assert_called_once_with([tasks.HOSTNAMES_IN_FLIGHT_KEY])
+        self.assertFalse(enqueue_hostname_resolution.called)
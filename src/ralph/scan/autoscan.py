@@ -14,13 +14,28 @@ from __future__ import unicode_literals
 import itertools
 import datetime
 
+from django.db import IntegrityError, models as db, transaction
 import django_rq
+import ipaddr
 
-from ralph.util.network import ping
-from ralph.discovery.http import get_http_family
-from ralph.discovery.models import IPAddress, Network
-from ralph.scan.snmp import get_snmp
+from ralph.util.network import ping_many
+from ralph.discovery.http import get_http_families
+from ralph.discovery.models import Device, IPAddress, Network
+from ralph.discovery.models_history import (
+    get_component_changes,
+    save_history_changes,
+)
+from ralph.discovery.models_network import queue_hostname_resolution
+from ralph.dnsedit.util import update_txt_records
+from ralph.scan.snmp import get_snmp_many
 from ralph.scan.errors import NoQueueError
+from ralph.util.jobs import (
+    enqueue_many,
+    enqueue_once,
+    get_in_flight_key,
+    get_owned_keys,
+    release_keys,
+)
 
 
 ADDRESS_GROUP_SIZE = 32
@@ -47,8 +62,13 @@ def autoscan_data_center(data_center):
         autoscan_network(network)
 
 
+def _get_in_flight_key(address):
+    return get_in_flight_key('autoscan', address)
+
+
 def autoscan_network(network):
-    """Queues a pre-scan of a whole network on the right worker."""
+    """Queues a pre-scan of a whole network on the right worker. Groups of
+    addresses that are all being pre-scanned already are skipped."""
 
     if not network.queue:
         raise NoQueueError(
@@ -56,22 +76,30 @@ def autoscan_network(network):
         )
     queue_name = network.queue.name
     queue = django_rq.get_queue(queue_name)
-    for group in _split_into_groups(
-            network.network.iterhosts(),
-            ADDRESS_GROUP_SIZE,
-        ):
-        queue.enqueue_call(
-            func=_autoscan_group,
-            args=(group,),
-            timeout=60,
-            result_ttl=0,
-        )
+    enqueue_many(
+        queue,
+        (
+            (
+                _autoscan_group,
+                (group,),
+                {},
+                [_get_in_flight_key(address) for address in group],
+            )
+            for group in _split_into_groups(
+                network.network.iterhosts(),
+                ADDRESS_GROUP_SIZE,
+            )
+        ),
+        timeout=60,
+        result_ttl=0,
+    )
     network.last_scan = datetime.datetime.now()
     network.save()
 
 
 def autoscan_address(address):
-    """Queues a scan of a single address on the right worker."""
+    """Queues a scan of a single address on the right worker. Returns the
+    id of the job, or of the one already pre-scanning the address."""
 
     try:
         network = Network.from_ip(address)
@@ -86,50 +114,182 @@ def autoscan_address(address):
         )
     queue_name = network.queue.name
     queue = django_rq.get_queue(queue_name)
-    queue.enqueue_call(
-        func=_autoscan_group,
-        args=([address],),
+    job = enqueue_once(
+        queue,
+        _get_in_flight_key(address),
+        _autoscan_group,
+        ([address],),
         timeout=60,
         result_ttl=0,
     )
+    return job.id
 
 
 def _autoscan_group(addresses):
-    """This is the function that actually gets queued during autoscanning."""
+    """This is the function that actually gets queued during autoscanning.
+    Addresses that are being pre-scanned by other jobs are skipped."""
 
-    for address in addresses:
-        _autoscan_address(address)
+    keys = get_owned_keys(_get_in_flight_key(address) for address in addresses)
+    owned = set(keys)
+    try:
+        _autoscan_addresses([
+            address for address in addresses
+            if _get_in_flight_key(address) in owned
+        ])
+    finally:
+        release_keys(keys)
 
 
-def _autoscan_address(address):
-    """Autoscans a single address on the worker."""
+def _autoscan_addresses(addresses):
+    """The whole group is pinged at once, only the live addresses are scanned
+    further and their HTTP families and SNMP communities are probed
+    together. All the known addresses of the group are read with a single
+    query and the results are written back in bulk."""
 
-    try:
-        ipaddress = IPAddress.objects.get(address=address)
-    except IPAddress.DoesNotExist:
-        ipaddress = None
-    if ipaddress and ipaddress.is_buried:
-        return
-    pinged = ping(address)
-    if pinged:
-        if not ipaddress:
-            ipaddress, created = IPAddress.objects.get_or_create(
-                address=address,
-            )
-        ipaddress.http_family = get_http_family(ipaddress.address)
-        (
-            ipaddress.snmp_name,
-            ipaddress.snmp_community,
-            ipaddress.snmp_version,
-        ) = get_snmp(ipaddress)
-        ipaddress.dead_ping_count = 0
-        ipaddress.save(update_last_seen=True)
-    else:
-        if ipaddress:
+    pinged = ping_many(addresses)
+    known = {
+        ipaddress.address: ipaddress
+        for ipaddress in IPAddress.objects.filter(
+            address__in=addresses,
+        ).select_related('device')
+    }
+    alive = []
+    dead = []
+    for address in addresses:
+        ipaddress = known.get(address)
+        if ipaddress and ipaddress.is_buried:
+            continue
+        if pinged[address]:
+            if not ipaddress:
+                ipaddress = IPAddress(address=address)
+            ipaddress.dead_ping_count = 0
+            alive.append(ipaddress)
+        elif ipaddress:
             ipaddress.http_family = None
             ipaddress.snmp_name = None
             ipaddress.snmp_community = None
             ipaddress.snmp_version = None
             ipaddress.dead_ping_count += 1
-            ipaddress.save(update_last_seen=False)
+            dead.append(ipaddress)
+    families = get_http_families([ipaddress.address for ipaddress in alive])
+    for ipaddress in alive:
+        ipaddress.http_family = families[ipaddress.address]
+    for ipaddress, snmp in zip(alive, get_snmp_many(alive)):
+        (
+            ipaddress.snmp_name,
+            ipaddress.snmp_community,
+            ipaddress.snmp_version,
+        ) = snmp
+    _save_addresses(alive, dead)
+
+
+def _find_network(address):
+    try:
+        return Network.from_ip(address)
+    except IndexError:
+        return None
+
+
+def _save_addresses(alive, dead):
+    """Writes the autoscan results back to the database, recording the
+    history of changes just like `IPAddress.save` would."""
+
+    now = datetime.datetime.now()
+    history = []
+    for ipaddress in alive + dead:
+        network = _find_network(ipaddress.address)
+        ipaddress.network = network
+        if network and network.ignore_addresses:
+            ipaddress.device = None
+        if ipaddress.id:
+            history.extend(get_component_changes(ipaddress))
+    for ipaddress in alive:
+        if not ipaddress.id:
+            continue
+        IPAddress.objects.filter(id=ipaddress.id).update(
+            http_family=ipaddress.http_family,
+            snmp_name=ipaddress.snmp_name,
+            snmp_community=ipaddress.snmp_community,
+            snmp_version=ipaddress.snmp_version,
+            dead_ping_count=0,
+            network=ipaddress.network,
+            device=ipaddress.device,
+            last_seen=now,
+            modified=now,
+            cache_version=db.F('cache_version') + 1,
+        )
+    for ipaddress in dead:
+        if {'network_id', 'device_id'} & set(ipaddress.dirty_fields):
+            IPAddress.objects.filter(id=ipaddress.id).update(
+                network=ipaddress.network,
+                device=ipaddress.device,
+            )
+    if dead:
+        IPAddress.objects.filter(
+            id__in=[ipaddress.id for ipaddress in dead],
+        ).update(
+            http_family=None,
+            snmp_name=None,
+            snmp_community=None,
+            snmp_version=None,
+            dead_ping_count=db.F('dead_ping_count') + 1,
+            modified=now,
+            cache_version=db.F('cache_version') + 1,
+        )
+    if history:
+        save_history_changes(history)
+    _update_txt_records(alive + dead)
+    unresolved = [
+        ipaddress.address for ipaddress in alive + dead
+        if ipaddress.id and not ipaddress.hostname
+    ]
+    if unresolved:
+        queue_hostname_resolution(unresolved)
+    new = [ipaddress for ipaddress in alive if not ipaddress.id]
+    if new:
+        _create_addresses(new, now)
+
+
+def _update_txt_records(addresses):
+    """Updates the DNS TXT records of the devices of the saved addresses,
+    the current and the previous ones, like the IPAddress post_save hook
+    does, but once per device."""
+
+    device_ids = set()
+    for ipaddress in addresses:
+        if not ipaddress.id:
+            continue
+        device_ids.add(ipaddress.device_id)
+        device_ids.add(ipaddress.dirty_fields.get('device_id'))
+    device_ids.discard(None)
+    if not device_ids:
+        return
+    for device in Device.objects.filter(id__in=device_ids):
+        update_txt_records(device)
 
+
+def _create_addresses(new, now):
+    """Inserts the newly found addresses with a single query. Falls back to
+    creating them one by one if any of them has been created concurrently.
+    Their hostnames are resolved later in the background."""
+
+    for ipaddress in new:
+        ipaddress.number = int(ipaddr.IPAddress(ipaddress.address))
+        ipaddress.last_seen = now
+    try:
+        with transaction.commit_on_success():
+            IPAddress.objects.bulk_create(new)
+    except IntegrityError:
+        # Some of the addresses were created in the meantime.
+        for ipaddress in new:
+            created_ipaddress, created = IPAddress.concurrent_get_or_create(
+                address=ipaddress.address,
+            )
+            created_ipaddress.http_family = ipaddress.http_family
+            created_ipaddress.snmp_name = ipaddress.snmp_name
+            created_ipaddress.snmp_community = ipaddress.snmp_community
+            created_ipaddress.snmp_version = ipaddress.snmp_version
+            created_ipaddress.dead_ping_count = 0
+            created_ipaddress.save(update_last_seen=True, defer_hostname=True)
+    else:
+        queue_hostname_resolution([ipaddress.address for ipaddress in new])
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+
+"""
+Statistics of the credentials (like SNMP communities) that worked before.
+
+The successes are counted per scope -- a network, an HTTP family or a device
+model -- so that new addresses try the credentials that worked for similar
+hosts first. The credentials that failed for an address a few times are
+skipped for a while. Everything is kept in the Django cache, shared by the
+workers, and the credentials themselves are only stored as hashes.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+
+from ralph.discovery.models import Network
+
+
+CREDENTIALS_TIMEOUT = getattr(settings, 'SCAN_CREDENTIALS_TIMEOUT', 604800)
+CREDENTIALS_NEGATIVE_TIMEOUT = getattr(
+    settings, 'SCAN_CREDENTIALS_NEGATIVE_TIMEOUT', 3600,
+)
+CREDENTIALS_MAX_FAILURES = getattr(
+    settings, 'SCAN_CREDENTIALS_MAX_FAILURES', 3,
+)
+
+
+def _hash(credential):
+    return hashlib.md5(repr(credential).encode('utf-8')).hexdigest()
+
+
+def _hits_key(kind, scope, credential_hash):
+    return 'ralph-credentials-hits-{}-{}-{}-{}'.format(
+        kind, scope[0], _hash(scope[1]), credential_hash,
+    )
+
+
+def _failure_key(kind, address, credential):
+    return 'ralph-credentials-failed-{}-{}-{}'.format(
+        kind, address, _hash(credential),
+    )
+
+
+def get_scopes(ipaddress):
+    """Returns the scopes of an IP address: its network, HTTP family and
+    device model, as far as they are known."""
+
+    scopes = []
+    network_id = ipaddress.network_id
+    if not network_id:
+        try:
+            network_id = Network.from_ip(ipaddress.address).id
+        except IndexError:
+            pass
+    if network_id:
+        scopes.append(('network', network_id))
+    if ipaddress.http_family:
+        scopes.append(('http_family', ipaddress.http_family))
+    if ipaddress.device_id and ipaddress.device.model_id:
+        scopes.append(('model', ipaddress.device.model_id))
+    return scopes
+
+
+class CredentialStats(object):
+    """Success and failure statistics of one `kind` of credentials."""
+
+    def __init__(self, kind):
+        self.kind = kind
+
+    def get_hits(self, scopes, credentials):
+        """Returns a dict of hit counts of the hashes of the `credentials`,
+        summed over the given scopes."""
+
+        keys = {
+            _hits_key(self.kind, scope, _hash(credential)): _hash(credential)
+            for scope in scopes
+            for credential in credentials
+        }
+        hits = {}
+        for key, count in cache.get_many(keys).iteritems():
+            hits[keys[key]] = hits.get(keys[key], 0) + count
+        return hits
+
+    def order(self, credentials, scopes, hits=None):
+        """Sorts the credentials so that the ones most successful in the
+        given scopes go first. Keeps the order of the equally good ones."""
+
+        if hits is None:
+            hits = self.get_hits(scopes, credentials)
+        return sorted(
+            credentials,
+            key=lambda credential: -hits.get(_hash(credential), 0),
+        )
+
+    def succeeded(self, credential, scopes):
+        credential_hash = _hash(credential)
+        for scope in scopes:
+            key = _hits_key(self.kind, scope, credential_hash)
+            if cache.add(key, 1, CREDENTIALS_TIMEOUT):
+                continue
+            try:
+                cache.incr(key)
+            except ValueError:
+                # expired in the meantime
+                cache.set(key, 1, CREDENTIALS_TIMEOUT)
+
+    def failed(self, failures):
+        """Counts the failures of the `(address, credential)` pairs that
+        didn't work. Concurrent updates may lose a failure, which only
+        delays skipping the credential."""
+
+        keys = [
+            _failure_key(self.kind, address, credential)
+            for address, credential in failures
+        ]
+        counts = cache.get_many(keys)
+        cache.set_many(
+            {key: counts.get(key, 0) + 1 for key in keys},
+            CREDENTIALS_NEGATIVE_TIMEOUT,
+        )
+
+    def get_failed(self, address, credentials):
+        """Returns the set of the credentials that recently failed for the
+        address at least `CREDENTIALS_MAX_FAILURES` times."""
+
+        keys = {
+            _failure_key(self.kind, address, credential): credential
+            for credential in credentials
+        }
+        return {
+            keys[key] for key, count in cache.get_many(keys).iteritems()
+            if count >= CREDENTIALS_MAX_FAILURES
+        }
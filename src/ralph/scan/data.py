@@ -10,8 +10,11 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
-from django.db import models as db
+from django.db import connections, models as db, router
+from django.db.models.fields import FieldDoesNotExist
+from django.db.models.deletion import Collector
 from django.conf import settings
+from lck.django.common.models import MACAddressField
 
 from ralph.discovery.models_component import (
     ComponentModel,
@@ -50,6 +53,10 @@ UNIQUE_FIELDS_FOR_MERGER = {
     'installed_software': [('device', 'path')],
 }
 SCAN_SAVE_PRIORITY = 100
+COMPONENT_MODEL_FIELDS = {
+    field.name for field in ComponentModel._meta.fields
+}
+LOOKUP_CHUNK_SIZE = 500
 
 
 def _update_addresses(device, address_data, is_management=False):
@@ -60,15 +67,21 @@ def _update_addresses(device, address_data, is_management=False):
     :param address_data: list of strings with the ip addresses
     :param is_management: whether to update management or system addresses
     """
+    existing = {
+        ipaddress.address: ipaddress
+        for ipaddress in IPAddress.objects.filter(address__in=address_data)
+    }
     ipaddress_ids = []
     for ip in address_data:
         try:
-            ipaddress = IPAddress.objects.get(address=ip)
-        except IPAddress.DoesNotExist:
+            ipaddress = existing[ip]
+        except KeyError:
             ipaddress = IPAddress(address=ip)
+            existing[ip] = ipaddress
         ipaddress.device = device
         ipaddress.is_management = is_management
-        ipaddress.save(update_last_seen=False)
+        if not ipaddress.id or ipaddress.significant_fields_updated:
+            ipaddress.save(update_last_seen=False)
         ipaddress_ids.append(ipaddress.id)
     # Disconnect the rest of addresses from this device
     for ipaddress in IPAddress.objects.filter(
@@ -84,6 +97,7 @@ def _get_or_create_model_for_component(
     component_data,
     field_map,
     forbidden_model_fields=set(),
+    cache=None,
 ):
     """
     For concrete component type try to save or reuse instance of
@@ -97,6 +111,8 @@ def _get_or_create_model_for_component(
     :param field_map: mapping from database fields to component_data keys
     :param forbidden_model_fields: If provided, model will be created
                                    without those fields
+    :param cache: If provided, a dict in which the models are remembered,
+                  so that components with the same model data reuse them
     """
     model_fields = {
         field: component_data[field_map[field]]
@@ -119,6 +135,13 @@ def _get_or_create_model_for_component(
             model_fields['family'] = path
     if 'family' in model_fields:
         model_fields['family'] = model_fields.get('family', '')[:128]
+    if cache is not None:
+        key = (model_type, tuple(sorted(
+            (field, value) for field, value in model_fields.iteritems()
+            if field in COMPONENT_MODEL_FIELDS
+        )))
+        if key in cache:
+            return cache[key]
     model, created = ComponentModel.create(
         model_type,
         SCAN_SAVE_PRIORITY,
@@ -129,9 +152,107 @@ def _get_or_create_model_for_component(
                 continue
             setattr(model, field, value)
         model.save(priority=SCAN_SAVE_PRIORITY)
+    if cache is not None:
+        cache[key] = model
     return model
 
 
+class _ComponentIndex(object):
+    """
+    Components of one type found by the values of their unique fields, the
+    way the database would find them. Call `update` after changing the
+    values of a component.
+    """
+
+    def __init__(self, Component, unique_fields):
+        self.Component = Component
+        self.index = dict((group, {}) for group in unique_fields)
+        self.keys = {}
+        # MySQL compares strings case-insensitively with its default
+        # collations, the other supported databases don't
+        self.ignore_case = connections[
+            router.db_for_read(Component)
+        ].vendor == 'mysql'
+
+    def _value(self, field, value):
+        model_field = self.Component._meta.get_field(field)
+        if model_field.rel:
+            return getattr(value, 'pk', value)
+        value = model_field.get_prep_value(value)
+        if self.ignore_case and isinstance(value, basestring):
+            value = value.lower()
+        return value
+
+    def find(self, group, fields):
+        key = tuple(self._value(field, fields[field]) for field in group)
+        return self.index[group].get(key)
+
+    def update(self, component):
+        old_keys = self.keys.get(id(component), {})
+        new_keys = {}
+        for group, index in self.index.iteritems():
+            values = [
+                getattr(
+                    component,
+                    self.Component._meta.get_field(field).attname,
+                ) for field in group
+            ]
+            if old_keys.get(group) is not None and \
+                    index.get(old_keys[group]) is component:
+                del index[old_keys[group]]
+            if None in values:
+                continue
+            key = tuple(
+                self._value(field, value)
+                for field, value in zip(group, values)
+            )
+            index[key] = component
+            new_keys[group] = key
+        self.keys[id(component)] = new_keys
+
+
+def _to_python(Component, field, value):
+    """Convert a value from the data to the type stored in the field, so that
+    unchanged values don't look changed."""
+
+    try:
+        model_field = Component._meta.get_field(field)
+    except FieldDoesNotExist:
+        return value
+    if model_field.rel:
+        return value
+    if isinstance(model_field, MACAddressField):
+        return model_field.normalize(value)
+    return model_field.to_python(value)
+
+
+def _get_existing_components(device, component_data, Component, field_map,
+                             unique_fields):
+    """
+    Fetch all the components of the device and all the components that
+    can be matched by the unique fields without the device.
+    """
+
+    components = {
+        component.id: component
+        for component in Component.objects.filter(device=device)
+    }
+    for group in unique_fields:
+        if 'device' in group:
+            continue
+        field = group[0]
+        values = list({
+            data[field_map[field]] for data in component_data
+            if data.get(field_map[field]) is not None
+        })
+        for i in xrange(0, len(values), LOOKUP_CHUNK_SIZE):
+            for component in Component.objects.filter(**{
+                '%s__in' % field: values[i:i + LOOKUP_CHUNK_SIZE],
+            }):
+                components.setdefault(component.id, component)
+    return components.values()
+
+
 def _update_component_data(
     device,
     component_data,
@@ -157,11 +278,23 @@ def _update_component_data(
                                    without those fields
     """
 
-    component_ids = []
     for index, data in enumerate(component_data):
-        model = None
         data['device'] = device
         data['index'] = index
+    existing = _get_existing_components(
+        device,
+        component_data,
+        Component,
+        field_map,
+        unique_fields,
+    )
+    components = _ComponentIndex(Component, unique_fields)
+    for component in existing:
+        components.update(component)
+    models = {}
+    component_ids = set()
+    for data in component_data:
+        model = None
         for group in unique_fields:
             # First try to find an existing component using unique fields
             fields = {
@@ -171,9 +304,8 @@ def _update_component_data(
             }
             if len(group) != len(fields):
                 continue
-            try:
-                component = Component.objects.get(**fields)
-            except Component.DoesNotExist:
+            component = components.find(group, fields)
+            if component is None:
                 continue
             break
         else:
@@ -191,6 +323,7 @@ def _update_component_data(
                         data,
                         field_map,
                         forbidden_model_fields,
+                        models,
                     )
                 if model is None:
                     raise ValueError('Unknown model')
@@ -200,7 +333,11 @@ def _update_component_data(
         # Fill the component with values from the data dict
         for field, key in field_map.iteritems():
             if key in data:
-                setattr(component, field, data[key])
+                setattr(
+                    component,
+                    field,
+                    _to_python(Component, field, data[key]),
+                )
         if model_type is not None and model is None:
             try:
                 model = _get_or_create_model_for_component(
@@ -208,21 +345,30 @@ def _update_component_data(
                     data,
                     field_map,
                     forbidden_model_fields,
+                    models,
                 )
             except AssertionError:
                 pass
             else:
                 if model:
                     component.model = model
-        component.save(priority=SCAN_SAVE_PRIORITY)
-        component_ids.append(component.id)
+        # Only save the real changes, so that history is written once
+        if not component.id or component.significant_fields_updated:
+            component.save(priority=SCAN_SAVE_PRIORITY)
+        components.update(component)
+        component_ids.add(component.id)
     # Delete the components that are no longer current
-    for component in Component.objects.filter(
-        device=device,
-    ).exclude(
-        id__in=component_ids,
-    ):
-        component.delete()
+    stale = [
+        component for component in existing
+        if component.device_id == device.id and
+        component.id not in component_ids
+    ]
+    if stale:
+        for component in stale:
+            component.device = device  # spare the history hooks a query
+        collector = Collector(using=router.db_for_write(Component))
+        collector.collect(stale)
+        collector.delete()
 
 
 def get_device_data(device):
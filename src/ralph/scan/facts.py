@@ -528,7 +528,7 @@ def handle_facts_os(facts, is_virtual=False):
                 pass
             else:
                 try:
-                    lshw = parse_lshw(lshw)
+                    lshw = parse_lshw(lshw, classes=('disk',))
                 except LshwError:
                     pass
                 else:
@@ -14,38 +14,20 @@ import re
 import jpath
 
 from lck.django.common.models import MACAddressField
-from lck.lang import Null, nullify
-from lck.xml import etree_to_dict
-import lck.xml.converters
-from lxml import etree as ET
 
 from ralph.discovery.models import (
     DISK_PRODUCT_BLACKLIST,
     DISK_VENDOR_BLACKLIST,
     DeviceType,
 )
+from ralph.discovery.lshw import LSHW_NODE_CLASSES, iterparse_lshw
 from ralph.scan.errors import Error
 from ralph.util import units, untangle
 
 
-TAG_TRANSLATION_PAIRS = set([
-    ('node', 'class'),
-    ('capability', 'id'),
-    ('setting', 'id'),
-    ('resource', 'type'),
-])
-TEXT_TRANSLATION_PAIRS = set([
-    ('setting', 'value'),
-])
 FC_CARD_PHYSICAL_ID_EXPRESSION = re.compile(r"([1-9][0-9]*)")
 
 
-def _nullify(value):
-    if value is not None:
-        raise ValueError
-    return Null
-
-
 def _get_logical_name(arg):
     l_name = arg['logicalname']
     if isinstance(l_name, list):
@@ -54,46 +36,11 @@ def _get_logical_name(arg):
         return l_name
 
 
-def parse_lshw(raw_data):
-    parser = ET.ETCompatXMLParser(recover=True)
-    response = ET.fromstring(raw_data, parser=parser)
-    if response.tag is None or response.tag.upper() != 'NODE':
+def parse_lshw(raw_data, classes=LSHW_NODE_CLASSES):
+    lshw = iterparse_lshw(raw_data, classes)
+    if lshw is None:
         raise Error('Lshw parse error.')
-    for element in response.findall('.//'):
-        for k in element.attrib.keys():
-            try:
-                v = element.attrib[k]
-            except UnicodeDecodeError:
-                continue   # value has bytes not possible to decode with UTF-8
-            if (element.tag, k) in TAG_TRANSLATION_PAIRS:
-                try:
-                    element.tag = v
-                except ValueError:
-                    pass
-                continue
-            if (element.tag, k) in TEXT_TRANSLATION_PAIRS:
-                element.text = v
-                continue
-            if k == 'units':
-                value = ET.Element(b'value')
-                value.text = element.text
-                element.text = ''
-                element.append(value)
-            child = ET.Element(k)
-            child.text = v
-            element.append(child)
-    return nullify(
-        etree_to_dict(
-            response,
-            _converters=[
-                _nullify,
-                int,
-                float,
-                lck.xml.converters._datetime,
-                lck.xml.converters._datetime_strip_tz,
-            ],
-        ),
-    )[1]
+    return lshw
 
 
 def handle_lshw(data, is_virtual):
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Shows how long the discovery and scan plugins take and how often they
+fail."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import textwrap
+
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from ralph.scan.metrics import (
+    GROUPS,
+    PLUGIN_METRICS_DAYS,
+    get_runs,
+    get_slowest,
+    get_stats,
+    prune,
+)
+
+
+class Command(BaseCommand):
+    """
+    Shows the statistics of the discovery and scan plugins from the last
+    days: the number of runs, the percentiles of their wall time, the error
+    rate, and the slowest hosts.
+    """
+
+    help = textwrap.dedent(__doc__).strip()
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '-k',
+            '--kind',
+            dest='kind',
+            default=None,
+            choices=['discovery', 'scan'],
+            help='Only show the discovery or the scan plugins.',
+        ),
+        make_option(
+            '-g',
+            '--group-by',
+            dest='group_by',
+            default='plugin',
+            choices=list(GROUPS),
+            help='Aggregate by plugin (default), chain, queue or network.',
+        ),
+        make_option(
+            '-d',
+            '--days',
+            dest='days',
+            type='int',
+            default=1,
+            help='Use the runs from that many last days (default 1).',
+        ),
+        make_option(
+            '-s',
+            '--slowest',
+            dest='slowest',
+            type='int',
+            default=10,
+            help='Show that many slowest runs (default 10).',
+        ),
+        make_option(
+            '--prune',
+            dest='prune',
+            action='store_true',
+            default=False,
+            help='Delete the runs older than PLUGIN_METRICS_DAYS (%d) '
+                 'instead.' % PLUGIN_METRICS_DAYS,
+        ),
+    )
+
+    def handle(self, *args, **kwargs):
+        if kwargs['prune']:
+            prune()
+            return
+        runs = get_runs(kwargs['days'], kwargs['kind'])
+        print('{:<32} {:>7} {:>8} {:>8} {:>8} {:>8} {:>7} {:>7} {:>9}'.format(
+            kwargs['group_by'], 'runs', 'p50', 'p90', 'p99', 'max',
+            'errors', 'timeout', 'total',
+        ))
+        for group in get_stats(runs, kwargs['group_by']):
+            print(
+                '{:<32} {:>7} {:>8.2f} {:>8.2f} {:>8.2f} {:>8.2f} {:>6.1f}% '
+                '{:>7} {:>9.0f}'.format(
+                    group['name'] or '-', group['count'], group['p50'],
+                    group['p90'], group['p99'], group['max'],
+                    group['error_rate'] * 100, group['timeouts'],
+                    group['total'],
+                ),
+            )
+        if kwargs['slowest']:
+            print()
+            print('Slowest runs:')
+            for run in get_slowest(runs, kwargs['slowest']):
+                print('{:>8.2f} {:<16} {:<32} {}'.format(
+                    run.duration, run.address, run.plugin, run.outcome,
+                ))
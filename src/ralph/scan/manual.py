@@ -17,70 +17,123 @@ import datetime
 import hashlib
 import json
 import logging
+import threading
+import time
+import Queue
 
 import django_rq
 import rq
 
 from django.conf import settings
+from django.db import connection
 from django.utils.importlib import import_module
 
 from ralph.discovery.models import IPAddress, Network
 from ralph.scan.errors import NoQueueError
-from ralph.scan.models import ScanSummary
+from ralph.scan.metrics import (
+    Measurement,
+    get_network_name,
+    get_size,
+    record,
+)
+from ralph.scan.models import PluginRun, ScanSummary
+from ralph.util.jobs import (
+    enqueue_many,
+    enqueue_once,
+    get_in_flight_key,
+    release_keys,
+)
 
 
 logger = logging.getLogger("SCAN")
 SCAN_LOG_DIRECTORY = getattr(settings, 'SCAN_LOG_DIRECTORY', None)
+PLUGIN_WORKERS = settings.SCAN_PLUGIN_WORKERS
+PLUGIN_TIMEOUT = settings.SCAN_PLUGIN_TIMEOUT
+META_SAVE_INTERVAL = 1 # seconds between the job.meta updates
+SCAN_JOB_TIMEOUT = 300
+SCAN_JOB_RESULT_TTL = 86400
+UNNECESSARY_KEYS = set(['status', 'date', 'messages'])
+
+
+def _get_network(ip_address):
+    try:
+        return Network.from_ip(ip_address.address)
+    except IndexError:
+        raise NoQueueError(
+            "Address {0} doesn't belong to any configured "
+            "network.".format(ip_address.address),
+        )
 
 
-def scan_address(ip_address, plugins, network=None):
-    """Queue scan on the specified address."""
-
-    if not network:
-        try:
-            network = Network.from_ip(ip_address.address)
-        except IndexError:
-            raise NoQueueError(
-                "Address {0} doesn't belong to any configured "
-                "network.".format(ip_address.address),
-            )
+def _get_queue_name(network):
     if not network.queue:
         raise NoQueueError(
             "The network {0} has no discovery queue.".format(network),
         )
-    queue = django_rq.get_queue(network.queue.name)
-    job = queue.enqueue_call(
-        func=scan_address_job,
-        args=(
-            ip_address,
-            plugins,
-        ),
-        kwargs={
-            'snmp_community': ip_address.snmp_community,
-            'snmp_version': ip_address.snmp_version,
-            'http_family': ip_address.http_family,
-            'snmp_name': ip_address.snmp_name,
-        },
-        timeout=300,
-        result_ttl=86400,
+    return network.queue.name
+
+
+def _get_in_flight_key(address, plugins):
+    return get_in_flight_key('scan', address, plugins or ())
+
+
+def _get_scan_call(ip_address, plugins):
+    """Returns the `(function, args, kwargs)` of the scan job of the
+    address."""
+
+    return scan_address_job, (ip_address, plugins), {
+        'snmp_community': ip_address.snmp_community,
+        'snmp_version': ip_address.snmp_version,
+        'http_family': ip_address.http_family,
+        'snmp_name': ip_address.snmp_name,
+    }
+
+
+def scan_address(ip_address, plugins, network=None):
+    """Queue scan on the specified address. If the address is already being
+    scanned with the same plugins, returns the job doing it instead."""
+
+    if not network:
+        network = _get_network(ip_address)
+    queue = django_rq.get_queue(_get_queue_name(network))
+    func, args, kwargs = _get_scan_call(ip_address, plugins)
+    job = enqueue_once(
+        queue,
+        _get_in_flight_key(ip_address.address, plugins),
+        func,
+        args,
+        kwargs,
+        timeout=SCAN_JOB_TIMEOUT,
+        result_ttl=SCAN_JOB_RESULT_TTL,
     )
     return job
 
 
 def scan_network(network, plugins):
-    """Queue scan of a entire network on the right worker."""
-
-    for address in network.network.iterhosts():
-        try:
-            # scan only exists and not dead IP addresses
-            ip_address = IPAddress.objects.get(
-                address=address,
-                dead_ping_count__lte=settings.DEAD_PING_COUNT,
+    """Queue scan of a entire network on the right worker. The addresses are
+    read with a single query and their jobs are sent to Redis in
+    pipelines. Addresses that are already being scanned with the same
+    plugins are skipped."""
+
+    queue = django_rq.get_queue(_get_queue_name(network))
+    net = network.network
+    # only existing and not dead IP addresses
+    ip_addresses = IPAddress.objects.filter(
+        number__gt=int(net.network),
+        number__lt=int(net.broadcast),
+        dead_ping_count__lte=settings.DEAD_PING_COUNT,
+    )
+    return enqueue_many(
+        queue,
+        (
+            _get_scan_call(ip_address, plugins) + (
+                [_get_in_flight_key(ip_address.address, plugins)],
             )
-        except IPAddress.DoesNotExist:
-            continue
-        else:
-            scan_address(ip_address, plugins, network)
+            for ip_address in ip_addresses.iterator()
+        ),
+        timeout=SCAN_JOB_TIMEOUT,
+        result_ttl=SCAN_JOB_RESULT_TTL,
+    )
 
 
 def scan_data_center(data_center, plugins):
@@ -90,49 +143,176 @@ def scan_data_center(data_center, plugins):
         scan_network(network, plugins)
 
 
+def _error_result(plugin_name, messages):
+    return {
+        'status': 'error',
+        'date': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'plugin': plugin_name.split(".")[-1],
+        'messages': messages,
+    }
+
+
+def _run_plugin(address, plugin_name, **kwargs):
+    """Returns a tuple of `(result, import_error)`."""
+
+    try:
+        module = import_module(plugin_name)
+    except ImportError as e:
+        return None, 'Failed to import: %s.' % e
+    try:
+        return module.scan_address(address, **kwargs), None
+    except Exception as e:
+        msg = "Exception occured in plugin {} and address {}".format(
+            plugin_name.split(".")[-1],
+            address,
+        )
+        logger.exception(msg)
+        return _error_result(plugin_name, [msg, unicode(e.message)]), None
+
+
+def _plugin_worker(address, tasks, events, kwargs):
+    try:
+        while True:
+            try:
+                plugin_name = tasks.get_nowait()
+            except Queue.Empty:
+                return
+            events.put(('started', plugin_name, None))
+            with Measurement() as measurement:
+                result = _run_plugin(address, plugin_name, **kwargs)
+            events.put(('finished', plugin_name, (result, measurement)))
+    finally:
+        # every thread holds its own database connection
+        connection.close()
+
+
+def _start_plugin_worker(address, tasks, events, kwargs):
+    thread = threading.Thread(
+        target=_plugin_worker,
+        args=(address, tasks, events, kwargs),
+    )
+    # a plugin that never returns must not keep the worker alive
+    thread.daemon = True
+    thread.start()
+
+
+def _finish_plugin(address, plugin_name, job, results, result, import_error):
+    if import_error:
+        job.meta['messages'].append(
+            (address, plugin_name, 'error', import_error),
+        )
+        job.meta['status'][plugin_name] = 'error'
+    else:
+        results[plugin_name] = result
+        for message in result.get('messages', []):
+            job.meta['messages'].append(
+                (address, plugin_name, 'warning', message),
+            )
+        job.meta['status'][plugin_name] = result.get('status', 'success')
+    job.meta['finished'].append(plugin_name)
+
+
+def _plugin_run(address, plugin_name, job, network, started, duration,
+                outcome, queries=None, size=None):
+    return PluginRun(
+        kind='scan',
+        plugin=plugin_name.split('.')[-1],
+        queue=getattr(job, 'origin', None) or '',
+        network=network,
+        address=address,
+        started=started,
+        duration=duration,
+        outcome=outcome,
+        queries=queries,
+        size=size,
+    )
+
+
 def _run_plugins(address, plugins, job, **kwargs):
+    """Runs the `plugins` concurrently in `SCAN_PLUGIN_WORKERS` threads. A
+    plugin that doesn't return within `SCAN_PLUGIN_TIMEOUT` seconds is
+    reported as failed and abandoned. Python threads can't be stopped, so
+    the abandoned plugin keeps running in the background until it returns,
+    and its result is ignored. The progress is collected in memory
+    and saved to `job.meta` at most every `META_SAVE_INTERVAL` seconds. The
+    time and outcome of every plugin are recorded in the plugin statistics
+    at the end."""
+
     results = {}
+    runs = []
+    network = get_network_name(address)
     job.meta['messages'] = []
     job.meta['finished'] = []
     job.meta['status'] = {}
+    job.save()
+    tasks = Queue.Queue()
+    events = Queue.Queue()
+    pending = set()
     for plugin_name in plugins:
-        message = "Running plugin %s." % plugin_name
-        job.meta['messages'].append((address, plugin_name, 'info', message))
-        job.save()
+        if plugin_name not in pending:
+            pending.add(plugin_name)
+            tasks.put(plugin_name)
+    for i in xrange(min(PLUGIN_WORKERS, len(pending))):
+        _start_plugin_worker(address, tasks, events, kwargs)
+    deadlines = {}
+    started = {}
+    saved = time.time()
+    changed = False
+    while pending:
+        wait = META_SAVE_INTERVAL if changed else PLUGIN_TIMEOUT
+        if deadlines:
+            wait = min(wait, min(deadlines.itervalues()) - time.time())
         try:
-            module = import_module(plugin_name)
-        except ImportError as e:
-            message = 'Failed to import: %s.' % e
-            job.meta['messages'].append(
-                (address, plugin_name, 'error', message),
-            )
-            job.meta['status'][plugin_name] = 'error'
+            event, plugin_name, value = events.get(timeout=max(wait, 0))
+        except Queue.Empty:
+            pass
         else:
-            try:
-                result = module.scan_address(address, **kwargs)
-            except Exception as e:
-                name = plugin_name.split(".")[-1]
-                msg = "Exception occured in plugin {} and address {}".format(
-                    name,
-                    address,
-                )
-                logger.exception(msg)
-                result = {
-                    'status': 'error',
-                    'date': datetime.datetime.now().strftime(
-                        '%Y-%m-%d %H:%M:%S',
-                    ),
-                    'plugin': name,
-                    'messages': [msg, unicode(e.message)],
-                }
-            results[plugin_name] = result
-            for message in result.get('messages', []):
-                job.meta['messages'].append(
-                    (address, plugin_name, 'warning', message),
-                )
-            job.meta['status'][plugin_name] = result.get('status', 'success')
-        job.meta['finished'].append(plugin_name)
-        job.save()
+            if plugin_name in pending:
+                changed = True
+                if event == 'started':
+                    deadlines[plugin_name] = time.time() + PLUGIN_TIMEOUT
+                    started[plugin_name] = datetime.datetime.now()
+                    job.meta['messages'].append((
+                        address, plugin_name, 'info',
+                        "Running plugin %s." % plugin_name,
+                    ))
+                else:
+                    (result, import_error), measurement = value
+                    _finish_plugin(address, plugin_name, job, results,
+                                   result, import_error)
+                    if import_error:
+                        outcome, size = 'error', None
+                    else:
+                        outcome = result.get('status', 'success')
+                        size = get_size(result)
+                    runs.append(_plugin_run(
+                        address, plugin_name, job, network,
+                        measurement.started, measurement.duration, outcome,
+                        measurement.queries, size,
+                    ))
+                    del deadlines[plugin_name]
+                    pending.remove(plugin_name)
+        now = time.time()
+        for plugin_name, deadline in deadlines.items():
+            if deadline > now:
+                continue
+            message = "Timed out after %g seconds." % PLUGIN_TIMEOUT
+            _finish_plugin(address, plugin_name, job, results,
+                           _error_result(plugin_name, [message]), None)
+            runs.append(_plugin_run(
+                address, plugin_name, job, network, started[plugin_name],
+                PLUGIN_TIMEOUT, 'timeout',
+            ))
+            del deadlines[plugin_name]
+            pending.remove(plugin_name)
+            changed = True
+            # the stuck thread is lost, replace it
+            _start_plugin_worker(address, tasks, events, kwargs)
+        if changed and (not pending or now - saved >= META_SAVE_INTERVAL):
+            job.save()
+            saved = now
+            changed = False
+    record(runs)
     return results
 
 
@@ -160,7 +340,6 @@ def _get_ip_addresses_from_results(results):
 
 
 def _get_cleaned_results(data):
-    UNNECESSARY_KEYS = set(['status', 'date', 'messages'])
     data = copy.deepcopy(data)
     for plugin_name, plugin_results in data.iteritems():
         for key in UNNECESSARY_KEYS:
@@ -172,6 +351,27 @@ def _get_results_checksum(data):
     return hashlib.md5(json.dumps(data, sort_keys=True)).hexdigest()
 
 
+def _get_fingerprints(results):
+    """
+    Returns a dict mapping every plugin to the checksums of the components
+    found by it.
+    """
+
+    fingerprints = {}
+    for plugin_name, plugin_results in results.iteritems():
+        components = {}
+        for key, value in plugin_results.iteritems():
+            if key in UNNECESSARY_KEYS:
+                continue
+            if key == 'device' and isinstance(value, dict):
+                for component, data in value.iteritems():
+                    components[component] = _get_results_checksum(data)
+            else:
+                components[key] = _get_results_checksum(value)
+        fingerprints[plugin_name] = components
+    return fingerprints
+
+
 def _scan_postprocessing(results, job, ip_address=None):
     """
     Postprocessing is an act of calculation checksums on scan results, and
@@ -187,6 +387,7 @@ def _scan_postprocessing(results, job, ip_address=None):
         job.meta['finished'] = []
         job.meta['status'] = {}
         job.save()
+    scanned_plugins = set(results)
     # get connected ip_address
     if not ip_address:
         ip_addresses = _get_ip_addresses_from_results(results)
@@ -232,11 +433,17 @@ def _scan_postprocessing(results, job, ip_address=None):
                 job.meta['status'][plugin_name] = plugin_results['status']
         job.save()
         results.update(updated_results)
-    # calculate new checksum
-    cleaned_results = _get_cleaned_results(results)
-    checksum = _get_results_checksum(cleaned_results)
+    # calculate new checksum from the stored fingerprints and the fresh ones
+    # of the plugins that have just run
+    fingerprints = scan_summary.get_fingerprints()
+    fingerprints.update(_get_fingerprints({
+        plugin_name: plugin_results
+        for plugin_name, plugin_results in results.iteritems()
+        if plugin_name in scanned_plugins or plugin_name not in fingerprints
+    }))
+    scan_summary.set_fingerprints(fingerprints)
+    checksum = _get_results_checksum(fingerprints)
     job.meta['results_checksum'] = checksum
-    job.save()
     # calculate new status
     if all((
         checksum != scan_summary.previous_checksum,
@@ -247,6 +454,14 @@ def _scan_postprocessing(results, job, ip_address=None):
         job.meta['changed'] = False
         scan_summary.false_positive_checksum = None
     job.save()
+    scan_summary.changed = job.meta['changed']
+    statuses = {
+        plugin_name: plugin_results.get('status')
+        for plugin_name, plugin_results in results.iteritems()
+    }
+    statuses.update(job.meta['status'])
+    scan_summary.set_statuses(statuses)
+    scan_summary.finished = datetime.datetime.now()
     scan_summary.save()
     ip_address.save()
     # cancel old job (if exists)
@@ -260,13 +475,19 @@ def scan_address_job(ip_address=None, plugins=None, results=None, **kwargs):
     """
 
     job = rq.get_current_job()
+    if ip_address:
+        key = _get_in_flight_key(ip_address.address, plugins)
     available_plugins = getattr(settings, 'SCAN_PLUGINS', {}).keys()
     if not plugins:
         plugins = available_plugins
     run_postprocessing = not (set(available_plugins) - set(plugins))
-    if ip_address and plugins:
-        results = _run_plugins(ip_address.address, plugins, job, **kwargs)
-    if run_postprocessing:
-        _scan_postprocessing(results, job, ip_address)
+    try:
+        if ip_address and plugins:
+            results = _run_plugins(ip_address.address, plugins, job, **kwargs)
+        if run_postprocessing:
+            _scan_postprocessing(results, job, ip_address)
+    finally:
+        if ip_address:
+            release_keys([key])
     return results
 
@@ -220,6 +220,72 @@ def _find_data(rows, lookup):
             return row
 
 
+def _text(value):
+    try:
+        return str(value)
+    except UnicodeError:
+        return unicode(value)
+
+
+class _RowIndex(object):
+    """
+    Rows indexed by the values of every group of unique fields. `find`
+    gives the same row as `_find_data` would for the lookup of a whole
+    group, without scanning all the rows. Call `update` after changing
+    a row.
+    """
+
+    def __init__(self, unique_fields):
+        self.rows = []
+        self.row_keys = []
+        self.index = dict((group, {}) for group in unique_fields)
+
+    def _key(self, row, group):
+        key = []
+        for field in group:
+            if field not in row:
+                return
+            value = _text(row[field])
+            if not value:
+                return
+            key.append(value.strip().lower())
+        return tuple(key)
+
+    def append(self, row):
+        self.rows.append(row)
+        self.row_keys.append({})
+        self.update(len(self.rows) - 1)
+
+    def update(self, position):
+        row = self.rows[position]
+        old_keys = self.row_keys[position]
+        new_keys = {}
+        for group, index in self.index.iteritems():
+            key = self._key(row, group)
+            old_key = old_keys.get(group)
+            if key != old_key:
+                if old_key is not None:
+                    index[old_key].discard(position)
+                    if not index[old_key]:
+                        del index[old_key]
+                if key is not None:
+                    index.setdefault(key, set()).add(position)
+            if key is not None:
+                new_keys[group] = key
+        self.row_keys[position] = new_keys
+
+    def find(self, group, row):
+        """
+        Returns the position of the first row matching the values of `group`
+        fields in `row` or None.
+        """
+
+        key = tuple(_text(row[field]).strip().lower() for field in group)
+        positions = self.index[group].get(key)
+        if positions:
+            return min(positions)
+
+
 def merge(
     component,
     data,
@@ -325,19 +391,17 @@ def merge(
     )  # rank it
     if db_plugin_name in data:
         ranked_plugins.append(db_plugin_name)  # add db plugin on the end
-    merged_data = []
+    merged_data = _RowIndex(unique_fields)
     for plugin in ranked_plugins:
         groups = usefull_data.get(plugin, {}).keys()  # get only usefull groups
                                                       # of unique fields for
                                                       # plugin
         for unique_group in groups:
             for new_row in usefull_data[plugin][unique_group]:
-                lookup = {}
-                for field in unique_group:
-                    lookup[field] = new_row[field]
                 # find previous version of this dict (row) by current lookup
-                current_row = _find_data(merged_data, lookup)
-                if current_row:
+                position = merged_data.find(unique_group, new_row)
+                if position is not None:
+                    current_row = merged_data.rows[position]
                     # now we should update it or complete values that are
                     # only in the database
                     if plugin == db_plugin_name:
@@ -346,25 +410,24 @@ def merge(
                                 current_row[field] = value
                     else:
                         current_row.update(new_row)
+                    merged_data.update(position)
                 else:
                     # in this case dict could be in merged_data - but current
                     # lookup can't find it - we must try other
                     # possible lookups
                     exists_in_results = False
                     for alternative_group in set(groups) - set([unique_group]):
-                        lookup = {}
-                        for field in alternative_group:
-                            try:
-                                lookup[field] = new_row[field]
-                            except KeyError:
-                                continue
-                        if len(lookup.keys()) == len(alternative_group):
-                            if _find_data(merged_data, lookup):
-                                # exists - ignore it...
-                                exists_in_results = True
-                                break
+                        if any(
+                            field not in new_row
+                            for field in alternative_group
+                        ):
+                            continue
+                        if merged_data.find(alternative_group, new_row) \
+                                is not None:
+                            # exists - ignore it...
+                            exists_in_results = True
+                            break
                     if not exists_in_results and plugin != db_plugin_name:
                         # we can add it
                         merged_data.append(new_row.copy())
-    return merged_data
-
+    return merged_data.rows
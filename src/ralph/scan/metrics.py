@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+
+"""
+Timing and outcome statistics of the discovery and scan plugins.
+
+Every plugin run is stored as a `PluginRun` record with its wall time, its
+outcome and the number of database queries it made. The records are then
+aggregated per plugin, chain, queue or network, so that it's easy to tell
+which plugins take the most time and fail the most often.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import datetime
+import json
+import logging
+import math
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+from ralph.discovery.models import Network
+from ralph.scan.models import PluginRun
+
+
+logger = logging.getLogger(__name__)
+PLUGIN_METRICS = getattr(settings, 'PLUGIN_METRICS', True)
+PLUGIN_METRICS_DAYS = getattr(settings, 'PLUGIN_METRICS_DAYS', 30)
+PRUNE_KEY = 'ralph-plugin-metrics-pruned'
+PRUNE_INTERVAL = 3600  # seconds
+GROUPS = ('plugin', 'chain', 'queue', 'network')
+# the outcomes that count as errors in the statistics
+ERROR_OUTCOMES = frozenset(['exception', 'error', 'timeout'])
+
+
+class _CountingCursor(object):
+    """Wraps a database cursor, counting the queries it executes."""
+
+    def __init__(self, cursor, measurement):
+        self.cursor = cursor
+        self.measurement = measurement
+
+    def execute(self, *args, **kwargs):
+        self.measurement.queries += 1
+        return self.cursor.execute(*args, **kwargs)
+
+    def executemany(self, *args, **kwargs):
+        self.measurement.queries += 1
+        return self.cursor.executemany(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+
+class Measurement(object):
+    """Measures the wall time and the database queries of a block of code
+    run in the current thread::
+
+        with Measurement() as measurement:
+            ...
+        measurement.duration, measurement.queries
+
+    The queries are counted by wrapping the cursors of the connection of the
+    thread, without logging them.
+    """
+
+    def __enter__(self):
+        self.started = datetime.datetime.now()
+        # the connection object is different in every thread
+        self._connection = connections[DEFAULT_DB_ALIAS]
+        self._cursor = self._connection.__dict__.get('cursor')
+        cursor = self._cursor or self._connection.cursor
+        self._connection.cursor = lambda: _CountingCursor(cursor(), self)
+        self._start = time.time()
+        self.duration = None
+        self.queries = 0
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.duration = time.time() - self._start
+        if self._cursor is None:
+            del self._connection.cursor
+        else:
+            self._connection.cursor = self._cursor
+
+
+def get_network_name(address):
+    try:
+        return Network.from_ip(address).name
+    except (IndexError, KeyError, ValueError):
+        return ''
+
+
+def get_size(result):
+    """Returns the size of the JSON representation of a plugin result."""
+
+    try:
+        return len(json.dumps(result, default=unicode))
+    except (TypeError, ValueError):
+        return None
+
+
+def record(runs):
+    """Saves the given unsaved `PluginRun` records and, at most once an hour,
+    deletes the ones older than `PLUGIN_METRICS_DAYS`. Never raises, a broken
+    statistics store must not stop the discovery."""
+
+    if not PLUGIN_METRICS or not runs:
+        return
+    try:
+        PluginRun.objects.bulk_create(runs)
+        if cache.add(PRUNE_KEY, True, PRUNE_INTERVAL):
+            prune()
+    except DatabaseError:
+        logger.exception("Couldn't save the plugin statistics.")
+
+
+def prune(days=PLUGIN_METRICS_DAYS):
+    """Deletes the records older than `days`."""
+
+    since = datetime.datetime.now() - datetime.timedelta(days=days)
+    PluginRun.objects.filter(started__lt=since).delete()
+
+
+def percentile(values, fraction):
+    """Returns the nearest-rank percentile of the sorted `values`."""
+
+    if not values:
+        return None
+    index = int(math.ceil(fraction * len(values))) - 1
+    return values[max(index, 0)]
+
+
+def get_runs(days=1, kind=None):
+    since = datetime.datetime.now() - datetime.timedelta(days=days)
+    runs = PluginRun.objects.filter(started__gte=since)
+    if kind:
+        runs = runs.filter(kind=kind)
+    return runs
+
+
+def get_stats(runs, group_by='plugin'):
+    """Aggregates the `runs` by one of `GROUPS`. Returns a list of dicts
+    sorted by the total time spent, the most expensive groups first."""
+
+    if group_by not in GROUPS:
+        raise ValueError("Can't group by {!r}.".format(group_by))
+    groups = {}
+    for name, duration, outcome, queries, size in runs.values_list(
+        group_by, 'duration', 'outcome', 'queries', 'size',
+    ).iterator():
+        group = groups.setdefault(name, {
+            'name': name,
+            'durations': [],
+            'outcomes': {},
+            'queries': 0,
+            'size': 0,
+        })
+        group['durations'].append(duration)
+        group['outcomes'][outcome] = group['outcomes'].get(outcome, 0) + 1
+        group['queries'] += queries or 0
+        group['size'] += size or 0
+    stats = []
+    for group in groups.itervalues():
+        durations = sorted(group.pop('durations'))
+        count = len(durations)
+        errors = sum(
+            n for outcome, n in group['outcomes'].iteritems()
+            if outcome in ERROR_OUTCOMES
+        )
+        group.update({
+            'count': count,
+            'total': sum(durations),
+            'p50': percentile(durations, 0.5),
+            'p90': percentile(durations, 0.9),
+            'p99': percentile(durations, 0.99),
+            'max': durations[-1],
+            'error_rate': errors / count,
+            'timeouts': group['outcomes'].get('timeout', 0),
+            'queries': group['queries'] / count,
+            'size': group['size'] / count,
+        })
+        stats.append(group)
+    stats.sort(key=lambda group: group['total'], reverse=True)
+    return stats
+
+
+def get_slowest(runs, limit=10):
+    """Returns the `limit` longest runs."""
+
+    return list(runs.order_by('-duration')[:limit])
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+import datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        # Adding field 'ScanSummary.changed'
+        db.add_column('scan_scansummary', 'changed',
+                      self.gf('django.db.models.fields.BooleanField')(default=False, db_index=True),
+                      keep_default=False)
+
+        # Adding field 'ScanSummary.statuses'
+        db.add_column('scan_scansummary', 'statuses',
+                      self.gf('django.db.models.fields.TextField')(default='', blank=True),
+                      keep_default=False)
+
+        # Adding field 'ScanSummary.finished'
+        db.add_column('scan_scansummary', 'finished',
+                      self.gf('django.db.models.fields.DateTimeField')(default=None, null=True, db_index=True, blank=True),
+                      keep_default=False)
+
+        # Adding index on 'ScanSummary', fields ['modified']
+        db.create_index('scan_scansummary', ['modified'])
+
+
+    def backwards(self, orm):
+        # Removing index on 'ScanSummary', fields ['modified']
+        db.delete_index('scan_scansummary', ['modified'])
+
+        # Deleting field 'ScanSummary.changed'
+        db.delete_column('scan_scansummary', 'changed')
+
+        # Deleting field 'ScanSummary.statuses'
+        db.delete_column('scan_scansummary', 'statuses')
+
+        # Deleting field 'ScanSummary.finished'
+        db.delete_column('scan_scansummary', 'finished')
+
+
+    models = {
+        'scan.scansummary': {
+            'Meta': {'object_name': 'ScanSummary'},
+            'changed': ('django.db.models.fields.BooleanField', [], {'default': 'False', 'db_index': 'True'}),
+            'created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'false_positive_checksum': ('django.db.models.fields.CharField', [], {'max_length': '32', 'null': 'True', 'blank': 'True'}),
+            'fingerprints': ('django.db.models.fields.TextField', [], {'default': "''", 'blank': 'True'}),
+            'finished': ('django.db.models.fields.DateTimeField', [], {'default': 'None', 'null': 'True', 'db_index': 'True', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'job_id': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '36'}),
+            'modified': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'auto_now_add': 'True', 'db_index': 'True', 'blank': 'True'}),
+            'previous_checksum': ('django.db.models.fields.CharField', [], {'max_length': '32'}),
+            'previous_fingerprints': ('django.db.models.fields.TextField', [], {'default': "''", 'blank': 'True'}),
+            'statuses': ('django.db.models.fields.TextField', [], {'default': "''", 'blank': 'True'})
+        }
+    }
+
+    complete_apps = ['scan']
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+import datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        # Adding model 'PluginRun'
+        db.create_table('scan_pluginrun', (
+            ('id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('kind', self.gf('django.db.models.fields.CharField')(max_length=16, db_index=True)),
+            ('plugin', self.gf('django.db.models.fields.CharField')(max_length=64, db_index=True)),
+            ('chain', self.gf('django.db.models.fields.CharField')(default=u'', max_length=64, blank=True)),
+            ('queue', self.gf('django.db.models.fields.CharField')(default=u'', max_length=64, blank=True)),
+            ('network', self.gf('django.db.models.fields.CharField')(default=u'', max_length=128, blank=True)),
+            ('address', self.gf('django.db.models.fields.CharField')(default=u'', max_length=64, blank=True)),
+            ('started', self.gf('django.db.models.fields.DateTimeField')(db_index=True)),
+            ('duration', self.gf('django.db.models.fields.FloatField')()),
+            ('outcome', self.gf('django.db.models.fields.CharField')(max_length=16)),
+            ('queries', self.gf('django.db.models.fields.PositiveIntegerField')(default=None, null=True, blank=True)),
+            ('size', self.gf('django.db.models.fields.PositiveIntegerField')(default=None, null=True, blank=True)),
+        ))
+        db.send_create_signal('scan', ['PluginRun'])
+
+
+    def backwards(self, orm):
+        # Deleting model 'PluginRun'
+        db.delete_table('scan_pluginrun')
+
+
+    models = {
+        'scan.pluginrun': {
+            'Meta': {'object_name': 'PluginRun'},
+            'address': ('django.db.models.fields.CharField', [], {'default': "u''", 'max_length': '64', 'blank': 'True'}),
+            'chain': ('django.db.models.fields.CharField', [], {'default': "u''", 'max_length': '64', 'blank': 'True'}),
+            'duration': ('django.db.models.fields.FloatField', [], {}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'kind': ('django.db.models.fields.CharField', [], {'max_length': '16', 'db_index': 'True'}),
+            'network': ('django.db.models.fields.CharField', [], {'default': "u''", 'max_length': '128', 'blank': 'True'}),
+            'outcome': ('django.db.models.fields.CharField', [], {'max_length': '16'}),
+            'plugin': ('django.db.models.fields.CharField', [], {'max_length': '64', 'db_index': 'True'}),
+            'queries': ('django.db.models.fields.PositiveIntegerField', [], {'default': 'None', 'null': 'True', 'blank': 'True'}),
+            'queue': ('django.db.models.fields.CharField', [], {'default': "u''", 'max_length': '64', 'blank': 'True'}),
+            'size': ('django.db.models.fields.PositiveIntegerField', [], {'default': 'None', 'null': 'True', 'blank': 'True'}),
+            'started': ('django.db.models.fields.DateTimeField', [], {'db_index': 'True'})
+        },
+        'scan.scansummary': {
+            'Meta': {'object_name': 'ScanSummary'},
+            'changed': ('django.db.models.fields.BooleanField', [], {'default': 'False', 'db_index': 'True'}),
+            'created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'false_positive_checksum': ('django.db.models.fields.CharField', [], {'max_length': '32', 'null': 'True', 'blank': 'True'}),
+            'fingerprints': ('django.db.models.fields.TextField', [], {'default': "u''", 'blank': 'True'}),
+            'finished': ('django.db.models.fields.DateTimeField', [], {'default': 'None', 'null': 'True', 'db_index': 'True', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'job_id': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '36'}),
+            'modified': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'auto_now_add': 'True', 'db_index': 'True', 'blank': 'True'}),
+            'previous_checksum': ('django.db.models.fields.CharField', [], {'max_length': '32'}),
+            'previous_fingerprints': ('django.db.models.fields.TextField', [], {'default': "u''", 'blank': 'True'}),
+            'statuses': ('django.db.models.fields.TextField', [], {'default': "u''", 'blank': 'True'})
+        }
+    }
+
+    complete_apps = ['scan']
\ No newline at end of file
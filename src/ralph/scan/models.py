@@ -6,6 +6,8 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import json
+
 from django.db import models as db
 from lck.django.common.models import WithConcurrentGetOrCreate
 
@@ -25,6 +27,83 @@ class ScanSummary(db.Model, WithConcurrentGetOrCreate):
         max_length=32,
         verbose_name="Ignored checksum",
     )
+    fingerprints = db.TextField(blank=True, default='')
+    previous_fingerprints = db.TextField(blank=True, default='')
+    changed = db.BooleanField(default=False, db_index=True)
+    statuses = db.TextField(blank=True, default='')
+    finished = db.DateTimeField(
+        blank=True,
+        null=True,
+        default=None,
+        db_index=True,
+    )
     created = db.DateTimeField(auto_now=False, auto_now_add=True)
-    modified = db.DateTimeField(auto_now=True, auto_now_add=True)
+    modified = db.DateTimeField(
+        auto_now=True,
+        auto_now_add=True,
+        db_index=True,
+    )
+
+    def get_fingerprints(self):
+        """
+        Returns the checksums of the latest scan results for every plugin and
+        every component found by it.
+        """
+
+        return json.loads(self.fingerprints or '{}')
+
+    def set_fingerprints(self, fingerprints):
+        self.fingerprints = json.dumps(fingerprints, sort_keys=True)
+
+    def get_statuses(self):
+        """
+        Returns the status of every plugin of the latest scan.
+        """
+
+        return json.loads(self.statuses or '{}')
 
+    def set_statuses(self, statuses):
+        self.statuses = json.dumps(statuses, sort_keys=True)
+
+    def get_changes(self):
+        """
+        Returns a sorted list of `(plugin, component)` pairs that changed
+        since the scan results were last saved.
+        """
+
+        previous = json.loads(self.previous_fingerprints or '{}')
+        changes = set()
+        for plugin, components in self.get_fingerprints().iteritems():
+            previous_components = previous.get(plugin, {})
+            for component in set(components) | set(previous_components):
+                if (
+                    components.get(component) !=
+                    previous_components.get(component)
+                ):
+                    changes.add((plugin, component))
+        return sorted(changes)
+
+
+class PluginRun(db.Model):
+    """
+    A single run of a discovery or scan plugin on an address: how long it
+    took, how it ended and how much work it did. These records feed the
+    plugin statistics.
+    """
+
+    kind = db.CharField(max_length=16, db_index=True)
+    plugin = db.CharField(max_length=64, db_index=True)
+    chain = db.CharField(max_length=64, blank=True, default='')
+    queue = db.CharField(max_length=64, blank=True, default='')
+    network = db.CharField(max_length=128, blank=True, default='')
+    address = db.CharField(max_length=64, blank=True, default='')
+    started = db.DateTimeField(db_index=True)
+    duration = db.FloatField()
+    outcome = db.CharField(max_length=16)
+    queries = db.PositiveIntegerField(blank=True, null=True, default=None)
+    size = db.PositiveIntegerField(
+        blank=True,
+        null=True,
+        default=None,
+        verbose_name="result size in bytes",
+    )
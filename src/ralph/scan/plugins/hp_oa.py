@@ -5,16 +5,15 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
-import httplib
 import lck.xml.converters
 
-from urllib2 import urlopen, URLError
-
 from lck.django.common.models import MACAddressField
 from lck.lang import Null, nullify
 from lck.xml import etree_to_dict
 from lxml import etree as ET
+import requests
 
+from ralph.discovery.http import get_session, get_timeout
 from ralph.discovery.models import DeviceType, SERIAL_BLACKLIST
 from ralph.scan.plugins import get_base_result_template
 from ralph.util import network
@@ -40,18 +39,16 @@ def _nullify(value):
 
 def _get_hp_xml_data(ip_address, timeout=10):
     try:
-        url = urlopen(
+        response = get_session().get(
             "https://{}/xmldata?item=all".format(ip_address),
-            timeout=timeout,
+            timeout=get_timeout(read_timeout=timeout),
         )
-        try:
-            data = url.read()
-        finally:
-            url.close()
-    except (URLError, httplib.InvalidURL, httplib.BadStatusLine) as e:
+        response.raise_for_status()
+        data = response.content
+    except requests.RequestException as e:
         raise IncompatibleAnswerError('Incompatible answer (%s).' % unicode(e))
     else:
-        if not url.info().get('Content-Type', '').startswith('text/xml'):
+        if not response.headers.get('Content-Type', '').startswith('text/xml'):
             raise IncompatibleAnswerError(
                 'Incompatible answer (improper content type).',
             )
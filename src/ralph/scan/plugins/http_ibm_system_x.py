@@ -5,12 +5,10 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
-import urllib2
-
 from django.conf import settings
 from xml.etree import cElementTree as ET
 
-from ralph.discovery.http import guess_family, get_http_info
+from ralph.discovery.http import get_http_family, get_session, get_timeout
 from ralph.discovery.models import DeviceType
 from ralph.scan.errors import (
     AuthError,
@@ -43,23 +41,26 @@ GENERIC_SOAP_TEMPLATE = '''\n
 
 
 def _send_soap(post_url, session_id, message):
-    opener = urllib2.build_opener()
-    request = urllib2.Request(
-        post_url, message,
+    response = get_session().post(
+        post_url,
+        data=message,
         headers={'session_id': session_id},
+        timeout=get_timeout(read_timeout=10),
     )
-    response = opener.open(request, timeout=10)
-    response_data = response.read()
-    return response_data
+    response.raise_for_status()
+    return response.content
 
 
 def _get_session_id(ip_address, user, password):
     login_url = "http://%s/session/create" % ip_address
     login_data = "%s,%s" % (user, password)
-    opener = urllib2.build_opener()
-    request = urllib2.Request(login_url, login_data)
-    response = opener.open(request, timeout=15)
-    response_data = response.readlines()
+    response = get_session().post(
+        login_url,
+        data=login_data,
+        timeout=get_timeout(read_timeout=15),
+    )
+    response.raise_for_status()
+    response_data = response.content.splitlines()
     if response_data and response_data[0][:2] == 'ok':
         return response_data[0][3:]
     raise AuthError('Session error.')
@@ -240,9 +241,7 @@ def scan_address(ip_address, **kwargs):
             'Not configured. Set IBM_SYSTEM_X_USER and IBM_SYSTEM_X_PASSWORD '
             'in your configuration file.',
         )
-    headers, document = get_http_info(ip_address)
-    family = guess_family(headers, document)
-    if family != 'IBM System X':
+    if get_http_family(ip_address) != 'IBM System X':
         raise NoMatchError('It is not IBM System X device.')
     result.update({
         'status': 'success',
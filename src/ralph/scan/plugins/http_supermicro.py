@@ -7,10 +7,11 @@ from __future__ import unicode_literals
 
 import json
 import re
-import urllib2
 
 from django.conf import settings
+import requests
 
+from ralph.discovery.http import get_session, get_timeout
 from ralph.scan.plugins import get_base_result_template
 
 
@@ -26,7 +27,7 @@ class Error(Exception):
 
 def _get_code(response, regexp):
     lines = []
-    for line in response.readlines():
+    for line in response.text.splitlines():
         line = line.strip()
         if not line or line.startswith('//'):
             continue
@@ -38,34 +39,47 @@ def _get_code(response, regexp):
     return m.group(1)
 
 
+def _request(url, **kwargs):
+    try:
+        response = get_session().request(
+            'POST' if 'data' in kwargs else 'GET',
+            url,
+            timeout=get_timeout(),
+            **kwargs
+        )
+        response.raise_for_status()
+    except requests.RequestException as e:
+        raise Error(unicode(e))
+    return response
+
+
 def _get_mac_addresses(ip_address, user, password):
-    opener = urllib2.build_opener()
-    request = urllib2.Request(
-        LOGIN_URL_TEMPLATE.format(ip_address=ip_address),
-        'WEBVAR_USERNAME={user}&WEBVAR_PASSWORD={password}'.format(
-            user=user,
-            password=password,
-        ),
-    )
     session = _get_code(
-        opener.open(request, timeout=5),
+        _request(
+            LOGIN_URL_TEMPLATE.format(ip_address=ip_address),
+            data='WEBVAR_USERNAME={user}&WEBVAR_PASSWORD={password}'.format(
+                user=user,
+                password=password,
+            ),
+            headers={'Content-Type': 'application/x-www-form-urlencoded'},
+        ),
         re.compile(r"'SESSION_COOKIE'\s*:\s*'([^']*)'"),
     )
-    request = urllib2.Request(
-        MAC_URL_TEMPLATE.format(ip_address=ip_address),
-        headers={'Cookie': 'SessionCookie=%s' % session},
-    )
+    # the shared session doesn't keep cookies
+    headers = {'Cookie': 'SessionCookie=%s' % session}
     json_data = _get_code(
-        opener.open(request, timeout=5),
+        _request(
+            MAC_URL_TEMPLATE.format(ip_address=ip_address),
+            headers=headers,
+        ),
         re.compile(r"WEBVAR_STRUCTNAME_GETMBMAC\s*:\s*\[({[^\}]*})"),
     ).replace("'", '"')
     macs = json.loads(json_data).values()
-    request = urllib2.Request(
-        MGMT_MAC_URL_TEMPLATE.format(ip_address=ip_address),
-        headers={'Cookie': 'SessionCookie=%s' % session},
-    )
     json_data = _get_code(
-        opener.open(request, timeout=5),
+        _request(
+            MGMT_MAC_URL_TEMPLATE.format(ip_address=ip_address),
+            headers=headers,
+        ),
         re.compile(r"WEBVAR_STRUCTNAME_HL_GETLANCONFIG\s*:\s*\[({[^\}]*})"),
     ).replace("'", '"')
     macs.append(json.loads(json_data)['MAC'])
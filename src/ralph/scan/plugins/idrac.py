@@ -8,11 +8,10 @@ from __future__ import unicode_literals
 import re
 import uuid
 
-import requests
-
 from django.conf import settings
 from xml.etree import cElementTree as ET
 
+from ralph.discovery.http import get_session, get_timeout
 from ralph.scan.plugins import get_base_result_template
 
 
@@ -58,13 +57,14 @@ class Error(Exception):
 def _send_soap(post_url, login, password, message):
     """Try to send soap message to post_url using http basic authentication.
     Note, that we don't store any session information, nor validate ssl
-    certificate. Any following requests will re-send basic auth header again.
+    certificate. Any following requests will re-send basic auth header again,
+    but they reuse the connection.
     """
-    r = requests.post(
+    r = get_session().post(
         post_url,
         data=message,
         auth=(login, password),
-        verify=False,
+        timeout=get_timeout(read_timeout=30),
         headers={
             'Content-Type': 'application/soap+xml;charset=UTF-8',
         },
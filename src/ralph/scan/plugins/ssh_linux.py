@@ -5,6 +5,8 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import socket
+
 import paramiko
 
 from django.conf import settings
@@ -16,6 +18,20 @@ from ralph.scan.errors import NoMatchError
 
 
 SETTINGS = settings.SCAN_PLUGINS.get(__name__, {})
+# Run concurrently over one connection before the results are parsed.
+BATCHED_COMMANDS = (
+    "/usr/bin/sudo /usr/sbin/dmidecode",
+    "/sbin/ip addr show | /bin/grep 'link/ether'",
+    "/bin/hostname -f",
+    "multipath -l",
+    "pvs --noheadings --units M --separator '|'",
+    "lvs --noheadings --units M",
+    "/bin/uname -a",
+    "/bin/grep 'MemTotal:' '/proc/meminfo'",
+    "/bin/df -P -x tmpfs -x devtmpfs -x ecryptfs -x iso9660 -BM "
+    "| /bin/grep '^/'",
+    "/bin/grep '^processor' '/proc/cpuinfo'",
+)
 
 
 def _parse_dmidecode(data):
@@ -158,6 +174,7 @@ def _get_disk_shares(ssh):
 
 
 def _ssh_linux(ssh, ip_address, messages=[]):
+    ssh = network.BatchedSSH(ssh, BATCHED_COMMANDS)
     device_info = _get_base_device_info(ssh)
     mac_addresses = _get_mac_addresses(ssh)
     if mac_addresses:
@@ -196,7 +213,7 @@ def scan_address(ip_address, **kwargs):
         if user is None or password is None:
             continue
         try:
-            ssh = network.connect_ssh(ip_address, user, password)
+            ssh = network.SSH_POOL.connect(ip_address, user, password)
         except network.AuthError:
             continue
         else:
@@ -207,7 +224,7 @@ def scan_address(ip_address, **kwargs):
         return result
     try:
         device_info = _ssh_linux(ssh, ip_address)
-    except (network.Error, paramiko.SSHException) as e:
+    except (network.Error, paramiko.SSHException, socket.error) as e:
         messages.append(unicode(e))
         result['status'] = 'error'
     else:
@@ -215,5 +232,7 @@ def scan_address(ip_address, **kwargs):
             'status': 'success',
             'device': device_info,
         })
+    finally:
+        network.SSH_POOL.release(ssh)
     return result
 
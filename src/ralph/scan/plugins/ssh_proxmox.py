@@ -28,7 +28,7 @@ logger = logging.getLogger("SCAN")
 def _connect_ssh(ip_address, user, password):
     if not network.check_tcp_port(ip_address, 22):
         raise ConnectionError('Port 22 closed on a Proxmox server.')
-    return network.connect_ssh(ip_address, user, password)
+    return network.SSH_POOL.connect(ip_address, user, password)
 
 
 def _get_master_ip_address(ssh, ip_address, cluster_cfg=None):
@@ -273,7 +273,7 @@ def _ssh_proxmox(ip_address, user, password):
         if subdevices:
             cluster_member['subdevices'] = subdevices
     finally:
-        ssh.close()
+        network.SSH_POOL.release(ssh)
     return cluster_member
 
 
@@ -22,7 +22,7 @@ XEN_USER, XEN_PASSWORD = SETTINGS['xen_user'], SETTINGS['xen_password']
 
 
 def _connect_ssh(ip):
-    return network.connect_ssh(ip, XEN_USER, XEN_PASSWORD)
+    return network.SSH_POOL.connect(ip, XEN_USER, XEN_PASSWORD)
 
 
 def _ssh_lines(ssh, command):
@@ -154,7 +154,7 @@ def run_ssh_xen(ipaddr):
         disks = get_disks(ssh)
         shares = hardware.get_disk_shares(ssh)
     finally:
-        ssh.close()
+        network.SSH_POOL.release(ssh)
     dev = {'subdevices': []}
     for vm_name, vm_uuid, vm_cores, vm_memory in vms:
         vm_device = {}
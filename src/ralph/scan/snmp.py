@@ -11,7 +11,8 @@ from __future__ import unicode_literals
 
 from django.conf import settings
 
-from ralph.discovery.snmp import snmp_command, check_snmp_port
+from ralph.discovery.snmp import SNMP_CLIENT, check_snmp_ports
+from ralph.scan.credentials import CredentialStats, get_scopes
 
 
 SNMP_COMMUNITIES = getattr(settings, 'SNMP_PLUGIN_COMMUNITIES', ['public'])
@@ -22,71 +23,161 @@ SNMP_V3_AUTH = (
 )
 if not all(SNMP_V3_AUTH):
     SNMP_V3_AUTH = None
+SNMP_CREDENTIALS = CredentialStats('snmp')
+
+SYS_DESCR_OID = (1, 3, 6, 1, 2, 1, 1, 1, 0)
+BLADE_CENTER_MANUFACTURING_ID_OID = (
+    1, 3, 6, 1, 4, 1, 2, 3, 51, 2, 2, 21, 1, 1, 5, 0,
+)
 
 
-def _snmp(ip, community, oid, attempts=2, timeout=3, snmp_version='2c'):
-    result = snmp_command(str(ip), community, oid, attempts=attempts,
-        timeout=timeout, snmp_version=snmp_version)
+def _message(result):
     if result is None:
-        message = None
-    else:
-        message = unicode(result[0][1])
-    return message
+        return None
+    return unicode(result[0][1])
 
 
 def get_snmp(ipaddress):
-    community = ipaddress.snmp_community
-    version = ipaddress.snmp_version or '2c'
-    oid =  (1, 3, 6, 1, 2, 1, 1, 1, 0) # sysDesc
-    http_family = ipaddress.http_family
-    message = None
-    # Windows hosts always say that the port is closed, even when it's open
-    if http_family not in ('Microsoft-IIS', 'Unspecified', 'RomPager'):
-        if not check_snmp_port(ipaddress.address):
-            return None, None, None
-    if http_family == 'HP':
-        version = '1'
-        oid = (1, 3, 6, 1, 4, 1, 2, 3, 51, 2 ,2 ,21, 1, 1, 5, 0)
-        # bladeCenterManufacturingId
-    if http_family == 'RomPager':
-        version = '1'
-    if version != '3':
-        # Don't try SNMP v2 if v3 worked on this host.
-        communities = list(SNMP_COMMUNITIES)
-        if community:
-            if community in communities:
-                communities.remove(community)
-            communities.insert(0, community)
-        for community in communities:
-            message = _snmp(
-                ipaddress.address,
-                community,
-                oid,
-                attempts=2,
+    return get_snmp_many([ipaddress])[0]
+
+
+def _probe_many(probes):
+    """Sends all the `(address, community, oid, version)` probes at once.
+    Returns a `(message, version)` tuple for each of them."""
+
+    results = [
+        (_message(result), version)
+        for (address, community, oid, version), result in zip(
+            probes,
+            SNMP_CLIENT.get_many(
+                (
+                    (address, community, [oid], version)
+                    for address, community, oid, version in probes
+                ),
                 timeout=0.2,
-                snmp_version=version,
-            )
-            if message == '' and version != '1':
-                # prevent empty response for some communities.
-                version = '1'
-                message = _snmp(
-                    ipaddress.address,
-                    community,
-                    oid,
-                    attempts=2,
-                    timeout=0.2,
-                    snmp_version=version,
+                attempts=2,
+            ),
+        )
+    ]
+    # prevent empty response for some communities.
+    retries = [
+        n for n, (message, version) in enumerate(results)
+        if message == '' and version != '1'
+    ]
+    for n, result in zip(retries, SNMP_CLIENT.get_many(
+        (
+            (probes[n][0], probes[n][1], [probes[n][2]], '1')
+            for n in retries
+        ),
+        timeout=0.2,
+        attempts=2,
+    )):
+        results[n] = _message(result), '1'
+    return results
+
+
+def get_snmp_many(ipaddresses):
+    """Finds the SNMP name, community and version of each of the addresses.
+
+    The SNMP ports are checked and the communities are probed for all the
+    addresses at once, so this takes about as long as for a single address.
+    The known community of every address, or the one that worked best for
+    similar hosts, is tried first. The other communities are only tried for
+    the addresses that didn't answer, skipping the ones that recently
+    failed. Returns a list of `(name, community, version)` tuples, in the
+    order of `ipaddresses`.
+    """
+
+    results = [(None, None, None)] * len(ipaddresses)
+    open_ports = check_snmp_ports([
+        ipaddress.address for ipaddress in ipaddresses
+        if ipaddress.http_family not in (
+            'Microsoft-IIS', 'Unspecified', 'RomPager',
+        )
+    ])
+    hosts = []
+    v3_probes = []
+    hits = {}
+    for i, ipaddress in enumerate(ipaddresses):
+        # Windows hosts always say that the port is closed, even when it's
+        # open
+        if not open_ports.get(ipaddress.address, True):
+            continue
+        version = ipaddress.snmp_version or '2c'
+        oid = SYS_DESCR_OID
+        if ipaddress.http_family == 'HP':
+            version = '1'
+            oid = BLADE_CENTER_MANUFACTURING_ID_OID
+        if ipaddress.http_family == 'RomPager':
+            version = '1'
+        if version == '3':
+            # Don't try SNMP v2 if v3 worked on this host.
+            if SNMP_V3_AUTH:
+                v3_probes.append(
+                    (i, ipaddress.address, ipaddress.snmp_community, oid),
                 )
-    if SNMP_V3_AUTH and version not in ('1', '2', '2c'):
-        version = '3'
-        message = _snmp(
+            continue
+        scopes = get_scopes(ipaddress)
+        key = tuple(scopes)
+        if key not in hits:
+            hits[key] = SNMP_CREDENTIALS.get_hits(scopes, SNMP_COMMUNITIES)
+        communities = SNMP_CREDENTIALS.order(
+            [
+                community for community in SNMP_COMMUNITIES
+                if community != ipaddress.snmp_community
+            ],
+            scopes,
+            hits[key],
+        )
+        if ipaddress.snmp_community:
+            communities.insert(0, ipaddress.snmp_community)
+        if not communities:
+            continue
+        failed = SNMP_CREDENTIALS.get_failed(
             ipaddress.address,
-            SNMP_V3_AUTH,
+            communities[1:],
+        )
+        hosts.append((
+            i,
+            ipaddress.address,
+            scopes,
             oid,
+            version,
+            [communities[0]] + [c for c in communities[1:] if c not in failed],
+        ))
+    # the first round probes the most likely community of every host, the
+    # second one all the others of the hosts that didn't answer
+    for first_round in (True, False):
+        probes = [
+            (i, scopes, (address, community, oid, version))
+            for i, address, scopes, oid, version, communities in hosts
+            if results[i][0] is None
+            for community in (
+                communities[:1] if first_round else communities[1:]
+            )
+        ]
+        answers = _probe_many([probe for i, scopes, probe in probes])
+        failures = []
+        for (i, scopes, probe), (message, version) in zip(probes, answers):
+            address, community = probe[:2]
+            if not message:
+                failures.append((address, community))
+            elif results[i][0] is None:
+                results[i] = message, community, version
+                SNMP_CREDENTIALS.succeeded(community, scopes)
+        SNMP_CREDENTIALS.failed(failures)
+    for (i, address, community, oid), result in zip(
+        v3_probes,
+        SNMP_CLIENT.get_many(
+            (
+                (address, SNMP_V3_AUTH, [oid], '3')
+                for i, address, community, oid in v3_probes
+            ),
+            timeout=0.5,  # SNMP v3 usually needs more time
             attempts=2,
-            timeout=0.5, # SNMP v3 usually needs more time
-            snmp_version=version,
-        )
-    if not message:
-        return None, None, None
-    return message, community, version
+        ),
+    ):
+        message = _message(result)
+        if message:
+            results[i] = message, community, '3'
+    return results
@@ -7,8 +7,15 @@ from __future__ import unicode_literals
 
 from django.test import TestCase
 from lck.lang import nullify
+import mock
+import requests
 
-from ralph.scan.plugins.hp_oa import _get_parent_device, _handle_subdevices
+from ralph.scan.plugins.hp_oa import (
+    IncompatibleAnswerError,
+    _get_hp_xml_data,
+    _get_parent_device,
+    _handle_subdevices,
+)
 from ralph.scan.tests.plugins.samples.hp_oa import HP_OA_SAMPLE
 
 
@@ -217,3 +224,19 @@ class HpOaPluginTest(TestCase):
             }
         )
 
+
+    @mock.patch('ralph.scan.plugins.hp_oa.get_session')
+    def test_get_hp_xml_data(self, get_session):
+        response = get_session.return_value.get.return_value
+        response.headers = {'Content-Type': 'text/xml'}
+        response.content = b'<RIMP><INFRA2><RACK>rack</RACK></INFRA2></RIMP>'
+        self.assertEqual(
+            _get_hp_xml_data('127.0.0.1'),
+            {'INFRA2': {'RACK': 'rack'}},
+        )
+        response.headers = {'Content-Type': 'text/html'}
+        with self.assertRaises(IncompatibleAnswerError):
+            _get_hp_xml_data('127.0.0.1')
+        response.raise_for_status.side_effect = requests.HTTPError('404')
+        with self.assertRaises(IncompatibleAnswerError):
+            _get_hp_xml_data('127.0.0.1')
@@ -5,7 +5,10 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import socket
+
 from django.test import TestCase
+import mock
 
 from ralph.discovery.tests.samples.dmidecode_data import DATA
 from ralph.discovery.tests.util import MockSSH
@@ -18,6 +21,7 @@ from ralph.scan.plugins.ssh_linux import (
     _get_os_visible_cores_count,
     _get_os_visible_memory,
     _get_os_visible_storage,
+    scan_address,
 )
 
 
@@ -207,3 +211,15 @@ class SshLinuxPluginTest(TestCase):
             ],
         )
 
+    @mock.patch('ralph.scan.plugins.ssh_linux._ssh_linux')
+    @mock.patch('ralph.scan.plugins.ssh_linux.network.SSH_POOL')
+    def test_scan_address_timeout(self, ssh_pool, _ssh_linux):
+        _ssh_linux.side_effect = socket.timeout('Timed out running uname.')
+        with mock.patch.dict(
+            'ralph.scan.plugins.ssh_linux.SETTINGS',
+            {'auths': [('root', 'secret')]},
+        ):
+            result = scan_address('127.0.0.1', snmp_name='Linux')
+        self.assertEqual(result['status'], 'error')
+        self.assertEqual(result['messages'], ['Timed out running uname.'])
+        self.assertTrue(ssh_pool.release.called)
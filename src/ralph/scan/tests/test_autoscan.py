@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from django.test import TestCase
+import mock
+
+from ralph.discovery.models import (
+    DataCenter,
+    Device,
+    DeviceType,
+    HistoryChange,
+    IPAddress,
+    Network,
+)
+from ralph.scan.autoscan import _autoscan_group
+
+
+class AutoscanTest(TestCase):
+    def setUp(self):
+        self.network = Network.objects.create(
+            name='local',
+            address='127.0.0.0/24',
+            gateway='127.0.0.254',
+            data_center=DataCenter.objects.create(name='dc'),
+        )
+        self.dead_ip, _ = IPAddress.concurrent_get_or_create(
+            address='127.0.0.3',
+        )
+        self.dead_ip.http_family = 'Apache'
+        self.dead_ip.save()
+        self.device = Device.create(
+            sn='device',
+            model_type=DeviceType.rack_server,
+            model_name='device',
+        )
+        # an address known without its hostname
+        IPAddress.objects.filter(id=self.dead_ip.id).update(
+            device=self.device,
+            hostname=None,
+        )
+
+    @mock.patch('ralph.scan.autoscan.update_txt_records')
+    @mock.patch('ralph.scan.autoscan.queue_hostname_resolution')
+    @mock.patch('ralph.scan.autoscan.get_snmp_many')
+    @mock.patch('ralph.scan.autoscan.get_http_families')
+    @mock.patch('ralph.scan.autoscan.ping_many')
+    def test_autoscan_group(self, ping_many, get_http_families, get_snmp_many,
+                            queue_hostname_resolution, update_txt_records):
+        ping_many.return_value = {
+            '127.0.0.1': 0.001,
+            '127.0.0.2': None,
+            '127.0.0.3': None,
+        }
+        get_http_families.return_value = {'127.0.0.1': 'Apache'}
+        get_snmp_many.return_value = [('snmp name', 'public', '2c')]
+        _autoscan_group(['127.0.0.1', '127.0.0.2', '127.0.0.3'])
+        ping_many.assert_called_once_with(
+            ['127.0.0.1', '127.0.0.2', '127.0.0.3'],
+        )
+        get_http_families.assert_called_once_with(['127.0.0.1'])
+        self.assertEqual(get_snmp_many.call_count, 1)
+        self.assertEqual(
+            [ip.address for ip in get_snmp_many.call_args[0][0]],
+            ['127.0.0.1'],
+        )
+        live_ip = IPAddress.objects.get(address='127.0.0.1')
+        self.assertEqual(live_ip.http_family, 'Apache')
+        self.assertEqual(live_ip.snmp_community, 'public')
+        self.assertEqual(live_ip.dead_ping_count, 0)
+        self.assertEqual(live_ip.hostname, None)
+        self.assertEqual(queue_hostname_resolution.call_args_list, [
+            mock.call(['127.0.0.3']),
+            mock.call(['127.0.0.1']),
+        ])
+        update_txt_records.assert_called_once_with(self.device)
+        self.assertEqual(live_ip.network, self.network)
+        self.assertFalse(
+            IPAddress.objects.filter(address='127.0.0.2').exists(),
+        )
+        dead_ip = IPAddress.objects.get(address='127.0.0.3')
+        self.assertEqual(dead_ip.http_family, None)
+        self.assertEqual(dead_ip.dead_ping_count, 1)
+        self.assertEqual(dead_ip.network, self.network)
+        self.assertEqual(dead_ip.device, self.device)
+        history = HistoryChange.objects.filter(component_id=dead_ip.id)
+        self.assertEqual(
+            history.get(field_name='dead_ping_count').new_value,
+            '1',
+        )
+        self.assertTrue(history.filter(
+            field_name='http_family',
+            old_value='Apache',
+            new_value='None',
+        ).exists())
@@ -5,9 +5,12 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+from django.db import connections
 from django.test import TestCase
+import mock
 
 from ralph.scan.data import (
+    _ComponentIndex,
     get_device_data,
     set_device_data,
     device_from_data,
@@ -24,6 +27,7 @@ from ralph.discovery.models import (
     Ethernet,
     FibreChannel,
     GenericComponent,
+    HistoryChange,
     IPAddress,
     Memory,
     Processor,
@@ -414,6 +418,42 @@ class SetDeviceDataTest(TestCase):
         self.assertEqual(memory[0].index, 0)
         self.assertEqual(len(memory), 2)
 
+    def test_unchanged_components(self):
+        data = {
+            'memory': [{'size': '128', 'label': 'DIMM %d' % i}
+                       for i in range(4)],
+            'mac_addresses': ['deadbeefcaf0', 'deadbeefcaf1'],
+            'system_ip_addresses': ['127.0.0.1'],
+        }
+        set_device_data(self.device, data)
+        memory_ids = set(self.device.memory_set.values_list('id', flat=True))
+        history = HistoryChange.objects.count()
+        set_device_data(self.device, data)
+        self.assertEqual(HistoryChange.objects.count(), history)
+        self.assertEqual(
+            set(self.device.memory_set.values_list('id', flat=True)),
+            memory_ids,
+        )
+        data['memory'].pop()
+        data['mac_addresses'] = ['DE:AD:BE:EF:CA:F1']
+        set_device_data(self.device, data)
+        self.assertEqual(self.device.memory_set.count(), 3)
+        self.assertEqual(
+            list(self.device.ethernet_set.values_list('mac', flat=True)),
+            ['DEADBEEFCAF1'],
+        )
+
+    def test_component_index_case(self):
+        memory = Memory(device=self.device, label='DIMM A', size=128)
+        index = _ComponentIndex(Memory, [('label',)])
+        index.update(memory)
+        self.assertIs(index.find(('label',), {'label': 'DIMM A'}), memory)
+        self.assertIsNone(index.find(('label',), {'label': 'dimm a'}))
+        with mock.patch.object(connections['default'], 'vendor', 'mysql'):
+            index = _ComponentIndex(Memory, [('label',)])
+        index.update(memory)
+        self.assertIs(index.find(('label',), {'label': 'dimm a'}), memory)
+
     def test_processors(self):
         data = {
             'processors': [
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from django.test import TestCase
+
+from ralph.discovery.tests.plugins.samples.puppet import facts_db_data
+from ralph.scan.lshw import (
+    Error,
+    handle_lshw,
+    handle_lshw_storage,
+    parse_lshw,
+)
+from ralph.util import uncompress_base64_data
+
+
+LSHW_DATA = uncompress_base64_data(facts_db_data['lshw'])
+
+
+class LshwTest(TestCase):
+    def test_handle_lshw(self):
+        self.assertEqual(handle_lshw(LSHW_DATA, False), {
+            'mac_addresses': ['5E61F39D3995'],
+            'model_name': 'Bochs',
+            'type': 'rack server',
+            'processors': [{
+                'index': 1,
+                'label': 'CPU 1',
+                'speed': 1907,
+                'family': 'QEMU Virtual CPU version 0.12.4',
+                'model_name': 'QEMU Virtual CPU version 0.12.4',
+            }],
+            'memory': [{'index': 1, 'label': 'DIMM 0', 'size': 1024}],
+        })
+
+    def test_parse_lshw_drops_unused_nodes(self):
+        lshw = parse_lshw(LSHW_DATA)
+        self.assertEqual(lshw['product'], 'Bochs')
+        self.assertIn('memory', lshw['bus'])
+        self.assertNotIn('display', lshw['bus']['bridge'])
+        self.assertNotIn('description', lshw['bus']['bridge'])
+        lshw = parse_lshw(LSHW_DATA, classes=('disk',))
+        self.assertNotIn('memory', lshw['bus'])
+        self.assertEqual(
+            handle_lshw_storage(lshw),
+            handle_lshw_storage(parse_lshw(LSHW_DATA)),
+        )
+
+    def test_parse_lshw_fibrechannel_cards(self):
+        fiber = (
+            '<node id="fiber" claimed="true" class="bus" '
+            'handle="PCI:0000:04:00.0">'
+            '<product>ISP2532</product><vendor>QLogic Corp.</vendor>'
+            '</node>'
+        )
+        data = LSHW_DATA.replace(
+            b'<node id="bridge" claimed="true"',
+            fiber.encode('utf-8') + b'<node id="bridge" claimed="true"',
+        )
+        self.assertEqual(handle_lshw(data, False)['fibrechannel_cards'], [{
+            'physical_id': '4',
+            'label': 'QLogic Corp. ISP2532',
+            'model_name': 'ISP2532',
+        }])
+
+    def test_parse_lshw_error(self):
+        with self.assertRaises(Error):
+            parse_lshw(b'<list><node/></list>')
@@ -10,6 +10,7 @@ import mock
 from django.test import TestCase
 
 from ralph.scan.merger import (
+    _RowIndex,
     _find_data,
     _get_ranked_plugins_list,
     _get_results_priority,
@@ -87,6 +88,21 @@ class UtilsTest(TestCase):
             {'key_1': 'val_1_1', 'key_2': 'val_2', 'key_3': 'val_3_1'},
         )
 
+    def test_row_index(self):
+        index = _RowIndex([('key_1',), ('key_2', 'key_3')])
+        index.append({'key_1': 'val_1', 'key_2': 'val_2'})
+        index.append({'key_1': ' VAL_1 ', 'key_2': 'val_2', 'key_3': 'x'})
+        self.assertEqual(index.find(('key_1',), {'key_1': 'Val_1'}), 0)
+        self.assertEqual(
+            index.find(('key_2', 'key_3'), {'key_2': 'val_2', 'key_3': 'X'}),
+            1,
+        )
+        self.assertIsNone(index.find(('key_1',), {'key_1': 'val_2'}))
+        index.rows[0]['key_1'] = 'val_2'
+        index.update(0)
+        self.assertEqual(index.find(('key_1',), {'key_1': 'val_1'}), 1)
+        self.assertEqual(index.find(('key_1',), {'key_1': 'val_2'}), 0)
+
 
 class MergerTest(TestCase):
     def setUp(self):
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import datetime
+import StringIO
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase
+import mock
+
+from ralph.discovery.tasks import _execute_plugin, run_chains_concurrently
+from ralph.scan.metrics import (
+    Measurement,
+    get_runs,
+    get_slowest,
+    get_stats,
+    percentile,
+    record,
+)
+from ralph.scan.models import PluginRun
+from ralph.util import plugin
+
+
+class MetricsTest(TestCase):
+    def _run(self, plugin_name, duration, outcome, network='', days=0):
+        PluginRun.objects.create(
+            kind='discovery',
+            plugin=plugin_name,
+            network=network,
+            address='127.0.0.1',
+            started=datetime.datetime.now() - datetime.timedelta(days=days),
+            duration=duration,
+            outcome=outcome,
+            queries=2,
+        )
+
+    def test_percentile(self):
+        values = range(1, 101)
+        self.assertEqual(percentile(values, 0.5), 50)
+        self.assertEqual(percentile(values, 0.99), 99)
+        self.assertEqual(percentile([3], 0.9), 3)
+        self.assertEqual(percentile([], 0.9), None)
+
+    def test_get_stats(self):
+        for duration in (1, 2, 3, 4):
+            self._run('snmp', duration, 'up', 'net1')
+        self._run('snmp', 10, 'exception', 'net2')
+        self._run('ssh_linux', 1, 'down', 'net2')
+        self._run('ssh_linux', 100, 'up', days=2)
+        snmp, ssh_linux = get_stats(get_runs(days=1))
+        self.assertEqual(snmp['name'], 'snmp')
+        self.assertEqual(snmp['count'], 5)
+        self.assertEqual(snmp['p50'], 3)
+        self.assertEqual(snmp['max'], 10)
+        self.assertEqual(snmp['total'], 20)
+        self.assertEqual(snmp['error_rate'], 0.2)
+        self.assertEqual(snmp['queries'], 2)
+        self.assertEqual(ssh_linux['count'], 1)
+        self.assertEqual(
+            [group['name'] for group in get_stats(get_runs(), 'network')],
+            ['net2', 'net1'],
+        )
+        self.assertEqual(
+            [run.duration for run in get_slowest(get_runs(days=3), 2)],
+            [100, 10],
+        )
+
+    def test_pluginstats_command(self):
+        self._run('snmp', 5, 'up', 'net1')
+        self._run('snmp', 5, 'up', days=40)
+        with mock.patch('sys.stdout', StringIO.StringIO()) as stdout:
+            call_command('pluginstats', group_by='network')
+        self.assertIn('net1', stdout.getvalue())
+        call_command('pluginstats', prune=True)
+        self.assertEqual(PluginRun.objects.count(), 1)
+
+    def test_record_prunes_old_runs(self):
+        cache.clear()
+        self._run('snmp', 5, 'up', days=40)
+        run = PluginRun(
+            kind='discovery',
+            plugin='snmp',
+            started=datetime.datetime.now(),
+            duration=1,
+            outcome='up',
+        )
+        record([run])
+        self.assertEqual(PluginRun.objects.count(), 1)
+        self._run('snmp', 5, 'up', days=40)
+        # not again within the hour
+        record([run])
+        self.assertEqual(PluginRun.objects.count(), 3)
+
+    def test_measurement_counts_queries(self):
+        with self.settings(DEBUG=False):
+            with Measurement() as outer:
+                PluginRun.objects.count()
+                with Measurement() as inner:
+                    PluginRun.objects.count()
+                    list(PluginRun.objects.all())
+        self.assertEqual(inner.queries, 2)
+        self.assertEqual(outer.queries, 3)
+        with self.assertNumQueries(1):
+            PluginRun.objects.count()
+
+    @mock.patch('ralph.discovery.tasks.plugin.run')
+    def test_discovery_runs_are_recorded(self, run):
+        run.return_value = True, 'done', {'model': 'server'}
+        _execute_plugin('discovery.tasks', 'ping', {'ip': '127.0.0.1'})
+        run.side_effect = plugin.Restart('later')
+        _execute_plugin('discovery.tasks', 'snmp', {'ip': '127.0.0.1'})
+        self.assertEqual(
+            {
+                (run.chain, run.plugin, run.address, run.outcome)
+                for run in PluginRun.objects.all()
+            },
+            {
+                ('discovery.tasks', 'ping', '127.0.0.1', 'up'),
+                ('discovery.tasks', 'snmp', '127.0.0.1', 'restart'),
+            },
+        )
+        self.assertEqual(
+            PluginRun.objects.get(plugin='ping').size,
+            len('{"model": "server"}'),
+        )
+        self.assertIsNone(PluginRun.objects.get(plugin='snmp').size)
+
+    @mock.patch('ralph.discovery.tasks.record')
+    @mock.patch('ralph.discovery.tasks.plugin.run')
+    def test_discovery_runs_are_recorded_at_once(self, run, record_):
+        run.return_value = True, 'done', {}
+        runs = []
+        _execute_plugin('discovery.tasks', 'ping', {'ip': '127.0.0.1'}, runs)
+        _execute_plugin('discovery.tasks', 'snmp', {'ip': '127.0.0.1'}, runs)
+        self.assertFalse(record_.called)
+        self.assertEqual([run.plugin for run in runs], ['ping', 'snmp'])
+        with mock.patch('ralph.discovery.tasks.plugin.runnable') as runnable:
+            runnable.side_effect = [['ping'], ['snmp'], []]
+            run_chains_concurrently(
+                {'ip': '127.0.0.1'},
+                ('discovery.tasks',),
+                interactive=True,
+                outputs=(lambda *args, **kwargs: None,) * 3,
+            )
+        record_.assert_called_once_with(mock.ANY)
+        self.assertEqual(
+            [run.plugin for run in record_.call_args[0][0]],
+            ['ping', 'snmp'],
+        )
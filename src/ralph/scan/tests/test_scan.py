@@ -5,13 +5,29 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import threading
+import time
+
 from django.test import TestCase
+import mock
 
-from ralph.discovery.models import IPAddress
+from ralph.discovery.models import (
+    DataCenter,
+    DiscoveryQueue,
+    IPAddress,
+    Network,
+)
+from ralph.scan.models import PluginRun, ScanSummary
 from ralph.scan.manual import (
     _get_cleaned_results,
+    _get_fingerprints,
+    _get_in_flight_key,
     _get_ip_addresses_from_results,
     _get_results_checksum,
+    _run_plugins,
+    _scan_postprocessing,
+    scan_address_job,
+    scan_network,
 )
 
 
@@ -130,3 +146,208 @@ class TestScan(TestCase):
             ) == '124e70669d35effe35d338372e84bce6',
         )
 
+
+    def test_get_fingerprints(self):
+        fingerprints = _get_fingerprints({
+            'plugin_1': {
+                'status': 'success',
+                'date': '2013-01-01 00:00:00',
+                'device': {
+                    'serial_number': 'sn1',
+                    'disks': [{'serial_number': 'sn2'}],
+                },
+            },
+        })
+        self.assertEqual(
+            fingerprints,
+            {
+                'plugin_1': {
+                    'serial_number': _get_results_checksum('sn1'),
+                    'disks': _get_results_checksum([{'serial_number': 'sn2'}]),
+                },
+            },
+        )
+
+
+class ScanPostprocessingTest(TestCase):
+    def setUp(self):
+        self.ip_address, _ = IPAddress.concurrent_get_or_create(
+            address='127.0.0.2',
+        )
+
+    def _scan(self, job_id, results):
+        job = mock.Mock()
+        job.id = job_id
+        job.meta = {}
+        old_job = mock.Mock()
+        old_job.meta = {}
+        old_job.result = {}
+        with mock.patch('ralph.scan.manual.rq') as rq:
+            rq.job.Job.fetch.return_value = old_job
+            _scan_postprocessing(results, job, self.ip_address)
+        return job
+
+    def test_changes(self):
+        results = {
+            'plugin_1': {
+                'status': 'success',
+                'device': {'serial_number': 'sn1', 'model_name': 'a'},
+            },
+            'plugin_2': {
+                'status': 'success',
+                'device': {'serial_number': 'sn1'},
+            },
+        }
+        job = self._scan('job-1', results)
+        self.assertTrue(job.meta['changed'])
+        scan_summary = ScanSummary.objects.get(job_id='job-1')
+        self.assertTrue(scan_summary.changed)
+        self.assertIsNotNone(scan_summary.finished)
+        self.assertEqual(
+            scan_summary.get_statuses(),
+            {'plugin_1': 'success', 'plugin_2': 'success'},
+        )
+        scan_summary = self.ip_address.scan_summary
+        scan_summary.previous_checksum = job.meta['results_checksum']
+        scan_summary.previous_fingerprints = scan_summary.fingerprints
+        scan_summary.save()
+        # only plugin_1 runs, the fingerprint of plugin_2 is kept
+        job = self._scan('job-2', {
+            'plugin_1': {
+                'status': 'success',
+                'device': {'serial_number': 'sn1', 'model_name': 'a'},
+            },
+        })
+        self.assertFalse(job.meta['changed'])
+        self.assertFalse(ScanSummary.objects.get(job_id='job-2').changed)
+        job = self._scan('job-3', {
+            'plugin_1': {
+                'status': 'success',
+                'device': {'serial_number': 'sn1', 'model_name': 'b'},
+            },
+        })
+        self.assertTrue(job.meta['changed'])
+        self.assertEqual(
+            self.ip_address.scan_summary.get_changes(),
+            [('plugin_1', 'model_name')],
+        )
+
+
+class RunPluginsTest(TestCase):
+    def setUp(self):
+        self.release = threading.Event()
+        self.modules = {}
+        for name in ('slow_1', 'slow_2', 'hanging'):
+            self.modules['plugins.%s' % name] = mock.Mock()
+        for name in ('slow_1', 'slow_2'):
+            self.modules['plugins.%s' % name].scan_address.side_effect = (
+                self._slow_plugin
+            )
+        self.modules['plugins.hanging'].scan_address.side_effect = (
+            self._hanging_plugin
+        )
+
+    def tearDown(self):
+        self.release.set()
+
+    def _slow_plugin(self, address, **kwargs):
+        time.sleep(0.3)
+        return {'status': 'success', 'messages': ['found']}
+
+    def _hanging_plugin(self, address, **kwargs):
+        self.release.wait(10)
+        return {'status': 'success'}
+
+    def _import_module(self, name):
+        try:
+            return self.modules[name]
+        except KeyError:
+            raise ImportError(name)
+
+    @mock.patch('ralph.scan.manual.PLUGIN_TIMEOUT', 0.5)
+    @mock.patch('ralph.scan.manual.PLUGIN_WORKERS', 4)
+    def test_run_plugins(self):
+        job = mock.Mock()
+        job.meta = {}
+        job.origin = 'default'
+        with mock.patch(
+            'ralph.scan.manual.import_module',
+            self._import_module,
+        ):
+            started = time.time()
+            results = _run_plugins(
+                '127.0.0.1',
+                ['plugins.slow_1', 'plugins.slow_2', 'plugins.hanging',
+                 'plugins.missing'],
+                job,
+            )
+            elapsed = time.time() - started
+        self.assertLess(elapsed, 0.9)
+        self.assertEqual(
+            job.meta['status'],
+            {
+                'plugins.slow_1': 'success',
+                'plugins.slow_2': 'success',
+                'plugins.hanging': 'error',
+                'plugins.missing': 'error',
+            },
+        )
+        self.assertEqual(
+            set(job.meta['finished']),
+            set(job.meta['status']),
+        )
+        self.assertEqual(
+            set(results),
+            {'plugins.slow_1', 'plugins.slow_2', 'plugins.hanging'},
+        )
+        self.assertEqual(
+            results['plugins.hanging']['messages'],
+            ['Timed out after 0.5 seconds.'],
+        )
+        self.assertLess(job.save.call_count, 6)
+        runs = PluginRun.objects.filter(kind='scan', queue='default')
+        self.assertEqual(
+            {run.plugin: run.outcome for run in runs},
+            {
+                'slow_1': 'success',
+                'slow_2': 'success',
+                'hanging': 'timeout',
+                'missing': 'error',
+            },
+        )
+        self.assertGreater(runs.get(plugin='slow_1').duration, 0.25)
+
+
+class ScanNetworkTest(TestCase):
+    def setUp(self):
+        self.network = Network.objects.create(
+            name='local',
+            address='127.0.0.0/24',
+            gateway='127.0.0.254',
+            data_center=DataCenter.objects.create(name='dc'),
+            queue=DiscoveryQueue.objects.create(name='dc1'),
+        )
+        for address in ('127.0.0.1', '127.0.0.2', '127.0.1.1'):
+            IPAddress.objects.create(address=address)
+        IPAddress.objects.filter(address='127.0.0.2').update(
+            dead_ping_count=100,
+        )
+        self.calls = []
+
+    def _enqueue_many(self, queue, calls, **kwargs):
+        self.calls.extend(calls)
+        return self.calls
+
+    @mock.patch('ralph.scan.manual.django_rq')
+    @mock.patch('ralph.scan.manual.enqueue_many')
+    def test_scan_network(self, enqueue_many, django_rq):
+        enqueue_many.side_effect = self._enqueue_many
+        with self.assertNumQueries(1):
+            scan_network(self.network, ['plugin'])
+        django_rq.get_queue.assert_called_once_with('dc1')
+        self.assertEqual(len(self.calls), 1)
+        func, args, kwargs, keys = self.calls[0]
+        self.assertEqual(func, scan_address_job)
+        self.assertEqual(args[0].address, '127.0.0.1')
+        self.assertEqual(args[1], ['plugin'])
+        self.assertEqual(keys, [_get_in_flight_key('127.0.0.1', ['plugin'])])
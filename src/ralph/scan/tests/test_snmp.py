@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from django.core.cache import cache
+from django.test import TestCase
+import mock
+
+from ralph.discovery.models import DataCenter, IPAddress, Network
+from ralph.scan.credentials import CredentialStats
+from ralph.scan.snmp import SYS_DESCR_OID, get_snmp_many
+
+
+class CredentialStatsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.stats = CredentialStats('test')
+
+    def test_hits(self):
+        scopes = [('network', 1), ('model', 2)]
+        self.stats.succeeded('private', scopes)
+        self.stats.succeeded('private', scopes[:1])
+        self.stats.succeeded('other', scopes[1:])
+        self.assertEqual(
+            self.stats.order(['public', 'other', 'private'], scopes),
+            ['private', 'other', 'public'],
+        )
+        self.assertEqual(
+            self.stats.order(['public', 'other', 'private'], scopes[:1]),
+            ['private', 'public', 'other'],
+        )
+
+    @mock.patch('ralph.scan.credentials.CREDENTIALS_MAX_FAILURES', 2)
+    def test_repeated_failures(self):
+        failures = [('127.0.0.1', 'public'), ('127.0.0.2', 'private')]
+        self.stats.failed(failures)
+        self.assertEqual(
+            self.stats.get_failed('127.0.0.1', ['public', 'private']),
+            set(),
+        )
+        self.stats.failed(failures[:1])
+        self.assertEqual(
+            self.stats.get_failed('127.0.0.1', ['public', 'private']),
+            {'public'},
+        )
+        self.assertEqual(
+            self.stats.get_failed('127.0.0.2', ['public', 'private']),
+            set(),
+        )
+
+
+class GetSnmpManyTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        Network.objects.create(
+            name='local',
+            address='127.0.0.0/24',
+            gateway='127.0.0.254',
+            data_center=DataCenter.objects.create(name='dc'),
+        )
+        self.requests = []
+        self.answers = {
+            ('127.0.0.1', 'public', '2c'): 'public name',
+            ('127.0.0.1', 'private', '2c'): 'private name',
+            ('127.0.0.3', 'public', '2c'): '',
+            ('127.0.0.3', 'public', '1'): 'v1 name',
+        }
+        self.known = IPAddress(
+            address='127.0.0.1',
+            snmp_community='private',
+        )
+        self.closed = IPAddress(address='127.0.0.2')
+        self.empty = IPAddress(address='127.0.0.3')
+        self.silent = IPAddress(address='127.0.0.4')
+
+    def _get_many(self, requests, timeout, attempts):
+        results = []
+        for address, community, oids, version in requests:
+            self.assertEqual(oids, [SYS_DESCR_OID])
+            self.requests.append((address, community, version))
+            answer = self.answers.get((address, community, version))
+            results.append(
+                None if answer is None else [(oids[0], answer)],
+            )
+        return results
+
+    @mock.patch('ralph.scan.snmp.SNMP_COMMUNITIES', ['public', 'private'])
+    @mock.patch('ralph.scan.snmp.check_snmp_ports')
+    @mock.patch('ralph.scan.snmp.SNMP_CLIENT')
+    def test_get_snmp_many(self, client, check_snmp_ports):
+        client.get_many.side_effect = self._get_many
+        check_snmp_ports.return_value = {
+            '127.0.0.1': True,
+            '127.0.0.2': False,
+            '127.0.0.3': True,
+            '127.0.0.4': True,
+        }
+        results = get_snmp_many(
+            [self.known, self.closed, self.empty, self.silent],
+        )
+        self.assertEqual(results, [
+            ('private name', 'private', '2c'),
+            (None, None, None),
+            ('v1 name', 'public', '1'),
+            (None, None, None),
+        ])
+        # the most likely community of every host goes first, the others
+        # are only tried for the hosts that didn't answer
+        self.assertEqual(self.requests, [
+            ('127.0.0.1', 'private', '2c'),
+            ('127.0.0.3', 'public', '2c'),
+            ('127.0.0.4', 'public', '2c'),
+            ('127.0.0.3', 'public', '1'),
+            ('127.0.0.4', 'private', '2c'),
+        ])
+
+    @mock.patch(
+        'ralph.scan.snmp.SNMP_COMMUNITIES',
+        ['public', 'private', 'other'],
+    )
+    @mock.patch('ralph.scan.credentials.CREDENTIALS_MAX_FAILURES', 1)
+    @mock.patch('ralph.scan.snmp.check_snmp_ports')
+    @mock.patch('ralph.scan.snmp.SNMP_CLIENT')
+    def test_credentials_learning(self, client, check_snmp_ports):
+        client.get_many.side_effect = self._get_many
+        check_snmp_ports.return_value = {}
+        self.answers = {
+            ('127.0.0.1', 'other', '2c'): 'first name',
+            ('127.0.0.2', 'other', '2c'): 'second name',
+        }
+        first = IPAddress(address='127.0.0.1', http_family='Apache')
+        silent = IPAddress(address='127.0.0.4', http_family='Apache')
+        self.assertEqual(
+            get_snmp_many([first, silent]),
+            [('first name', 'other', '2c'), (None, None, None)],
+        )
+        self.assertEqual(len(self.requests), 6)
+        self.requests = []
+        # a new address in the same network tries the successful community
+        # first, the silent one skips the communities that failed recently
+        second = IPAddress(address='127.0.0.2', http_family='Apache')
+        silent = IPAddress(address='127.0.0.4', http_family='Apache')
+        self.assertEqual(
+            get_snmp_many([second, silent]),
+            [('second name', 'other', '2c'), (None, None, None)],
+        )
+        self.assertEqual(self.requests, [
+            ('127.0.0.2', 'other', '2c'),
+            ('127.0.0.4', 'other', '2c'),
+        ])
@@ -185,6 +185,27 @@ SANITY_CHECK_IP2HOST_HOSTNAME_REGEX = r'.*google.*'
 
 SINGLE_DISCOVERY_TIMEOUT = 43200 # 12 hours
 NETWORK_TASK_DELEGATION_TIMEOUT = 7200 # 2 hours
+DISCOVERY_PLUGIN_WORKERS = 1 # >1 runs independent plugins concurrently
+SCAN_PLUGIN_WORKERS = 8 # plugins run concurrently in a single scan
+SCAN_PLUGIN_TIMEOUT = 120 # seconds, a plugin taking longer is abandoned
+SCAN_CREDENTIALS_TIMEOUT = 604800 # a week, successful credentials stats
+SCAN_CREDENTIALS_NEGATIVE_TIMEOUT = 3600 # failed credentials are skipped
+SCAN_CREDENTIALS_MAX_FAILURES = 3 # failures before a credential is skipped
+HTTP_CONNECT_TIMEOUT = 2 # seconds, for discovery HTTP requests
+HTTP_READ_TIMEOUT = 5 # seconds, for discovery HTTP requests
+HTTP_WORKERS = 16 # HTTP families of an autoscan group are probed in parallel
+PLUGIN_METRICS = True # record the time and outcome of every plugin run
+PLUGIN_METRICS_DAYS = 30 # older plugin runs are deleted
+DISCOVERY_INTERVAL = 86400 # seconds, base rediscovery interval of an address
+DISCOVERY_MIN_INTERVAL = 3600 # for new and often changing addresses
+DISCOVERY_MAX_INTERVAL = 2592000 # for addresses stable for months
+DISCOVERY_HISTORY_DAYS = 90 # device changes counted for the interval
+DISCOVERY_JOBS_PER_HOUR = 1000 # budget of `discover --schedule` per queue
+DISCOVERY_QUEUE_JOBS_PER_HOUR = {} # budgets of single queues, by name
+DISCOVERY_SCHEDULE_INTERVAL = 600 # seconds between the scheduler runs
+DISCOVERY_BATCH_SIZE = 1 # >1 discovers that many addresses in a single job
+JOBS_IN_FLIGHT_MARGIN = 3600 # seconds after the job timeout, then duplicates
+REPRICING_QUEUE = None # RQ queue repricing the devices affected by changes
 # django.contrib.messages settings
 MESSAGE_STORAGE = 'django.contrib.messages.storage.session.SessionStorage'
 # activity middleware settings
@@ -109,3 +109,27 @@ class ReportDeviceListForm(forms.Form):
         label="Deleted devices",
         widget=forms.CheckboxInput()
     )
+
+
+class PluginStatsForm(forms.Form):
+    kind = forms.ChoiceField(
+        label="Plugins",
+        required=False,
+        choices=[('', 'All'), ('discovery', 'Discovery'), ('scan', 'Scan')],
+    )
+    group_by = forms.ChoiceField(
+        label="Group by",
+        required=False,
+        choices=[
+            ('plugin', 'Plugin'),
+            ('chain', 'Chain'),
+            ('queue', 'Queue'),
+            ('network', 'Network'),
+        ],
+    )
+    days = forms.IntegerField(
+        label="Days",
+        required=False,
+        min_value=1,
+        initial=1,
+    )
@@ -7,8 +7,26 @@ from __future__ import unicode_literals
 
 import datetime
 
+from django.db import models as db
 from django.db.models.sql.aggregates import Aggregate
-from ralph.discovery.models import HistoryCost, DeviceType
+from ralph.discovery.models import (
+    DailyCost,
+    DeviceType,
+    HistoryCost,
+    SplunkUsage,
+)
+from ralph.discovery.models_history import fill_daily_costs
+
+
+# the types of devices that aren't counted in the venture reports
+UNCOUNTED_TYPES = {
+    DeviceType.cloud_server.id,
+    DeviceType.virtual_server.id,
+    DeviceType.unknown.id,
+    DeviceType.data_center.id,
+    DeviceType.rack.id,
+    DeviceType.management.id,
+}
 
 
 class SpanSum(Aggregate):
@@ -113,3 +131,58 @@ def get_total_virtual_cores(query, start, end):
             end=end.strftime('%Y-%m-%d'),
         ),
     )['spansum'] or 0)/ days
+
+
+def get_daily_costs(start, end):
+    """
+    Sum up the daily costs, spans and cores in the specified time span by
+    venture, device type, extra cost and device deletion, using the
+    ``DailyCost`` rollup. Its missing days are computed first.
+    """
+    fill_daily_costs(start, end)
+    return DailyCost.objects.filter(
+        day__gte=start,
+        day__lt=end,
+    ).values(
+        'venture_id',
+        'device_type',
+        'extra_id',
+        'deleted',
+    ).annotate(
+        db.Sum('cost'),
+        db.Sum('spans'),
+        db.Sum('cores'),
+    )
+
+
+def get_current_devices():
+    """
+    List the venture, the device and its deletion for the current time spans
+    of the devices that are counted in the venture reports.
+    """
+    return HistoryCost.objects.filter(
+        end__gte=datetime.date.today(),
+        device__model__type__isnull=False,
+    ).exclude(
+        device__model__type__in=UNCOUNTED_TYPES,
+    ).values_list(
+        'venture_id',
+        'device_id',
+        'device__deleted',
+    ).distinct()
+
+
+def get_splunk_sizes(start, end):
+    """
+    Sum up the Splunk usage in the specified time span (including ``end``) by
+    the venture of the device and the component model.
+    """
+    return SplunkUsage.objects.filter(
+        day__gte=start,
+        day__lte=end,
+    ).order_by().values(
+        'device__venture_id',
+        'model_id',
+    ).annotate(
+        db.Sum('size'),
+    )
@@ -25,6 +25,7 @@ from ralph.discovery.models import (
     DeprecationKind,
     MarginKind,
 )
+from ralph.scan.models import PluginRun
 from ralph.ui.tests.global_utils import login_as_su
 from ralph.ui.tests.util import create_device
 from ralph.util.pricing import get_device_price
@@ -49,6 +50,7 @@ class AccessToReportsTest(TestCase):
             '/ui/reports/services/',
             '/ui/reports/ventures/',
             '/ui/reports/device_prices_per_venture/',
+            '/ui/reports/plugins/',
         ]
 
     @skip("Not testable async report.")
@@ -133,6 +135,41 @@ class ReportsServicesTest(TestCase):
         self.assertEqual(len(re_services_without_venture), 0)
 
 
+class ReportsPluginsTest(TestCase):
+    def setUp(self):
+        self.client = login_as_su()
+        for plugin, duration, outcome in (
+            ('snmp', 1, 'up'),
+            ('snmp', 30, 'exception'),
+            ('ssh_linux', 2, 'up'),
+        ):
+            PluginRun.objects.create(
+                kind='discovery',
+                plugin=plugin,
+                queue='dc1',
+                address='127.0.0.1',
+                started=datetime.datetime.now(),
+                duration=duration,
+                outcome=outcome,
+            )
+
+    def test_reports_plugins(self):
+        report = self.client.get('/ui/reports/plugins/')
+        self.assertEqual(report.status_code, 200)
+        stats = report.context['stats']
+        self.assertEqual(
+            [(group['name'], group['count']) for group in stats],
+            [('snmp', 2), ('ssh_linux', 1)],
+        )
+        self.assertEqual(stats[0]['error_rate'], 0.5)
+        self.assertEqual(report.context['slowest'][0].duration, 30)
+        report = self.client.get('/ui/reports/plugins/?group_by=queue&days=2')
+        self.assertEqual(
+            [(group['name'], group['count']) for group in report.context['stats']],
+            [('dc1', 3)],
+        )
+
+
 class ReportsDevicesTest(TestCase):
     def setUp(self):
         self.client = login_as_su()
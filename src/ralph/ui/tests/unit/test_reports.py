@@ -1,7 +1,14 @@
 """Tests for ralph UI reports"""
+import datetime
+
 from django.test import TestCase
 
-from ralph.ui.views.reports import _report_services_data_provider
+from ralph.business.models import Venture
+from ralph.discovery.models import Device, DeviceType, HistoryCost
+from ralph.ui.views.reports import (
+    _report_services_data_provider,
+    _report_ventures_data_provider,
+)
 
 
 class TestServices(TestCase):
@@ -25,3 +32,53 @@ class TestServices(TestCase):
             ]),
             {'00002', '00003'},
         )
+
+
+class TestVentures(TestCase):
+    """Test for the ventures report."""
+
+    def setUp(self):
+        self.end = datetime.date.today()
+        self.start = self.end - datetime.timedelta(days=10)
+        self.parent = Venture(name='parent', symbol='parent')
+        self.parent.save()
+        self.child = Venture(name='child', symbol='child', parent=self.parent)
+        self.child.save()
+        for sn, venture, model_type, cost, days in (
+            ('parent', self.parent, DeviceType.rack_server, 304, 10),
+            ('child', self.child, DeviceType.rack_server, 608, 5),
+            ('virtual', self.child, DeviceType.virtual_server, 30.4, 10),
+        ):
+            dev = Device.create(
+                sn=sn,
+                model_type=model_type,
+                model_name=sn,
+            )
+            dev.venture = venture
+            dev.cached_cost = cost
+            dev.save()
+            HistoryCost.objects.filter(device=dev).update(
+                start=self.end - datetime.timedelta(days=days),
+            )
+
+    def test_ventures(self):
+        parent, parent_only, child = _report_ventures_data_provider(
+            self.start,
+            self.end,
+            [self.parent.id, self.child.id],
+            [],
+        )
+        self.assertEqual(parent['name'], 'parent')
+        self.assertTrue(parent['top_level'])
+        self.assertAlmostEqual(parent['total'], 10 * 10 + 20 * 5 + 1 * 10)
+        self.assertAlmostEqual(parent['hardware_cost'], parent['total'])
+        # the child's server was there for half the time
+        self.assertAlmostEqual(parent['count'], 1.5)
+        self.assertEqual(parent['count_now'], 2)
+        self.assertEqual(parent_only['name'], '-')
+        self.assertAlmostEqual(parent_only['total'], 10 * 10)
+        self.assertAlmostEqual(parent_only['count'], 1)
+        self.assertEqual(child['name'], 'child')
+        self.assertAlmostEqual(child['total'], 20 * 5 + 1 * 10)
+        self.assertAlmostEqual(child['count'], 0.5)
+        self.assertEqual(child['splunk_cost'], None)
@@ -92,6 +92,7 @@ from ralph.ui.views.reports import (
     ReportVentures,
     ReportDevices,
     ReportDevicePricesPerVenture,
+    ReportPlugins,
 )
 
 
@@ -253,6 +254,7 @@ urlpatterns = patterns('',
     url(r'^reports/margins/$', login_required(ReportMargins.as_view()), {}, 'reports_margins'),
     url(r'^reports/devices/$', login_required(ReportDevices.as_view()), {}, 'reports_devices'),
     url(r'^reports/device_prices_per_venture/$', login_required(ReportDevicePricesPerVenture.as_view()), {}, 'device_prices_per_venture'),
+    url(r'^reports/plugins/$', login_required(ReportPlugins.as_view()), {}, 'reports_plugins'),
 
     url(r'^deployment/mass/start/$',
         login_required(PrepareMassDeployment.as_view())),
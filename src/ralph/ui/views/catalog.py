@@ -28,14 +28,6 @@ from ralph.discovery.models import (
     DeviceModel,
     DeviceModelGroup,
     DeviceType,
-    DiskShare,
-    FibreChannel,
-    GenericComponent,
-    Memory,
-    OperatingSystem,
-    Processor,
-    Software,
-    Storage,
     PricingGroup,
     PricingValue,
     PricingVariable,
@@ -51,7 +43,7 @@ from ralph.ui.forms.catalog import (
     PricingFormulaFormSet,
 )
 from ralph.ui.views.common import Base
-from ralph.util import pricing
+from ralph.util import repricing
 
 from ralph.util.presentation import COMPONENT_ICONS, DEVICE_ICONS
 
@@ -186,10 +178,6 @@ class CatalogDevice(Catalog):
         super(CatalogDevice, self).__init__(*args, **kwargs)
         self.form = None
 
-    def update_cached(self, group):
-        for device in Device.objects.filter(model__group=group):
-            pricing.device_update_cached(device)
-
     def post(self, *args, **kwargs):
         if not self.request.user.get_profile().has_perm(
                 Perm.edit_device_info_financial):
@@ -213,7 +201,7 @@ class CatalogDevice(Catalog):
                 model = get_object_or_404(DeviceModel, id=item)
                 model.group = target
                 model.save(user=self.request.user)
-            self.update_cached(target)
+            repricing.reprice(device_models=items)
             messages.success(self.request, "Items moved.")
             return HttpResponseRedirect(self.request.path)
         elif 'clear' in self.request.POST:
@@ -239,7 +227,7 @@ class CatalogDevice(Catalog):
                                                id=self.group_id)
                 self.group.price = 0
                 self.group.save(user=self.request.user)
-                self.update_cached(self.group)
+                repricing.reprice(device_groups=[self.group.id])
                 self.group.delete()
                 messages.warning(self.request,
                                  "Group '%s' deleted." % self.group.name)
@@ -258,7 +246,7 @@ class CatalogDevice(Catalog):
             if self.form.is_valid():
                 self.form.save(commit=False)
                 self.form.instance.save(user=self.request.user)
-                self.update_cached(self.group)
+                repricing.reprice(device_groups=[self.form.instance.id])
                 messages.success(self.request, "Changes saved.")
                 return HttpResponseRedirect(self.request.path)
             else:
@@ -318,15 +306,6 @@ class CatalogComponent(Catalog):
         super(CatalogComponent, self).__init__(*args, **kwargs)
         self.form = None
 
-    def update_cached(self, group):
-        devices = set()
-        for _class in (Storage, Memory, Processor, DiskShare, FibreChannel,
-                       GenericComponent, OperatingSystem, Software):
-            for component in _class.objects.filter(model__group=group):
-                devices.add(component.device)
-        for device in devices:
-            pricing.device_update_cached(device)
-
     def post(self, *args, **kwargs):
         if not self.request.user.get_profile().has_perm(
                 Perm.edit_device_info_financial):
@@ -350,7 +329,7 @@ class CatalogComponent(Catalog):
                 model = get_object_or_404(ComponentModel, id=item)
                 model.group = target
                 model.save(user=self.request.user)
-            self.update_cached(target)
+            repricing.reprice(component_models=items)
             messages.success(self.request, "Items moved.")
             return HttpResponseRedirect(self.request.path)
         elif 'clear' in self.request.POST:
@@ -376,7 +355,7 @@ class CatalogComponent(Catalog):
                                                id=self.group_id)
                 self.group.price = 0
                 self.group.save(user=self.request.user)
-                self.update_cached(self.group)
+                repricing.reprice(component_groups=[self.group.id])
                 self.group.delete()
                 messages.warning(self.request,
                                  "Group '%s' deleted." % self.group.name)
@@ -395,7 +374,7 @@ class CatalogComponent(Catalog):
             if self.form.is_valid():
                 self.form.save(commit=False)
                 self.form.instance.save(user=self.request.user)
-                self.update_cached(self.group)
+                repricing.reprice(component_groups=[self.form.instance.id])
                 messages.success(self.request, "Changes saved.")
                 return HttpResponseRedirect(self.request.path)
             else:
@@ -73,7 +73,7 @@ from ralph.discovery.models_history import (
     FOREVER_DATE,
     ALWAYS_DATE,
 )
-from ralph.util import presentation, pricing
+from ralph.util import presentation, pricing, repricing
 from ralph.util.plugin import BY_NAME as AVAILABLE_PLUGINS
 from ralph.ui.forms import ChooseAssetForm
 from ralph.ui.forms.devices import (
@@ -541,21 +541,10 @@ class Info(DeviceUpdateView):
 
     def get_changed_addresses(self):
         delta = timezone.now() - datetime.timedelta(days=1)
-        result = []
-        for ip_address in self.object.ipaddress.filter(
+        return list(self.object.ipaddress.filter(
             scan_summary__modified__gt=delta,
-        ):
-            try:
-                job = rq.job.Job.fetch(
-                    ip_address.scan_summary.job_id,
-                    django_rq.get_connection(),
-                )
-            except rq.exceptions.NoSuchJobError:
-                continue
-            else:
-                if job.meta.get('changed', False):
-                    result.append(ip_address)
-        return result
+            scan_summary__changed=True,
+        ))
 
     def get_context_data(self, **kwargs):
         ret = super(Info, self).get_context_data(**kwargs)
@@ -1637,6 +1626,7 @@ class ScanStatus(BaseMixin, TemplateView):
                 ],
                 'task_size': 100 / len(plugins),
                 'job': self.job,
+                'changes': self.get_changes(),
             })
             if self.job.is_finished:
                 if not self.forms:
@@ -1669,6 +1659,18 @@ class ScanStatus(BaseMixin, TemplateView):
                     )
         return super(ScanStatus, self).get(*args, **kwargs)
 
+    def get_changes(self):
+        if not self.job.meta.get('changed'):
+            return []
+        try:
+            scan_summary = ScanSummary.objects.get(job_id=self.job.id)
+        except ScanSummary.DoesNotExist:
+            return []
+        return [
+            (plugin.split('.')[-1], component)
+            for plugin, component in scan_summary.get_changes()
+        ]
+
     def mark_scan_as_nochanges(self, job):
         try:
             scan_summary = ScanSummary.objects.get(job_id=job.id)
@@ -1678,6 +1680,7 @@ class ScanStatus(BaseMixin, TemplateView):
             scan_summary.false_positive_checksum = job.meta.get(
                 'results_checksum',
             )
+            scan_summary.changed = False
             scan_summary.save()
             job.meta['changed'] = False
             job.save()
@@ -1691,7 +1694,9 @@ class ScanStatus(BaseMixin, TemplateView):
             scan_summary.previous_checksum = job.meta.get(
                 'results_checksum',
             )
+            scan_summary.previous_fingerprints = scan_summary.fingerprints
             scan_summary.false_positive_checksum = None
+            scan_summary.changed = False
             scan_summary.save()
             job.meta['changed'] = False
             job.save()
@@ -1723,11 +1728,12 @@ class ScanStatus(BaseMixin, TemplateView):
                         for field_name in form.result
                     }
                     try:
-                        if device is None:
-                            device = device_from_data(data)
-                        else:
-                            set_device_data(device, data)
-                            device.save()
+                        with repricing.batched():
+                            if device is None:
+                                device = device_from_data(data)
+                            else:
+                                set_device_data(device, data)
+                                device.save()
                     except ValueError as e:
                         messages.error(self.request, e)
                     else:
@@ -7,9 +7,6 @@ from __future__ import unicode_literals
 import collections
 import datetime
 
-import django_rq
-import rq
-
 from bob.menu import MenuItem
 from django.conf import settings
 from django.db.models import Q
@@ -253,7 +250,12 @@ class NetworksAutoscan(SidebarNetworks, BaseMixin, BaseDeviceList):
             )
             query = query.filter(is_buried=False)
         elif self.status == 'changed':
-            query = query.filter(is_buried=False)
+            delta = timezone.now() - datetime.timedelta(days=1)
+            query = query.filter(
+                is_buried=False,
+                scan_summary__changed=True,
+                scan_summary__modified__gt=delta,
+            )
         elif self.status == 'dead':
             query = query.filter(
                 dead_ping_count__gt=settings.DEAD_PING_COUNT,
@@ -269,7 +271,7 @@ class NetworksAutoscan(SidebarNetworks, BaseMixin, BaseDeviceList):
         else:
             query = IPAddress.objects.none()
         return self.sort_queryset(
-            query,
+            query.select_related('scan_summary'),
             columns={
                 'address':  ('number',),
                 'hostname': ('hostname',),
@@ -287,20 +289,9 @@ class NetworksAutoscan(SidebarNetworks, BaseMixin, BaseDeviceList):
         for ip_address in ip_addresses:
             if (
                 ip_address.scan_summary and
-                ip_address.scan_summary.modified > delta
+                ip_address.scan_summary.modified <= delta
             ):
-                try:
-                    job = rq.job.Job.fetch(
-                        ip_address.scan_summary.job_id,
-                        django_rq.get_connection(),
-                    )
-                except rq.exceptions.NoSuchJobError:
-                    continue
-                else:
-                    ip_address.scan_summary.changed = job.meta.get(
-                        'changed',
-                        False,
-                    )
+                ip_address.scan_summary.changed = False
 
     def get_context_data(self, **kwargs):
         ret = super(NetworksAutoscan, self).get_context_data(**kwargs)
@@ -6,6 +6,7 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import collections
 import datetime
 
 from django.conf import settings
@@ -34,29 +35,33 @@ from ralph.cmdb.models_ci import (
 )
 from ralph.deployment.models import DeploymentStatus
 from ralph.discovery.models import (
+    ComponentModel,
     Device,
     DeviceType,
     MarginKind,
-    SplunkUsage,
     HistoryCost,
 )
 from ralph.ui.forms import DateRangeForm, MarginsReportForm
 from ralph.ui.reports import (
-    get_total_cores,
+    UNCOUNTED_TYPES,
+    get_current_devices,
+    get_daily_costs,
+    get_splunk_sizes,
     get_total_cost,
     get_total_count,
-    get_total_virtual_cores,
 )
 from ralph.ui.views.common import Base, DeviceDetailView, _get_details
 from ralph.ui.views.devices import DEVICE_SORT_COLUMNS
 from ralph.ui.forms.reports import (
     DeprecationRangeReportForm,
     DevicesChoiceReportForm,
+    PluginStatsForm,
     SupportRangeReportForm,
     ReportVentureCost,
     ReportDeviceListForm,
     WarrantyRangeReportForm,
 )
+from ralph.scan.metrics import get_runs, get_slowest, get_stats
 from ralph.util.async_reports import (
     get_cache_key,
     async_report_provider,
@@ -240,6 +245,11 @@ class SidebarReports(object):
                 fugue_icon='fugue-computer',
                 view_name='device_prices_per_venture'
             ),
+            MenuItem(
+                "Plugins",
+                fugue_icon='fugue-clock',
+                view_name='reports_plugins'
+            ),
         ]
         context.update({
             'sidebar_items': sidebar_items,
@@ -396,122 +406,143 @@ def _currency(value):
     return '{:,.2f} {}'.format(value or 0, settings.CURRENCY).replace(',', ' ')
 
 
-def _report_ventures_get_totals(start, end, query, extra_types):
-    venture_total = get_total_cost(query, start, end)
-    venture_count, venture_count_now, devices = get_total_count(
-        # Exclude all non-physical devices.
-        query.exclude(
-            device__model__type__in=(
-                DeviceType.cloud_server,
-                DeviceType.virtual_server,
-                DeviceType.unknown,
-                DeviceType.data_center,
-                DeviceType.rack,
-                DeviceType.management,
-            ),
-        ).exclude(                 
-            device_id__isnull=True 
-        ),                         
-        start,
-        end,
-    )
-    venture_core_count = get_total_cores(devices, start, end)
-    venture_virtual_core_count = get_total_virtual_cores(
-        devices, start, end
-    )
-    q = query.filter(extra=None)
-    venture_hardware_cost = get_total_cost(q, start, end)
-    cloud_cost = get_total_cost(
-        query.filter(
-            device__model__type=DeviceType.cloud_server.id
-        ), start, end
-    )
-    venture_extras = []
-    for extra_type in extra_types:
-        cost = None
-        for extra_cost in extra_type.ventureextracost_set.all():
-            q = query.filter(extra=extra_cost)
-            c = get_total_cost(q, start, end)
-            cost = cost + (c or 0) if cost else c
-        venture_extras.append(cost)
-    return {
-        'count': venture_count,
-        'count_now': venture_count_now,
-        'core_count': venture_core_count,
-        'virtual_core_count': venture_virtual_core_count,
-        'hardware_cost': venture_hardware_cost,
-        'cloud_cost': cloud_cost,
-        'extras': venture_extras,
-        'total': venture_total,
+def _report_ventures_get_totals(rows, devices_now, days, extra_ids,
+                                extra_count):
+    data = {
+        'count': 0,
+        'count_now': len(devices_now),
+        'core_count': 0,
+        'virtual_core_count': 0,
+        'hardware_cost': 0,
+        'cloud_cost': 0,
+        'extras': [None] * extra_count,
+        'total': 0,
     }
+    for row in rows:
+        cost = row['cost__sum'] or 0
+        data['total'] += cost
+        if row['extra_id'] is None:
+            data['hardware_cost'] += cost
+        elif row['extra_id'] in extra_ids:
+            index = extra_ids[row['extra_id']]
+            data['extras'][index] = (data['extras'][index] or 0) + cost
+        if row['device_type'] == DeviceType.cloud_server.id:
+            data['cloud_cost'] += cost
+        elif row['device_type'] == DeviceType.virtual_server.id:
+            data['virtual_core_count'] += row['cores__sum'] or 0
+        elif (row['device_type'] is not None and
+              row['device_type'] not in UNCOUNTED_TYPES):
+            data['count'] += row['spans__sum'] or 0
+            data['core_count'] += row['cores__sum'] or 0
+    # the devices that weren't there for the whole time count as fractions
+    for key in ('count', 'core_count', 'virtual_core_count'):
+        data[key] /= days
+    return data
+
+
+def _report_ventures_get_splunk_cost(rows, models):
+    if not rows:
+        return None
+    sizes = collections.Counter()
+    for row in rows:
+        sizes[row['model_id']] += row['size__sum'] or 0
+    return sum(
+        models[model_id].get_price(size=size)
+        for model_id, size in sizes.iteritems()
+        if model_id in models
+    )
 
 
 @async_report_provider(timeout=3600, cache_alias='bigdata')
 def _report_ventures_data_provider(start, end, ventures_ids, extra_types):
-    ventures = Venture.objects.filter(id__in=ventures_ids).order_by('path')
-    total_cloud_cost = get_total_cost(
-        HistoryCost.objects.filter(
-            device__model__type=DeviceType.cloud_server.id,
-        ),
-        start,
-        end,
-    )
-    result = []
-    for venture in ventures:
-        query = HistoryCost.objects.filter(
-            db.Q(venture=venture) |
-            db.Q(venture__parent=venture) |
-            db.Q(venture__parent__parent=venture) |
-            db.Q(venture__parent__parent__parent=venture) |
-            db.Q(venture__parent__parent__parent__parent=venture)
-        ).exclude(device__deleted=True)
-        data = _report_ventures_get_totals(start, end, query, extra_types)
-        (
-            splunk_cost,
-            splunk_count,
-            splunk_count_now,
-            splunk_size,
-        ) = SplunkUsage.get_cost(venture, start, end)
+    days = (end - start).days or 1
+    extra_ids = {
+        extra_id: index
+        for index, extra_type in enumerate(extra_types)
+        for extra_id in extra_type.ventureextracost_set.values_list(
+            'id', flat=True,
+        )
+    }
+    costs = collections.defaultdict(list)
+    total_cloud_cost = 0
+    for row in get_daily_costs(start, end):
+        costs[row['venture_id']].append(row)
+        if row['device_type'] == DeviceType.cloud_server.id:
+            total_cloud_cost += row['cost__sum'] or 0
+    devices_now = collections.defaultdict(list)
+    for venture_id, device_id, deleted in get_current_devices():
+        devices_now[venture_id].append((device_id, deleted))
+    splunk = collections.defaultdict(list)
+    for row in get_splunk_sizes(start, end):
+        splunk[row['device__venture_id']].append(row)
+    models = ComponentModel.objects.select_related('group').in_bulk({
+        row['model_id'] for rows in splunk.itervalues() for row in rows
+    })
+    children = collections.defaultdict(list)
+    for venture_id, parent_id in Venture.objects.values_list(
+        'id', 'parent_id',
+    ):
+        children[parent_id].append(venture_id)
+
+    def get_data(venture, venture_ids, deleted):
+        """The totals of the ventures with the given ids, including the
+        deleted devices if `deleted` is set."""
+
+        data = _report_ventures_get_totals(
+            [
+                row for venture_id in venture_ids
+                for row in costs[venture_id]
+                if deleted or not row['deleted']
+            ],
+            {
+                device_id for venture_id in venture_ids
+                for device_id, device_deleted in devices_now[venture_id]
+                if deleted or not device_deleted
+            },
+            days,
+            extra_ids,
+            len(extra_types),
+        )
         data.update({
             'id': venture.id,
-            'name': venture.name,
             'symbol': venture.symbol,
             'path': venture.path,
             'department': unicode(venture.department or ''),
             'margin': venture.get_margin(),
-            'top_level': venture.parent is None,
             'venture_icon': get_venture_icon(venture),
             'cloud_use': (
                 (data['cloud_cost'] or 0) / total_cloud_cost
             ) if total_cloud_cost else 0,
-            'splunk_cost': splunk_cost,
+            'splunk_cost': _report_ventures_get_splunk_cost(
+                [
+                    row for venture_id in venture_ids
+                    for row in splunk[venture_id]
+                ],
+                models,
+            ),
+        })
+        return data
+
+    ventures = Venture.objects.filter(id__in=ventures_ids).order_by('path')
+    result = []
+    for venture in ventures:
+        venture_ids = [venture.id]
+        # extended while iterated, with all the descendants
+        for venture_id in venture_ids:
+            venture_ids.extend(children[venture_id])
+        data = get_data(venture, venture_ids, deleted=False)
+        data.update({
+            'name': venture.name,
+            'top_level': venture.parent_id is None,
         })
         result.append(data)
-        if venture.parent is not None:
-            continue
-        if not venture.child_set.exists():
+        if venture.parent_id is not None or not children[venture.id]:
             continue
-        query = HistoryCost.objects.filter(venture=venture)
-        data = _report_ventures_get_totals(start, end, query, extra_types)
-        (
-            splunk_cost,
-            splunk_count,
-            splunk_count_now,
-            splunk_size,
-        ) = SplunkUsage.get_cost(venture, start, end, shallow=True)
+        # the costs of the top level venture itself
+        data = get_data(venture, [venture.id], deleted=True)
         data.update({
-            'id': venture.id,
             'name': '-',
-            'symbol': venture.symbol,
-            'path': venture.path,
-            'department': unicode(venture.department or ''),
-            'margin': venture.get_margin(),
             'top_level': False,
-            'venture_icon': get_venture_icon(venture),
-            'cloud_use': (
-                (data['cloud_cost'] or 0) / total_cloud_cost
-            ) if total_cloud_cost else 0,
-            'splunk_cost': splunk_cost,
         })
         result.append(data)
     return result
@@ -702,6 +733,41 @@ class ReportServices(SidebarReports, AsyncReportMixin, Base):
         return context
 
 
+class ReportPlugins(SidebarReports, Base):
+    template_name = 'ui/report_plugins.html'
+    subsection = 'plugins'
+    perms = [
+        {
+            'perm': Perm.read_device_info_reports,
+            'msg': _("You don't have permission to see reports."),
+        },
+    ]
+
+    @ralph_permission(perms)
+    def get(self, *args, **kwargs):
+        self.form = PluginStatsForm(self.request.GET or None)
+        kind, group_by, days = None, 'plugin', 1
+        if self.form.is_valid():
+            kind = self.form.cleaned_data['kind'] or None
+            group_by = self.form.cleaned_data['group_by'] or group_by
+            days = self.form.cleaned_data['days'] or days
+        runs = get_runs(days, kind)
+        self.stats = get_stats(runs, group_by)
+        self.slowest = get_slowest(runs, 20)
+        self.group_by = group_by
+        return super(ReportPlugins, self).get(*args, **kwargs)
+
+    def get_context_data(self, **kwargs):
+        context = super(ReportPlugins, self).get_context_data(**kwargs)
+        context.update({
+            'form': self.form,
+            'stats': self.stats,
+            'slowest': self.slowest,
+            'group_by': self.group_by,
+        })
+        return context
+
+
 class ReportDeviceList(object):
     template_name = 'ui/device_report_list.html'
 
@@ -8,9 +8,6 @@ import datetime
 import ipaddr
 import re
 
-import django_rq
-import rq
-
 from django.contrib import messages
 from django.core.urlresolvers import reverse
 from django.db.models import Q
@@ -20,8 +17,12 @@ from powerdns.models import Record
 from urllib import quote
 
 from ralph.account.models import Perm
-from ralph.discovery.models import ReadOnlyDevice, Device, ComponentModel
-from ralph.scan.models import ScanSummary
+from ralph.discovery.models import (
+    ComponentModel,
+    Device,
+    IPAddress,
+    ReadOnlyDevice,
+)
 from ralph.ui.forms.search import SearchForm
 from ralph.ui.views.common import (
     Addresses,
@@ -105,24 +106,11 @@ class SearchDeviceList(SidebarSearch, BaseMixin, BaseDeviceList):
 
     def _get_changed_devices_ids(self):
         delta = timezone.now() - datetime.timedelta(days=1)
-        ids = set()
-        for scan_summary in ScanSummary.objects.filter(modified__gt=delta):
-            try:
-                job = rq.job.Job.fetch(
-                    scan_summary.job_id,
-                    django_rq.get_connection(),
-                )
-            except rq.exceptions.NoSuchJobError:
-                continue
-            else:
-                if job.meta.get('changed', False):
-                    for device_id in scan_summary.ipaddress_set.values_list(
-                        'device__id',
-                        flat=True,
-                    ):
-                        if device_id:
-                            ids.add(device_id)
-        return sorted(list(ids))
+        return IPAddress.objects.filter(
+            scan_summary__modified__gt=delta,
+            scan_summary__changed=True,
+            device__isnull=False,
+        ).values_list('device_id', flat=True).distinct()
 
     def user_allowed(self):
         return True
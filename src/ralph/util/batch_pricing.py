@@ -0,0 +1,525 @@
+# -*- coding: utf-8 -*-
+
+"""
+Pricing of whole device trees at once.
+
+The functions in `ralph.util.pricing` price a single device and query the
+database for every component type, fallback group, formula and share mount
+on the way. `TreePricing` loads all of that for a set of devices in a
+handful of queries per chunk of devices and applies the same rules in
+memory. `update_cached` uses it to reprice a device
+with all its descendants and writes back only the values that changed.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import collections
+import datetime
+from decimal import Decimal
+
+from dateutil.relativedelta import relativedelta
+
+from django.db.transaction import commit_on_success
+
+from ralph.discovery.models import (
+    ComponentModel,
+    Device,
+    DeviceType,
+    DiskShare,
+    DiskShareMount,
+    FibreChannel,
+    GenericComponent,
+    HistoryCost,
+    IPAddress,
+    Memory,
+    OperatingSystem,
+    PricingFormula,
+    Processor,
+    Software,
+    SplunkUsage,
+    Storage,
+)
+from ralph.discovery.models_pricing import get_formulas, get_variables
+from ralph.util.pricing import Pricing
+
+
+# keeps the number of query parameters below the limits of the databases
+CHUNK_SIZE = 500
+# devices whose price or cost changed are updated in transactions of that
+# many devices
+WRITE_BATCH_SIZE = 100
+COMPONENT_MODELS = (
+    Processor,
+    Memory,
+    Storage,
+    GenericComponent,
+    FibreChannel,
+    Software,
+    OperatingSystem,
+)
+
+
+def chunks(items, size=CHUNK_SIZE):
+    """Splits `items` into lists of `size`."""
+
+    items = list(items)
+    for index in xrange(0, len(items), size):
+        yield items[index:index + size]
+
+
+def find_descendants(device):
+    """Returns the ids of the device and all its descendants, one query per
+    level of the tree."""
+
+    device_ids = [device.id]
+    visited = {device.id}
+    level = [device.id]
+    while level:
+        children = []
+        for chunk in chunks(level):
+            for device_id in Device.objects.filter(
+                parent_id__in=chunk,
+            ).values_list('id', flat=True):
+                if device_id in visited:
+                    # Make sure we don't do the same device twice.
+                    continue
+                visited.add(device_id)
+                children.append(device_id)
+        device_ids.extend(children)
+        level = children
+    return device_ids
+
+
+class TreePricing(Pricing):
+    """
+    The quoted prices and monthly costs of the devices with the given ids,
+    following the rules of `ralph.util.pricing`. Everything needed is loaded
+    up front. The devices referred to by the priced ones (their parents
+    and the owners of the mounted shares) are loaded as well, but they are
+    not priced. The parents are loaded with their components, the raw
+    prices of the blade systems are shared by their blade servers.
+    """
+
+    def __init__(self, device_ids, today=None):
+        super(TreePricing, self).__init__(today)
+        self.devices = {}
+        self._load_devices(device_ids)
+        self.device_ids = [
+            device_id for device_id in device_ids
+            if device_id in self.devices
+        ]
+        self._load_components()
+        self._load_shares()
+        self._load_splunk_usage()
+        self._load_formulas()
+        self._load_margins()
+        self._prices = {}
+
+    def _load_devices(self, device_ids, related=False):
+        # like the foreign keys, the related devices can be deleted ones
+        manager = Device.admin_objects if related else Device.objects
+        for chunk in chunks(device_ids):
+            for device in manager.filter(id__in=chunk).select_related(
+                'model__group',
+                'deprecation_kind',
+                'margin_kind',
+            ):
+                self.devices[device.id] = device
+        if related:
+            return
+        # the blade system of a blade server at the top of the tree
+        self.parent_ids = list({
+            device.parent_id for device in self.devices.itervalues()
+            if device.parent_id and device.parent_id not in self.devices
+        })
+        self._load_devices(self.parent_ids, related=True)
+        self.children = collections.defaultdict(list)
+        for device in self.devices.itervalues():
+            self.children[device.parent_id].append(device)
+
+    def _load_rows(self, model, device_ids=None, **kwargs):
+        """Returns the rows of `model` belonging to the priced devices, or
+        the ones with `device_ids`, read without joins. See `_make`."""
+
+        rows = []
+        for chunk in chunks(device_ids or self.device_ids):
+            rows.extend(model.objects.filter(
+                device_id__in=chunk, **kwargs
+            ).values())
+        return rows
+
+    def _make(self, model, row):
+        """Creates a component from its row, with its component model and
+        group attached from the ones loaded once for all the components."""
+
+        row = dict(row)
+        # attached before `__init__`, `Processor` guesses its cores from it
+        row['model'] = self.component_models.get(row.pop('model_id'))
+        return model(**row)
+
+    def _load_components(self):
+        device_ids = self.device_ids + self.parent_ids
+        rows = {
+            model: self._load_rows(model, device_ids)
+            for model in COMPONENT_MODELS
+        }
+        self.exported_shares = collections.defaultdict(list)
+        self.shares = {}
+        for row in self._load_rows(DiskShare):
+            self.shares[row['id']] = row
+        self.mounts = collections.defaultdict(list)
+        mounts = self._load_rows(DiskShareMount, device_ids)
+        # the mounted shares can be exported by devices outside of the tree
+        missing = {
+            row['share_id'] for row in mounts
+        } - set(self.shares)
+        for chunk in chunks(missing):
+            for row in DiskShare.objects.filter(id__in=chunk).values():
+                self.shares[row['id']] = row
+        model_ids = {
+            row['model_id']
+            for model_rows in rows.values() + [self.shares.values()]
+            for row in model_rows if row['model_id']
+        }
+        self.component_models = {}
+        for chunk in chunks(model_ids):
+            for model in ComponentModel.objects.filter(
+                id__in=chunk,
+            ).select_related('group'):
+                self.component_models[model.id] = model
+        self.components = {
+            model: collections.defaultdict(list)
+            for model in COMPONENT_MODELS
+        }
+        for model, model_rows in rows.iteritems():
+            for row in model_rows:
+                self.components[model][row['device_id']].append(
+                    self._make(model, row),
+                )
+        self.shares = {
+            share_id: self._make(DiskShare, row)
+            for share_id, row in self.shares.iteritems()
+        }
+        for share in self.shares.itervalues():
+            if share.device_id in self.devices:
+                self.exported_shares[share.device_id].append(share)
+        for row in mounts:
+            mount = DiskShareMount(**row)
+            mount.share = self.shares[mount.share_id]
+            self.mounts[mount.device_id].append(mount)
+
+    def _load_shares(self):
+        """Counts the mounts of the shares and loads the owners of the
+        shares that are mounted, but not exported, in the tree."""
+
+        self.mount_counts = collections.Counter()
+        self.physical_mount_counts = collections.Counter()
+        for chunk in chunks(self.shares):
+            for share_id, is_virtual in DiskShareMount.objects.filter(
+                share_id__in=chunk,
+            ).exclude(device=None).values_list('share_id', 'is_virtual'):
+                self.mount_counts[share_id] += 1
+                if not is_virtual:
+                    self.physical_mount_counts[share_id] += 1
+        self._load_devices({
+            share.device_id for share in self.shares.itervalues()
+            if share.device_id not in self.devices
+        }, related=True)
+
+    def _load_splunk_usage(self):
+        last_month = self.today - datetime.timedelta(days=31)
+        self.splunk_usage = collections.defaultdict(list)
+        for row in sorted(
+            self._load_rows(SplunkUsage, day__gte=last_month),
+            key=lambda row: row['day'],
+            reverse=True,
+        ):
+            self.splunk_usage[row['device_id']].append(
+                self._make(SplunkUsage, row),
+            )
+
+    def _load_formulas(self):
+        """Loads the formulas of this month's pricing groups of the owners of
+        the shares, and the values of the variables used in them."""
+
+        self.formulas = get_formulas(self.today)
+        self.variables = get_variables({
+            self.formulas[share.model.group_id, share.device_id].group_id
+            for share in self.shares.itervalues()
+            if share.model and
+            (share.model.group_id, share.device_id) in self.formulas
+        })
+
+    def _load_margins(self):
+        # `ralph.business.models` imports this module indirectly
+        from ralph.business.models import Venture
+
+        self.venture_margins = {}
+        if not any(
+            device.venture_id and not device.margin_kind_id
+            for device in self.devices.itervalues()
+        ):
+            return
+        ventures = {
+            venture_id: (parent_id, margin_kind_id, margin)
+            for venture_id, parent_id, margin_kind_id, margin
+            in Venture.objects.values_list(
+                'id', 'parent_id', 'margin_kind_id', 'margin_kind__margin',
+            )
+        }
+        for venture_id in ventures:
+            venture = venture_id
+            margin = 0
+            while venture:
+                parent_id, margin_kind_id, venture_margin = ventures[venture]
+                if margin_kind_id:
+                    margin = venture_margin
+                    break
+                venture = parent_id
+            self.venture_margins[venture_id] = margin
+
+    def get_name(self, device):
+        """The names of the devices, see `Device.get_name`."""
+
+        if not hasattr(self, 'names'):
+            self.names = {}
+            addresses = collections.defaultdict(list)
+            for chunk in chunks(self.device_ids):
+                for row in IPAddress.objects.filter(
+                    device_id__in=chunk,
+                ).order_by(
+                    'is_management', '-last_seen', '-address',
+                ).values_list('device_id', 'hostname', 'address'):
+                    addresses[row[0]].append(row[1:])
+            for device_id, rows in addresses.iteritems():
+                for hostname, address in rows:
+                    if hostname is not None:
+                        self.names[device_id] = hostname
+                        break
+                else:
+                    hostname, address = rows[0]
+                    self.names[device_id] = hostname or address
+        if device.model and device.model.type in (
+            DeviceType.rack.id,
+            DeviceType.data_center.id,
+        ):
+            return device.name
+        return self.names.get(device.id, 'unknown')
+
+    def get_parent(self, device):
+        return self.devices.get(device.parent_id)
+
+    def get_children(self, device, device_type):
+        return [
+            child for child in self.children[device.id]
+            if child.model and child.model.type == device_type.id and
+            not child.deleted
+        ]
+
+    def get_components(self, device, model):
+        return self.components[model][device.id]
+
+    def get_mounts(self, device):
+        return self.mounts[device.id]
+
+    def get_mounted_shares(self, device):
+        return [
+            share for share in self.exported_shares[device.id]
+            if self.mount_counts[share.id]
+        ]
+
+    def get_splunk_usage(self, device):
+        return self.splunk_usage[device.id]
+
+    def get_price(self, device):
+        if device.id not in self._prices:
+            self._prices[device.id] = super(TreePricing, self).get_price(
+                device,
+            )
+        return self._prices[device.id]
+
+    def _get_formula_price(self, share, size):
+        formula = self.formulas.get((share.model.group_id, share.device_id))
+        if formula is None:
+            return None
+        variables = dict(self.variables.get(formula.group_id, {}))
+        variables['size'] = Decimal(size)
+        try:
+            return float(PricingFormula.eval_formula(
+                formula.formula,
+                variables,
+            ))
+        except Exception:
+            return float('NaN')
+
+    def _is_share_deprecated(self, share):
+        device = self.devices.get(share.device_id)
+        return device is not None and device.is_deprecated()
+
+    def get_share_price(self, share):
+        """See `DiskShare.get_price`."""
+
+        if self._is_share_deprecated(share):
+            return 0
+        if not (share.model and share.model.group):
+            return 0
+        size = share.get_total_size() / 1024
+        price = self._get_formula_price(share, size)
+        if price is not None:
+            return price
+        return (share.model.group.price or 0) * size
+
+    def get_mount_price(self, mount):
+        """See `DiskShareMount.get_price`."""
+
+        share = mount.share
+        if self._is_share_deprecated(share):
+            return 0
+        if mount.size and share.model and share.model.group:
+            size = mount.get_size() / 1024
+            price = self._get_formula_price(share, size)
+            if price is not None:
+                return price
+            return (share.model.group.price or 0) * size
+        return (
+            self.get_share_price(share) /
+            (self.physical_mount_counts[share.id] or 1)
+        )
+
+    def get_margin(self, device):
+        if device.margin_kind:
+            return device.margin_kind.margin
+        elif device.venture_id:
+            return self.venture_margins[device.venture_id]
+        return 0
+
+
+def _needs_save(device):
+    """Whether `Device.save` would change more than the cached values."""
+
+    if device.purchase_date and device.deprecation_kind:
+        if device.deprecation_date != device.purchase_date + relativedelta(
+            months=device.deprecation_kind.months,
+        ):
+            return True
+    return bool(
+        device.model and
+        device.model.type == DeviceType.blade_server.id and
+        not device.position and device.get_position()
+    )
+
+
+def _save(device, **values):
+    for name, value in values.iteritems():
+        setattr(device, name, value)
+    # the history of the changes is recorded by `save`
+    with commit_on_success():
+        device.save()
+
+
+def _update_costs(devices):
+    """Writes the new cached prices and costs, without saving the whole
+    devices, and does what the `post_save` hook of the cost history would
+    have done."""
+
+    with commit_on_success():
+        for device, cost_changed in devices:
+            Device.objects.filter(id=device.id).update(
+                cached_price=device.cached_price,
+                cached_cost=device.cached_cost,
+            )
+            if device.deleted:
+                HistoryCost.end_span(device=device)
+            elif cost_changed:
+                HistoryCost.start_span(device=device)
+
+
+def _update(pricing, get_values=None):
+    """Writes back the changed values of the priced devices, children before
+    their parents. `get_values` returns the other fields to update on
+    a device, if any. Returns the number of updated devices."""
+
+    costs = []
+    updated = 0
+    for device_id in reversed(pricing.device_ids):
+        d = pricing.devices[device_id]
+        price = pricing.get_price(d)
+        cost = pricing.get_cost(d)
+        values = get_values(d) if get_values else {}
+        if _needs_save(d) or any(
+            getattr(d, name) != value for name, value in values.iteritems()
+        ):
+            _save(d, cached_price=price, cached_cost=cost, **values)
+            updated += 1
+        elif price != d.cached_price or cost != d.cached_cost:
+            old_cost = d.cached_cost or 0
+            d.cached_price = price
+            d.cached_cost = cost
+            costs.append((d, not -1 < cost - old_cost < 1))
+            if len(costs) >= WRITE_BATCH_SIZE:
+                _update_costs(costs)
+                costs = []
+            updated += 1
+    if costs:
+        _update_costs(costs)
+    return updated
+
+
+def update_cached(device):
+    """Updates the cached names, prices, costs, racks and data centers of the
+    device and all its descendants. Returns the number of updated
+    devices."""
+
+    dc = device
+    while dc and not (dc.model and dc.model.type == DeviceType.data_center):
+        dc = dc.parent
+    rack = device
+    while rack and not (rack.model and rack.model.type == DeviceType.rack):
+        rack = rack.parent
+    rack = rack.sn if rack else None
+    dc = dc.name.upper() if dc else None
+    pricing = TreePricing(find_descendants(device))
+
+    def get_values(d):
+        values = {'rack': rack, 'dc': dc}
+        name = pricing.get_name(d)
+        if name != 'unknown':
+            values['name'] = name
+        return values
+    return _update(pricing, get_values)
+
+
+def find_dependencies(device_ids):
+    """Returns the ids of the devices together with the virtual and blade
+    servers inside them, which their prices depend on."""
+
+    device_ids = list(device_ids)
+    visited = set(device_ids)
+    level = device_ids
+    while level:
+        children = []
+        for chunk in chunks(level):
+            for device_id in Device.objects.filter(
+                parent_id__in=chunk,
+                model__type__in=(
+                    DeviceType.virtual_server.id,
+                    DeviceType.blade_server.id,
+                ),
+            ).values_list('id', flat=True):
+                if device_id not in visited:
+                    visited.add(device_id)
+                    children.append(device_id)
+        device_ids.extend(children)
+        level = children
+    return device_ids
+
+
+def update_prices(device_ids):
+    """Updates the cached prices and costs of the devices (and of the ones
+    they depend on), leaving their names and locations alone. Returns the
+    number of updated devices."""
+
+    return _update(TreePricing(find_dependencies(device_ids)))
@@ -0,0 +1,305 @@
+# -*- coding: utf-8 -*-
+
+"""
+Benchmarks of the discovery and scan hot paths.
+
+Every benchmark prepares its input (the recorded samples from the tests
+scaled to `scale` times their size, or `scale` generated database objects)
+and returns the function to be measured. The function is run `repeat` times
+and its wall time and database queries are reported. Benchmarks that touch
+the database must be run against a disposable one, see the `benchmark`
+management command.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import collections
+import datetime
+import itertools
+import platform
+
+from django.db import connection
+
+from ralph import VERSION
+# the models have to be imported before the plugins
+from ralph.discovery.models import (
+    DataCenter,
+    Device,
+    DeviceType,
+    IPAddress,
+    Network,
+)
+from ralph.discovery.hardware import parse_dmidecode
+from ralph.discovery.tests.plugins.samples.puppet import facts_db_data
+from ralph.discovery.tests.samples.dmidecode_data import DATA as DMIDECODE
+from ralph.scan.data import UNIQUE_FIELDS_FOR_MERGER, set_device_data
+from ralph.scan.facts import handle_facts
+from ralph.scan.lshw import handle_lshw
+from ralph.scan.merger import merge
+from ralph.scan.metrics import Measurement, percentile
+from ralph.util import uncompress_base64_data
+from ralph.util.pricing import device_update_cached
+
+
+BENCHMARKS = collections.OrderedDict()
+
+
+def benchmark(name):
+    """Registers the decorated function as the benchmark `name`. The function
+    gets the scale and returns the function to measure."""
+
+    def decorator(func):
+        BENCHMARKS[name] = func
+        return func
+    return decorator
+
+
+def _repeat_node(data, node_id, scale):
+    """Repeats the lshw node of `node_id`, that has no subnodes, `scale`
+    times."""
+
+    start = data.index('<node id="{}"'.format(node_id))
+    end = data.index('</node>', start) + len('</node>')
+    node = data[start:end]
+    nodes = '\n'.join(
+        node.replace(
+            '<node id="{}"'.format(node_id),
+            '<node id="{}:{}"'.format(node_id, i),
+        )
+        for i in xrange(scale)
+    )
+    return data[:start] + nodes + data[end:]
+
+
+def _scale_lshw(data, scale):
+    for node_id in ('cpu', 'bank'):
+        data = _repeat_node(data, node_id, scale)
+    return data
+
+
+@benchmark('lshw')
+def lshw(scale):
+    data = _scale_lshw(
+        uncompress_base64_data(facts_db_data['lshw']).decode('utf-8'),
+        scale,
+    )
+    return lambda: handle_lshw(data, False)
+
+
+@benchmark('dmidecode')
+def dmidecode(scale):
+    blocks = []
+    for block in DMIDECODE.split('\n\n'):
+        # the processors and the memory modules
+        if 'DMI type 4,' in block or 'DMI type 17,' in block:
+            blocks.extend([block] * scale)
+        else:
+            blocks.append(block)
+    data = '\n\n'.join(blocks)
+    return lambda: parse_dmidecode(data)
+
+
+@benchmark('facts')
+def facts(scale):
+    data = dict(facts_db_data)
+    for i in xrange(scale):
+        for field in ('product', 'revision', 'size', 'vendor'):
+            data['disk_bench{}_{}'.format(i, field)] = data[
+                'disk_abc_{}'.format(field)
+            ]
+        data['disk_bench{}_serial'.format(i)] = 'BENCH{:08}'.format(i)
+    return lambda: handle_facts(data)
+
+
+def _disks(scale, plugin_name):
+    return [
+        {
+            'serial_number': 'BENCH{:08}'.format(i),
+            'label': 'disk {} from {}'.format(i, plugin_name),
+            'size': 1024 * (i + 1),
+            'family': 'Benchmark',
+            'device': 1,
+            'mount_point': '/dev/sd{}'.format(i),
+            'index': i,
+        }
+        for i in xrange(scale)
+    ]
+
+
+@benchmark('merge')
+def merge_disks(scale):
+    data = {
+        plugin_name: _disks(scale, plugin_name)
+        for plugin_name in (
+            'database',
+            'ralph.scan.plugins.puppet',
+            'ralph.scan.plugins.ssh_linux',
+        )
+    }
+    return lambda: merge('disks', data, UNIQUE_FIELDS_FOR_MERGER['disks'])
+
+
+def _serials(prefix):
+    # every run creates new objects
+    return ('{}{:08}'.format(prefix, i) for i in itertools.count())
+
+
+@benchmark('set_device_data')
+def set_device_data_(scale):
+    serials = _serials('SDD')
+    data = {
+        'model_name': 'Benchmark Server',
+        'type': 'rack server',
+        'hostname': 'bench.local',
+        'processors': [
+            {'index': i, 'label': 'CPU {}'.format(i), 'speed': 2000,
+             'cores': 4, 'model_name': 'Benchmark CPU', 'family': 'Benchmark'}
+            for i in xrange(scale)
+        ],
+        'memory': [
+            {'index': i, 'label': 'DIMM {}'.format(i), 'size': 8192}
+            for i in xrange(scale)
+        ],
+    }
+
+    def run():
+        device = Device.create(
+            sn=next(serials),
+            model_name='Benchmark Server',
+            model_type=DeviceType.rack_server,
+        )
+        run_data = dict(data, disks=[
+            dict(disk, serial_number=next(serials))
+            for disk in _disks(scale, 'bench')
+        ])
+        set_device_data(device, run_data)
+        device.save()
+    return run
+
+
+@benchmark('Device.create')
+def device_create(scale):
+    serials = _serials('DC')
+    # locally administered addresses
+    macs = ('02{:010X}'.format(i) for i in itertools.count(1))
+
+    def run():
+        for i in xrange(scale):
+            Device.create(
+                sn=next(serials),
+                ethernets=[('eth0', next(macs), 1000)],
+                model_name='Benchmark Server',
+                model_type=DeviceType.rack_server,
+            )
+    return run
+
+
+@benchmark('IPAddress.save')
+def ipaddress_save(scale):
+    Network.objects.get_or_create(
+        address='10.0.0.0/8',
+        defaults={
+            'name': 'bench',
+            'gateway': '10.0.0.1',
+            'data_center': DataCenter.objects.get_or_create(name='bench')[0],
+        },
+    )
+    numbers = itertools.count(int(0x0a000002))
+
+    def run():
+        for i in xrange(scale):
+            number = next(numbers)
+            address = IPAddress(
+                address='10.{}.{}.{}'.format(
+                    (number >> 16) & 0xff, (number >> 8) & 0xff, number & 0xff,
+                ),
+                hostname='bench-{}.local'.format(number),
+            )
+            address.save()
+            # and once more, as an update
+            address.save()
+    return run
+
+
+@benchmark('device_update_cached')
+def device_update_cached_(scale):
+    serials = _serials('DUC')
+    dc = Device.create(
+        sn=next(serials),
+        model_name='Benchmark Data Center',
+        model_type=DeviceType.data_center,
+        name='bench',
+    )
+    rack = Device.create(
+        sn=next(serials),
+        model_name='Benchmark Rack',
+        model_type=DeviceType.rack,
+        parent=dc,
+    )
+    for i in xrange(scale):
+        Device.create(
+            sn=next(serials),
+            model_name='Benchmark Server',
+            model_type=DeviceType.rack_server,
+            parent=rack,
+        )
+    return lambda: device_update_cached(dc)
+
+
+def run(names=None, scale=10, repeat=5):
+    """Runs the benchmarks (all of them if `names` is not given) and returns
+    the results as a dict that can be dumped to JSON."""
+
+    results = collections.OrderedDict()
+    for name, setup in BENCHMARKS.iteritems():
+        if names and name not in names:
+            continue
+        func = setup(scale)
+        times = []
+        queries = []
+        for i in xrange(repeat):
+            with Measurement() as measurement:
+                func()
+            times.append(measurement.duration)
+            queries.append(measurement.queries)
+        times.sort()
+        results[name] = {
+            'min': min(times),
+            'median': percentile(times, 0.5),
+            'max': max(times),
+            'queries': max(queries),
+        }
+    return collections.OrderedDict((
+        ('version', '.'.join(VERSION)),
+        ('python', platform.python_version()),
+        ('database', connection.vendor),
+        ('date', datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')),
+        ('scale', scale),
+        ('repeat', repeat),
+        ('benchmarks', results),
+    ))
+
+
+def compare(old, new):
+    """Compares two results of `run`. Returns a list of
+    `(name, old median, new median, ratio, old queries, new queries)` of the
+    benchmarks present in both."""
+
+    rows = []
+    for name, result in new['benchmarks'].iteritems():
+        if name not in old['benchmarks']:
+            continue
+        previous = old['benchmarks'][name]
+        rows.append((
+            name,
+            previous['median'],
+            result['median'],
+            result['median'] / previous['median']
+            if previous['median'] else None,
+            previous['queries'],
+            result['queries'],
+        ))
+    return rows
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+
+"""
+Process-local caches of values computed from the database.
+
+The value is kept in the memory of every process and computed again when
+a version token stored in the Django cache changes. Changing the data bumps
+the token, so that all the processes sharing the cache backend pick up the
+changes within seconds. With a per-process backend, like the default
+``LocMemCache``, other processes only see the bump of their own cache, so
+every value is also computed again at least every ``max_age`` seconds.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import threading
+import time
+import uuid
+
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+
+VERSION_TIMEOUT = 7 * 24 * 3600
+CHECK_INTERVAL = 5  # seconds
+MAX_AGE = 60  # seconds
+
+
+def after_commit(func, using=None):
+    """Calls `func` once the current transaction commits, or right away
+    outside of transaction management. The calls are dropped when the
+    transaction is rolled back."""
+
+    if not transaction.is_managed(using=using):
+        func()
+        return
+    connection = connections[using or DEFAULT_DB_ALIAS]
+    pending = getattr(connection, 'ralph_after_commit', None)
+    if pending is None:
+        pending = connection.ralph_after_commit = []
+        commit = connection.commit
+        rollback = connection.rollback
+        leave = connection.leave_transaction_management
+
+        def _call_pending():
+            calls = pending[:]
+            del pending[:]
+            for call in calls:
+                call()
+
+        def _commit():
+            commit()
+            _call_pending()
+
+        def _rollback():
+            del pending[:]
+            rollback()
+
+        def _leave():
+            leave()
+            # nothing was written, so there was nothing to commit
+            if not connection.is_managed():
+                _call_pending()
+        connection.commit = _commit
+        connection.rollback = _rollback
+        connection.leave_transaction_management = _leave
+    if func not in pending:
+        pending.append(func)
+
+
+class VersionedCache(object):
+    """A process-local value returned by `build`, computed again when the
+    version stored under `key` in the Django cache changes or when it's
+    older than `max_age` seconds."""
+
+    def __init__(self, key, build, max_age=MAX_AGE):
+        self.key = key
+        self.build = build
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.state = None
+        self.checked = 0
+
+    def invalidate(self):
+        """Forgets the value in all the processes. Called inside of
+        a transaction, the version is bumped again once it commits, so that
+        the processes which computed the value before the commit don't keep
+        it."""
+
+        self.state = None
+        self._bump()
+        after_commit(self._bump)
+
+    def get(self):
+        state = self.state
+        now = time.time()
+        if state and now - self.checked < CHECK_INTERVAL:
+            return state[2]
+        version = cache.get(self.key)
+        if version is None:
+            cache.add(self.key, uuid.uuid4().hex, VERSION_TIMEOUT)
+            version = cache.get(self.key)
+        self.checked = now
+        if state and state[1] == version and now - state[0] < self.max_age:
+            return state[2]
+        with self.lock:
+            if self.state is state:
+                self.state = now, version, self.build()
+            return self.state[2]
+
+    def _bump(self):
+        cache.set(self.key, uuid.uuid4().hex, VERSION_TIMEOUT)
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+
+"""
+Helpers for enqueueing RQ jobs.
+
+Jobs can claim in-flight keys, one for every address they work on. A key is
+claimed atomically (SET NX) with the id of the job and released by the job
+when it's done, so while a job is waiting in the queue or running, requests
+for the same work are collapsed into it instead of piling up. In case the job
+never releases them, e.g. because its worker was killed, the keys expire a
+while after the job would have timed out.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import hashlib
+import itertools
+
+from django.conf import settings
+import rq
+from rq import Queue
+from rq.job import Job, Status
+
+
+PIPELINE_SIZE = 1000
+# the time allowed for waiting in the queue, on top of the job timeout
+IN_FLIGHT_MARGIN = getattr(settings, 'JOBS_IN_FLIGHT_MARGIN', 3600)
+# the job timeout of the RQ workers when neither the job nor the queue set one
+DEFAULT_JOB_TIMEOUT = 180
+# deletes the keys still claimed by the job id given as the argument
+RELEASE_SCRIPT = """
+local released = 0
+for i, key in ipairs(KEYS) do
+    if redis.call('get', key) == ARGV[1] then
+        released = released + redis.call('del', key)
+    end
+end
+return released
+"""
+
+
+def get_in_flight_key(kind, address, what=()):
+    """Returns the in-flight key of the `kind` of work (e.g. a discovery or
+    a scan) done on the `address` with `what` (the names of the chains or
+    the plugins)."""
+
+    digest = hashlib.md5(
+        ','.join(sorted(what)).encode('utf-8'),
+    ).hexdigest()[:12]
+    return 'ralph:in-flight:{}:{}:{}'.format(kind, address, digest)
+
+
+def _get_key_timeout(queue, timeout):
+    """Returns the expiry time of the in-flight keys of a job with the
+    `timeout` enqueued on the `queue`."""
+
+    return (
+        (timeout or queue._default_timeout or DEFAULT_JOB_TIMEOUT) +
+        IN_FLIGHT_MARGIN
+    )
+
+
+def enqueue_once(queue, key, func, args=None, kwargs=None, timeout=None,
+                 result_ttl=None):
+    """Enqueues a job on the `queue` unless the in-flight `key` is already
+    claimed by another job. Returns the new job or the one in flight. The
+    latter is not fetched from Redis."""
+
+    job = Job.create(
+        func,
+        args,
+        kwargs,
+        connection=queue.connection,
+        result_ttl=result_ttl,
+        status=Status.QUEUED,
+    )
+    while not queue.connection.set(
+        key, job.id, ex=_get_key_timeout(queue, timeout), nx=True,
+    ):
+        job_id = queue.connection.get(key)
+        # otherwise the key has just been released, try again
+        if job_id is not None:
+            return Job(job_id, connection=queue.connection)
+    return queue.enqueue_job(job, timeout=timeout)
+
+
+def enqueue_many(queue, calls, timeout=None, result_ttl=None,
+                 pipeline_size=PIPELINE_SIZE):
+    """Enqueues a job on the `queue` for every `(func, args, kwargs)` in
+    `calls`. Instead of two Redis round trips per job, the jobs are sent in
+    pipelines of `pipeline_size`. Returns the list of the jobs.
+
+    A call can be given a fourth element, the in-flight keys to claim. Such
+    a job is only enqueued if it claims at least one of them."""
+
+    jobs = []
+    pipeline = queue.connection.pipeline(transaction=False)
+    # a queue writing into the pipeline instead of the connection
+    pipelined_queue = Queue(queue.name, connection=pipeline)
+    calls = iter(calls)
+    while True:
+        chunk = [
+            (
+                Job.create(
+                    call[0],
+                    call[1],
+                    call[2],
+                    connection=pipeline,
+                    result_ttl=result_ttl,
+                    status=Status.QUEUED,
+                ),
+                call[3] if len(call) > 3 else None,
+            )
+            for call in itertools.islice(calls, pipeline_size)
+        ]
+        if not chunk:
+            break
+        if any(keys is not None for job, keys in chunk):
+            chunk = _claim(
+                pipeline,
+                chunk,
+                _get_key_timeout(queue, timeout),
+            )
+        for job, keys in chunk:
+            pipelined_queue.enqueue_job(job, timeout=timeout)
+            job.connection = queue.connection
+            jobs.append(job)
+        if chunk:
+            pipeline.execute()
+    return jobs
+
+
+def _claim(pipeline, chunk, key_timeout):
+    """Claims the in-flight keys of the jobs in a single round trip and
+    returns the jobs that claimed any."""
+
+    for job, keys in chunk:
+        for key in keys or ():
+            pipeline.set(key, job.id, ex=key_timeout, nx=True)
+    claimed = iter(pipeline.execute())
+    return [
+        (job, keys) for job, keys in chunk
+        if keys is None or
+        # all the results are consumed
+        any([next(claimed) for key in keys])
+    ]
+
+
+def get_owned_keys(keys):
+    """Returns the in-flight keys that the current job should work on: the
+    ones it has claimed and the ones that have expired. Outside of workers
+    returns all the keys."""
+
+    keys = list(keys)
+    job = rq.get_current_job()
+    if job is None or not keys:
+        return keys
+    return [
+        key for key, job_id in zip(keys, job.connection.mget(keys))
+        if job_id is None or job_id == job.id
+    ]
+
+
+def release_keys(keys, job_id=None):
+    """Releases the in-flight keys claimed by the current job, or by the job
+    with `job_id` whose work the current job carries on, so that new jobs
+    can claim them. The keys that expired and were claimed by another job in
+    the meantime are left alone. Does nothing outside of workers."""
+
+    keys = list(keys)
+    job = rq.get_current_job()
+    if job is None or not keys:
+        return
+    job.connection.register_script(RELEASE_SCRIPT)(
+        keys=keys,
+        args=[job_id or job.id],
+    )
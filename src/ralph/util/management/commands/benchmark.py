@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Times the discovery and scan hot paths and counts their queries."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import json
+import sys
+import textwrap
+
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from ralph.util.benchmark import BENCHMARKS, compare, run
+
+
+class Command(BaseCommand):
+    """
+    Runs the benchmarks of the discovery and scan hot paths (parsing,
+    merging, saving devices and addresses, updating the cached prices) on
+    a fresh SQLite test database filled with generated data, and prints the
+    results as JSON. Save them to compare the next version with --compare.
+    Run it with the test settings, e.g. DJANGO_SETTINGS_PROFILE=test-ralph.
+    """
+
+    help = textwrap.dedent(__doc__).strip()
+    args = '[benchmark ...]'
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '-s',
+            '--scale',
+            dest='scale',
+            type='int',
+            default=10,
+            help='The size of the inputs, in multiples of the samples or in '
+                 'generated objects (default 10).',
+        ),
+        make_option(
+            '-r',
+            '--repeat',
+            dest='repeat',
+            type='int',
+            default=5,
+            help='Run every benchmark that many times (default 5).',
+        ),
+        make_option(
+            '-c',
+            '--compare',
+            dest='compare',
+            default=None,
+            help='Compare with the results saved in the given JSON file.',
+        ),
+        make_option(
+            '-l',
+            '--list',
+            dest='list',
+            action='store_true',
+            default=False,
+            help='List the benchmarks.',
+        ),
+    )
+
+    def handle(self, *args, **kwargs):
+        if kwargs['list']:
+            for name in BENCHMARKS:
+                print(name)
+            return
+        for name in args:
+            if name not in BENCHMARKS:
+                raise CommandError('Unknown benchmark: {}.'.format(name))
+        if connection.vendor != 'sqlite':
+            raise CommandError(
+                'The benchmarks are run on SQLite, use the test settings.',
+            )
+        # South migrates the test database just like for the tests
+        try:
+            from south.management.commands import patch_for_test_db_setup
+        except ImportError:
+            pass
+        else:
+            patch_for_test_db_setup()
+        old_name = connection.creation.create_test_db(
+            verbosity=0,
+            autoclobber=True,
+        )
+        try:
+            results = run(args, kwargs['scale'], kwargs['repeat'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+        if kwargs['compare']:
+            with open(kwargs['compare']) as f:
+                old = json.load(f)
+            print('{:<24} {:>10} {:>10} {:>7} {:>9}'.format(
+                'benchmark', old['version'], results['version'], 'ratio',
+                'queries',
+            ), file=sys.stderr)
+            for row in compare(old, results):
+                name, old_median, new_median, ratio, old_queries, queries = row
+                print(
+                    '{:<24} {:>10.4f} {:>10.4f} {:>7} {:>4}/{:<4}'.format(
+                        name, old_median, new_median,
+                        '{:.2f}'.format(ratio) if ratio else '-',
+                        old_queries, queries,
+                    ),
+                    file=sys.stderr,
+                )
+        print(json.dumps(results, indent=2))
@@ -29,3 +29,7 @@ db.signals.post_save.connect(create_api_key_ignore_dberrors, sender=User)
 
 from django.contrib.auth.tests import models as auth_test_models
 del auth_test_models.ProfileTestCase.test_site_profile_not_available
+
+
+# Register the receivers marking the devices to reprice
+import ralph.util.repricing  # noqa
@@ -9,16 +9,29 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+from multiprocessing.pool import ThreadPool
+import collections
+import logging
+import os
+import select
 import socket
+import struct
 import sys
+import threading
+import time
 import StringIO
 
 from dns.exception import DNSException
-from lck.cache import memoize
 import dns.resolver
+import dns.reversename
 import ipaddr
 import paramiko
-from ping import do_one
+from ping import do_one, send_one_ping
+
+
+ICMP_ECHO_REPLY = 0
+
+logger = logging.getLogger(__name__)
 
 
 class Error(Exception):
@@ -31,17 +44,147 @@ class AuthError(Error):
     pass
 
 
-@memoize
+class TTLCache(object):
+    """A thread-safe cache of answers holding at most `max_size` entries.
+    Answers expire after `ttl` seconds, empty answers after `negative_ttl`
+    seconds. The least recently used entries are evicted first."""
+
+    def __init__(self, max_size=10000, ttl=300, negative_ttl=60):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """Returns a tuple of `(found, value)`."""
+        with self.lock:
+            try:
+                expires, value = self.entries.pop(key)
+            except KeyError:
+                return False, None
+            if expires < time.time():
+                return False, None
+            self.entries[key] = expires, value
+            return True, value
+
+    def set(self, key, value):
+        ttl = self.ttl if value else self.negative_ttl
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = time.time() + ttl, value
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class Resolver(object):
+    """Cached DNS lookups. Batches of lookups are done in parallel by
+    `workers` threads. Every single query gives up after `timeout`
+    seconds."""
+
+    def __init__(self, timeout=2, workers=16, **cache_options):
+        self.timeout = timeout
+        self.workers = workers
+        self.cache = TTLCache(**cache_options)
+        self._resolver = None
+
+    @property
+    def resolver(self):
+        if self._resolver is None:
+            resolver = dns.resolver.Resolver()
+            resolver.lifetime = self.timeout
+            self._resolver = resolver
+        return self._resolver
+
+    def hostname(self, ip, reverse=False):
+        """See `hostname()`."""
+        key = ('A' if reverse else 'PTR', unicode(ip))
+        found, value = self.cache.get(key)
+        if not found:
+            value = self._hostname(unicode(ip), reverse)
+            self.cache.set(key, value)
+        return value
+
+    def hostnames(self, ips, reverse=False):
+        """Returns a dictionary mapping every one of `ips` to the result of
+        `hostname()`, doing the lookups that aren't cached in parallel."""
+        ips = list(ips)
+        if len(ips) < 2 or self.workers < 2:
+            return {ip: self.hostname(ip, reverse) for ip in ips}
+        pool = ThreadPool(min(self.workers, len(ips)))
+        try:
+            results = pool.map(lambda ip: self.hostname(ip, reverse), ips)
+        finally:
+            pool.close()
+            pool.join()
+        return dict(zip(ips, results))
+
+    def descriptions(self, host):
+        """See `descriptions()`."""
+        host = self.hostname(host)
+        if not host:
+            return []
+        key = ('TXT', host)
+        found, value = self.cache.get(key)
+        if not found:
+            value = [
+                str(answer).strip('"') for answer in self._query(host, 'TXT')
+            ]
+            self.cache.set(key, value)
+        return list(value)
+
+    def _hostname(self, host, reverse):
+        value = self._dns_hostname(host, reverse)
+        if value is not None:
+            return value
+        # the system resolver also knows /etc/hosts, NIS and the like
+        try:
+            result = socket.gethostbyaddr(str(host))
+        except (socket.error, UnicodeError):
+            return None
+        return result[0] if not reverse else result[2][0]
+
+    def _dns_hostname(self, host, reverse):
+        try:
+            address = unicode(ipaddr.IPAddress(host))
+        except ValueError:
+            answers = self._query(host, 'A')
+            if not answers:
+                return None
+            address = unicode(answers[0])
+        if reverse:
+            return address
+        answers = self._query(dns.reversename.from_address(address), 'PTR')
+        if not answers:
+            return None
+        return unicode(answers[0]).rstrip('.')
+
+    def _query(self, name, rdtype):
+        try:
+            return list(self.resolver.query(name, rdtype))
+        except DNSException: # dns.resolver.NXDOMAIN, dns.resolver.NoAnswer
+            return []
+
+
+RESOLVER = Resolver()
+
+
 def hostname(ip, reverse=False):
     """hostname(ip) -> 'hostname'
 
     `ip` may be a string or ipaddr.IPAddress instance.
     If no hostname known, returns None."""
-    try:
-        result = socket.gethostbyaddr(str(ip))
-        return result[0] if not reverse else result[2][0]
-    except socket.error:
-        return None
+    return RESOLVER.hostname(ip, reverse)
+
+def hostnames(ips, reverse=False):
+    """hostnames(ips) -> {'ip': 'hostname', ...}
+
+    Does `hostname()` for a batch of addresses in parallel."""
+    return RESOLVER.hostnames(ips, reverse)
 
 def descriptions(host):
     """descriptions(host) -> ['descriptive text 1', 'descriptive text 2', ...]
@@ -49,15 +192,7 @@ def descriptions(host):
     Lists DNS descriptive text for the specified `host`. `host` may be a string
     holding a hostname or IP, or ipaddr.IPAddress instance. If no descriptions
     are known, the returned list is empty."""
-    host = hostname(str(host))
-    result = []
-    if host:
-        try:
-            for answer in dns.resolver.query(host, 'TXT'):
-                result.append(str(answer).strip('"'))
-        except DNSException: # dns.resolver.NXDOMAIN, dns.resolver.NoAnswer
-            pass
-    return result
+    return RESOLVER.descriptions(host)
 
 def ping(hostname, timeout=0.2, attempts=2, packet_size=64):
     """ping(hostname, [timeout, attempts, packet_size]) -> float
@@ -73,6 +208,73 @@ def ping(hostname, timeout=0.2, attempts=2, packet_size=64):
             result = None
     return result
 
+def ping_many(hostnames, timeout=0.2, attempts=2, packet_size=64):
+    """ping_many(hostnames, [timeout, attempts, packet_size]) -> dict
+
+    Pings all the specified `hostnames` at once using a single raw socket.
+    Echo requests for all of them are sent first and the replies are
+    collected afterwards, so a batch of dead hosts costs `timeout` seconds
+    per attempt in total instead of per host. Returns a dictionary mapping
+    each of `hostnames` to its ping value or None if it didn't answer.
+
+    If the raw socket can't be opened (e.g. without CAP_NET_RAW), falls back
+    to `ping()` for every host."""
+    result = dict.fromkeys(hostnames)
+    try:
+        my_socket = socket.socket(
+            socket.AF_INET,
+            socket.SOCK_RAW,
+            socket.getprotobyname(b'icmp'),
+        )
+    except socket.error as e:
+        logger.warning(
+            "Can't open a raw socket (%s), pinging the hosts one by one.", e,
+        )
+        for hostname in hostnames:
+            result[hostname] = ping(hostname, timeout, attempts, packet_size)
+        return result
+    my_id = os.getpid() & 0xFFFF
+    try:
+        for i in xrange(attempts):
+            pending = {}
+            for hostname in hostnames:
+                if result[hostname] is not None:
+                    continue
+                try:
+                    address = socket.gethostbyname(str(hostname))
+                    send_one_ping(my_socket, address, my_id, packet_size)
+                except socket.error:
+                    continue
+                pending.setdefault(address, []).append(hostname)
+            deadline = time.time() + timeout
+            while pending:
+                time_left = deadline - time.time()
+                if time_left <= 0:
+                    break
+                try:
+                    if not select.select([my_socket], [], [], time_left)[0]:
+                        break
+                    time_received = time.time()
+                    packet, (address, port) = my_socket.recvfrom(1024)
+                except (select.error, socket.error) as e:
+                    logger.warning("Receiving the ping replies failed: %s", e)
+                    break
+                icmp_type, code, checksum, packet_id, sequence = struct.unpack(
+                    b'bbHHh',
+                    packet[20:28],
+                )
+                if (icmp_type != ICMP_ECHO_REPLY or packet_id != my_id or
+                        address not in pending):
+                    continue
+                time_sent = struct.unpack(b'd', packet[28:36])[0]
+                for hostname in pending.pop(address):
+                    result[hostname] = time_received - time_sent
+            if all(value is not None for value in result.itervalues()):
+                break
+    finally:
+        my_socket.close()
+    return result
+
 def ping_main(hostname=None, timeout=0.2, attempts=2):
     """ping as a command. Installed as pping by setuptools."""
     # FIXME: This needs proper argparse support.
@@ -107,6 +309,174 @@ def connect_ssh(ip, username, password=None, client=paramiko.SSHClient, key=None
     return ssh
 
 
+def _is_active(ssh):
+    transport = ssh.get_transport()
+    return transport is not None and transport.is_active()
+
+
+class SSHPool(object):
+    """Keeps the SSH connections of this worker process open, so that
+    plugins talking to the same host don't repeat the key exchange and the
+    authentication. Every connection is lent to one caller at a time and
+    closed after being idle for `idle_timeout` seconds. At most `max_idle`
+    connections are kept."""
+
+    def __init__(self, idle_timeout=60, max_idle=32):
+        self.idle_timeout = idle_timeout
+        self.max_idle = max_idle
+        self.idle = [] # (released, key, ssh), the oldest first
+        self.lent = {}
+        self.lock = threading.Lock()
+        self.pid = os.getpid()
+
+    def connect(self, ip, username, password=None, key=None):
+        """Like `connect_ssh()`, reusing an idle connection if possible.
+        Pass the result to `release()` instead of closing it."""
+        pool_key = (unicode(ip), username, password, key)
+        while True:
+            with self.lock:
+                stale = self._expire()
+                for i, (released, k, ssh) in enumerate(self.idle):
+                    if k == pool_key:
+                        del self.idle[i]
+                        break
+                else:
+                    ssh = None
+            self._close(stale)
+            if ssh is None or _is_active(ssh):
+                break
+            ssh.close()
+        if ssh is None:
+            ssh = connect_ssh(ip, username, password, key=key)
+        with self.lock:
+            self.lent[id(ssh)] = pool_key
+        return ssh
+
+    def release(self, ssh):
+        """Returns a connection obtained from `connect()` to the pool."""
+        with self.lock:
+            self._check_pid()
+            pool_key = self.lent.pop(id(ssh), None)
+            if pool_key is not None and _is_active(ssh):
+                self.idle.append((time.time(), pool_key, ssh))
+                ssh = None
+            stale = self._expire()
+        if ssh is not None:
+            stale.append(ssh)
+        self._close(stale)
+
+    def clear(self):
+        with self.lock:
+            self._check_pid()
+            stale = [ssh for released, key, ssh in self.idle]
+            del self.idle[:]
+        self._close(stale)
+
+    def _check_pid(self):
+        if self.pid != os.getpid():
+            # connections inherited from the parent process belong to it
+            self.pid = os.getpid()
+            self.idle = []
+            self.lent = {}
+
+    def _expire(self):
+        self._check_pid()
+        deadline = time.time() - self.idle_timeout
+        stale = []
+        while self.idle and (
+            len(self.idle) > self.max_idle or self.idle[0][0] < deadline
+        ):
+            stale.append(self.idle.pop(0)[2])
+        return stale
+
+    def _close(self, connections):
+        for ssh in connections:
+            try:
+                ssh.close()
+            except Exception:
+                pass
+
+
+SSH_POOL = SSHPool()
+
+
+def exec_commands(ssh, commands, max_channels=8, timeout=60):
+    """Runs all the `commands` over the single transport of `ssh`, each in its
+    own channel, with at most `max_channels` of them running concurrently
+    (OpenSSH allows 10 sessions per connection by default). A batch of
+    channels still running after `timeout` seconds raises `socket.timeout`.
+
+    Returns a dictionary mapping every command to its `(stdout, stderr)`."""
+    transport = ssh.get_transport()
+    pending = list(collections.OrderedDict.fromkeys(commands))
+    results = {}
+    while pending:
+        batch, pending = pending[:max_channels], pending[max_channels:]
+        channels = []
+        try:
+            for command in batch:
+                channel = transport.open_session()
+                channel.exec_command(command)
+                channel.shutdown_write()
+                channels.append((command, channel))
+            results.update(_read_channels(channels, timeout))
+        finally:
+            for command, channel in channels:
+                channel.close()
+    return results
+
+
+def _read_channels(channels, timeout):
+    """Reads the output of all the `(command, channel)` pairs until the
+    commands finish. Both streams are read as the data comes, so that no
+    command blocks on a full buffer of the stream not being read."""
+    deadline = time.time() + timeout
+    outputs = {command: ([], []) for command, channel in channels}
+    running = dict(channels)
+    while running:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            raise socket.timeout(
+                "Timed out running {}.".format(", ".join(running)),
+            )
+        # a channel is readable when any of its streams has data or ended
+        select.select(running.values(), [], [], remaining)
+        for command, channel in running.items():
+            stdout, stderr = outputs[command]
+            # checked first, the last data can come together with the end
+            eof = channel.eof_received
+            while channel.recv_ready():
+                stdout.append(channel.recv(4096))
+            while channel.recv_stderr_ready():
+                stderr.append(channel.recv_stderr(4096))
+            if eof:
+                del running[command]
+    return {
+        command: (b''.join(stdout), b''.join(stderr))
+        for command, (stdout, stderr) in outputs.iteritems()
+    }
+
+
+class BatchedSSH(object):
+    """Wraps an `SSHClient`, running the `commands` at once with
+    `exec_commands()`. Calls to `exec_command()` are then answered from those
+    results, each of them once. Other commands are run as usual."""
+
+    def __init__(self, ssh, commands, **kwargs):
+        self.ssh = ssh
+        self.results = exec_commands(ssh, commands, **kwargs)
+
+    def exec_command(self, command):
+        try:
+            stdout, stderr = self.results.pop(command)
+        except KeyError:
+            return self.ssh.exec_command(command)
+        return None, StringIO.StringIO(stdout), StringIO.StringIO(stderr)
+
+    def __getattr__(self, name):
+        return getattr(self.ssh, name)
+
+
 def validate_ip(address):
     ip = ipaddr.IPAddress(address)
     if ip.is_unspecified or ip.is_loopback or ip.is_link_local:
@@ -77,6 +77,16 @@ def prioritize(chain, plugins):
     )
 
 
+def runnable(chain, requirements, done_requirements):
+    """
+    Returns the plugins on a specified `chain` that can be run given the
+    plugins that succeeded (`requirements`) and the ones that have already
+    been ran (`done_requirements`), sorted in descending priority. All their
+    requirements are already met, so they can be run concurrently.
+    """
+    return prioritize(chain, next(chain, requirements) - set(done_requirements))
+
+
 def run(chain, func_name, **kwargs):
     """
     Run a single plugin by a name.
@@ -11,298 +11,344 @@ from datetime import date, timedelta
 
 from django.core.urlresolvers import reverse_lazy
 from django.db import models as db
-from django.db.transaction import commit_on_success
 from django.utils.html import escape
 from django.conf import settings
 
 from ralph.discovery.models import (
     ComponentModelGroup,
-    Device,
     DeviceType,
     DiskShare,
     EthernetSpeed,
+    FibreChannel,
+    GenericComponent,
+    Memory,
     OperatingSystem,
+    Processor,
+    Software,
+    Storage,
 )
 
 
-def get_device_price(device):
+class Pricing(object):
     """
-    The quoted price, including all subtractions and additions from other
-    devices.
+    The rules for the quoted prices and monthly costs of devices. The data
+    of the devices is read from the database as needed, one device at
+    a time. `ralph.util.batch_pricing.TreePricing` overrides the methods
+    reading it, to load it for whole device trees at once.
     """
-    if device.deleted:
+
+    def __init__(self, today=None):
+        self.today = today or date.today()
+
+    def get_parent(self, device):
+        return device.parent
+
+    def get_children(self, device, device_type):
+        """The devices of `device_type` inside the device, not deleted."""
+
+        return device.child_set.filter(
+            model__type=device_type.id,
+            deleted=False,
+        )
+
+    def get_components(self, device, model):
+        return model.objects.filter(device=device)
+
+    def get_os(self, device):
+        for os in self.get_components(device, OperatingSystem):
+            return os
+
+    def get_mounts(self, device):
+        return device.disksharemount_set.all()
+
+    def get_mounted_shares(self, device):
+        """The shares exported by the device and mounted on some device."""
+
+        return [
+            share for share in device.diskshare_set.all()
+            if share.disksharemount_set.exclude(device=None).exists()
+        ]
+
+    def get_share_price(self, share):
+        return share.get_price()
+
+    def get_mount_price(self, mount):
+        return mount.get_price()
+
+    def get_margin(self, device):
+        return device.get_margin()
+
+    def get_splunk_usage(self, device):
+        """The Splunk usage of the last month, the latest first."""
+
+        return device.splunkusage_set.filter(
+            day__gte=self.today - timedelta(days=31),
+        ).order_by('-day')
+
+    def get_price(self, device):
+        """
+        The quoted price, including all subtractions and additions from other
+        devices.
+        """
+        if device.deleted:
+            return 0
+        price = self.get_raw_price(device)
+        price += self.get_external_price(device)
+        return max(0, price)
+
+    def get_external_price(self, device):
+        """The price of all external subtractions additions for a device."""
+
+        price = 0
+        # Subtract the price of virtual servers, so they don't count 2x
+        price -= self.get_virtuals_price(device)
+        # Subtract the price of exported disk shares
+        price -= self.get_exported_storage_price(device)
+        if device.model and device.model.type == DeviceType.blade_system.id:
+            # Subtract the prices taken by blades
+            for d in self.get_children(device, DeviceType.blade_server):
+                price -= self.get_chassis_price(d)
+        elif device.model and device.model.type == DeviceType.blade_server.id:
+            # Add the price taken from the blade system
+            price += self.get_chassis_price(device)
+        # Add the prices of the remote disk shares
+        price += math.fsum(
+            self.get_mount_price(m) for m in self.get_mounts(device)
+        )
+        return price
+
+    def get_raw_price(self, device, ignore_deprecation=False):
+        """Purchase price of this device, before anything interacts with
+        it."""
+
+        if (device.deleted or
+            (not ignore_deprecation and device.is_deprecated())):
+            return 0
+        return device.price or self.get_auto_price(device)
+
+    def get_cost(self, device, ignore_deprecation=False):
+        """Return the monthly cost of this device."""
+
+        price = self.get_price(device)
+        cost = 0
+        if not device.deleted and device.deprecation_kind is not None:
+            if not device.is_deprecated() or ignore_deprecation:
+                cost = price / device.deprecation_kind.months
+        margin = self.get_margin(device) or 0
+        return cost * (1 + margin / 100) + self.get_additional_costs(device)
+
+    def get_additional_costs(self, device):
+        """Return additional monthly costs for this device, e.g. Splunk
+        usage."""
+
+        usage = list(self.get_splunk_usage(device))
+        if usage:
+            size = sum(splunk.size or 0 for splunk in usage)
+            return usage[0].get_price(size=size)
+        return 0
+
+    def get_chassis_price(self, device, ignore_deprecation=False):
+        """
+        Part of the chassis price that should be added to the blade
+        server's price.
+        """
+
+        parent = self.get_parent(device)
+        if (device.model and device.model.group and
+            device.model.group.slots and parent and parent.model and
+            parent.model.group and parent.model.group.slots and
+            not device.deleted):
+            parent_price = self.get_raw_price(
+                parent,
+                ignore_deprecation=ignore_deprecation,
+            )
+            if parent_price > 0:
+                return (
+                    device.model.group.slots * parent_price /
+                    parent.model.group.slots
+                )
         return 0
-    price = get_device_raw_price(device)
-    price += get_device_external_price(device)
-    return max(0, price)
+
+    def get_virtuals_price(self, device):
+        """Calculate the total price of all virtual servers inside."""
+
+        return math.fsum(
+            self.get_price(d)
+            for d in self.get_children(device, DeviceType.virtual_server)
+        )
+
+    def get_exported_storage_price(self, device):
+        return math.fsum(
+            self.get_share_price(s) for s in self.get_mounted_shares(device)
+        )
+
+    def get_components_price(self, device, model):
+        return math.fsum(
+            c.get_price() for c in self.get_components(device, model)
+        )
+
+    def get_cpu_price(self, device):
+        price = self.get_components_price(device, Processor)
+        if not price and device.model and device.model.type in {
+                DeviceType.rack_server.id,
+                DeviceType.blade_server.id
+            }:
+            # Fall back to OperatingSystem-visible cores, and then to default
+            group = ComponentModelGroup.fallbacks.get('OS Detected CPU')
+            os = self.get_os(device) if group else None
+            if os and os.cores_count:
+                return os.cores_count * group.price
+            group = ComponentModelGroup.fallbacks.get('Default CPU')
+            if group:
+                return group.price
+        return price
+
+    def get_memory_price(self, device):
+        price = math.fsum(
+            m.get_price() for m in self.get_components(device, Memory)
+            if m.model
+        )
+        if (not price and device.model and
+            device.model.type in (
+                DeviceType.rack_server.id, DeviceType.blade_server.id,
+                DeviceType.virtual_server.id)):
+            group = ComponentModelGroup.fallbacks.get('OS Detected Memory')
+            os = self.get_os(device) if group else None
+            if os:
+                if not group.per_size:
+                    return group.price or 0
+                if os.memory:
+                    return (os.memory /
+                            (group.size_modifier or 1)) * (group.price or 0)
+            group = ComponentModelGroup.fallbacks.get('Default Memory')
+            if group:
+                return group.price
+        return price
+
+    def get_local_storage_price(self, device):
+        price = self.get_components_price(device, Storage)
+        if not price and device.model and device.model.type in (
+                DeviceType.rack_server.id, DeviceType.blade_server.id,
+                DeviceType.virtual_server.id):
+            group = ComponentModelGroup.fallbacks.get('OS Detected Storage')
+            os = self.get_os(device) if group else None
+            if os:
+                if not group.per_size:
+                    return group.price or 0
+                else:
+                    storage = os.storage or 0
+                    remote_storage_size = math.fsum(
+                        m.get_size() for m in self.get_mounts(device)
+                    )
+                    storage -= remote_storage_size
+                    if storage > 0:
+                        return (storage / (group.size_modifier or 1)) * (
+                            group.price or 0)
+            if device.model.type != DeviceType.virtual_server.id:
+                group = ComponentModelGroup.fallbacks.get('Default Disk')
+                if group:
+                    return group.price
+        return price
+
+    def get_auto_price(self, device):
+        """Calculate the total price of all components."""
+
+        model_price = (device.model.group.price or 0) if (
+            device.model and device.model.group) else 0
+        return math.fsum([
+            model_price,
+            self.get_memory_price(device),
+            self.get_cpu_price(device),
+            self.get_local_storage_price(device),
+        ] + [
+            self.get_components_price(device, model)
+            for model in (
+                GenericComponent,
+                FibreChannel,
+                Software,
+                OperatingSystem,
+            )
+        ])
+
+
+def get_device_price(device):
+    return Pricing().get_price(device)
 
 
 def get_device_external_price(device):
-    """The price of all external subtractions additions for a device."""
-
-    price = 0
-    # Subtract the price of virtual servers, so they don't count 2x
-    price -= get_device_virtuals_price(device)
-    # Subtract the price of exported disk shares
-    price -= get_device_exported_storage_price(device)
-    if device.model and device.model.type == DeviceType.blade_system.id:
-        # Subtract the prices taken by blades
-        for d in device.child_set.filter(
-                model__type=DeviceType.blade_server.id,
-                deleted=False,
-            ):
-            price -= get_device_chassis_price(d)
-    elif device.model and device.model.type == DeviceType.blade_server.id:
-        # Add the price taken from the blade system
-        price += get_device_chassis_price(device)
-    # Add the prices of the remote disk shares
-    remote_storage_price = math.fsum(m.get_price()
-                                     for m in device.disksharemount_set.all())
-    price += remote_storage_price
-    return price
+    return Pricing().get_external_price(device)
 
 
 def get_device_raw_price(device, ignore_deprecation=False):
-    """Purchase price of this device, before anything interacts with it."""
-    if (device.deleted or (not ignore_deprecation and device.is_deprecated())
-    ):
-        return 0
-    return device.price or get_device_auto_price(device)
+    return Pricing().get_raw_price(
+        device,
+        ignore_deprecation=ignore_deprecation,
+    )
 
 
 def get_device_cost(device, ignore_deprecation=False):
-    """Return the monthly cost of this device."""
-
-    price = get_device_price(device)
-    cost = 0
-    if not device.deleted and device.deprecation_kind is not None:
-        if not device.is_deprecated() or ignore_deprecation:
-            cost = price / device.deprecation_kind.months
-    margin = device.get_margin() or 0
-    cost = cost * (1 + margin / 100) + get_device_additional_costs(device)
-    return cost
+    return Pricing().get_cost(device, ignore_deprecation=ignore_deprecation)
 
 
 def get_device_additional_costs(device):
-    """Return additional monthly costs for this device, e.g. Splunk usage."""
-
-    cost = 0
-    last_month = date.today() - timedelta(days=31)
-    splunk = device.splunkusage_set.filter(
-        day__gte=last_month).order_by('-day')
-    if splunk.count():
-        size = splunk.aggregate(db.Sum('size'))['size__sum'] or 0
-        cost += splunk[0].get_price(size=size)
-    return cost
+    return Pricing().get_additional_costs(device)
 
 
 def get_device_chassis_price(device, ignore_deprecation=False):
-    """
-    Part of the chassis price that should be added to the blade
-    server's price.
-    """
-
-    if (device.model and device.model.group and device.model.group.slots and
-        device.parent and device.parent.model and device.parent.model.group and
-        device.parent.model.group.slots and not device.deleted):
-        device_price = get_device_raw_price(
-            device.parent,
-            ignore_deprecation=ignore_deprecation,
-        )
-        if device_price > 0:
-            chassis_price = (
-                device.model.group.slots *
-                get_device_raw_price(device.parent, ignore_deprecation=ignore_deprecation) /
-                device.parent.model.group.slots)
-        else:
-            chassis_price = 0
-    else:
-        chassis_price = 0
-    return chassis_price
+    return Pricing().get_chassis_price(
+        device,
+        ignore_deprecation=ignore_deprecation,
+    )
 
 
 def get_device_virtuals_price(device):
-    """Calculate the total price of all virtual servers inside."""
-
-    price = math.fsum(
-        get_device_price(dev) for dev in
-        device.child_set.filter(
-            model__type=DeviceType.virtual_server.id,
-            deleted=False,
-        )
-    )
-    return price
+    return Pricing().get_virtuals_price(device)
 
 
 def get_device_cpu_price(device):
-    price = math.fsum(cpu.get_price() for cpu in device.processor_set.all())
-    if not price and device.model and device.model.type in {
-            DeviceType.rack_server.id,
-            DeviceType.blade_server.id
-        }:
-        # Fall back to OperatingSystem-visible cores, and then to default
-        try:
-            os = OperatingSystem.objects.get(device=device)
-            group = ComponentModelGroup.objects.get(name='OS Detected CPU')
-        except (OperatingSystem.DoesNotExist,
-                ComponentModelGroup.DoesNotExist):
-            pass
-        else:
-            if os.cores_count:
-                return os.cores_count * group.price
-        try:
-            group = ComponentModelGroup.objects.get(name='Default CPU')
-        except ComponentModelGroup.DoesNotExist:
-            pass
-        else:
-            return group.price
-    return price
+    return Pricing().get_cpu_price(device)
 
 
 def get_device_memory_price(device):
-    price = math.fsum(
-        m.get_price() for m in device.memory_set.all() if m.model)
-    if (not price and device.model and
-        device.model.type in (
-            DeviceType.rack_server.id, DeviceType.blade_server.id,
-            DeviceType.virtual_server.id)):
-        try:
-            os = OperatingSystem.objects.get(device=device)
-            group = ComponentModelGroup.objects.get(name='OS Detected Memory')
-        except (OperatingSystem.DoesNotExist,
-                ComponentModelGroup.DoesNotExist):
-            pass
-        else:
-            if not group.per_size:
-                return group.price or 0
-            if os.memory:
-                return (os.memory /
-                        (group.size_modifier or 1)) * (group.price or 0)
-        try:
-            group = ComponentModelGroup.objects.get(name='Default Memory')
-        except ComponentModelGroup.DoesNotExist:
-            pass
-        else:
-            return group.price
-    return price
+    return Pricing().get_memory_price(device)
 
 
 def get_device_local_storage_price(device):
-    price = math.fsum(s.get_price() for s in device.storage_set.all())
-    if not price and device.model and device.model.type in (
-            DeviceType.rack_server.id, DeviceType.blade_server.id,
-            DeviceType.virtual_server.id):
-        try:
-            os = OperatingSystem.objects.get(device=device)
-            group = ComponentModelGroup.objects.get(name='OS Detected Storage')
-        except (OperatingSystem.DoesNotExist,
-                ComponentModelGroup.DoesNotExist):
-            pass
-        else:
-            if not group.per_size:
-                return group.price or 0
-            else:
-                storage = os.storage or 0
-                remote_storage_size = math.fsum(
-                    m.get_size() for m in device.disksharemount_set.all()
-                )
-                storage -= remote_storage_size
-                if storage > 0:
-                    return (storage /
-                            (group.size_modifier or 1)) * (group.price or 0)
-        if device.model.type != DeviceType.virtual_server.id:
-            try:
-                group = ComponentModelGroup.objects.get(name='Default Disk')
-            except ComponentModelGroup.DoesNotExist:
-                pass
-            else:
-                return group.price
-    return price
+    return Pricing().get_local_storage_price(device)
 
 
 def get_device_exported_storage_price(device):
-    return math.fsum(
-        s.get_price() for s in device.diskshare_set.all()
-        if s.disksharemount_set.exclude(device=None).count())
+    return Pricing().get_exported_storage_price(device)
 
 
 def get_device_components_price(device):
-    return math.fsum(c.get_price() for c in device.genericcomponent_set.all())
+    return Pricing().get_components_price(device, GenericComponent)
 
 
 def get_device_fc_price(device):
-    return math.fsum(fc.get_price() for fc in device.fibrechannel_set.all())
+    return Pricing().get_components_price(device, FibreChannel)
 
 
 def get_device_software_price(device):
-    return math.fsum(s.get_price() for s in device.software_set.all())
+    return Pricing().get_components_price(device, Software)
 
 
 def get_device_operatingsystem_price(device):
-    return math.fsum(os.get_price() for os in device.operatingsystem_set.all())
+    return Pricing().get_components_price(device, OperatingSystem)
 
 
 def get_device_auto_price(device):
-    """Calculate the total price of all components."""
-
-    model_price = (device.model.group.price or 0) if (
-        device.model and device.model.group) else 0
-    return math.fsum([
-        model_price,
-        get_device_memory_price(device),
-        get_device_cpu_price(device),
-        get_device_local_storage_price(device),
-        get_device_components_price(device),
-        get_device_fc_price(device),
-        get_device_software_price(device),
-        get_device_operatingsystem_price(device),
-    ])
-
-
-@commit_on_success
-def find_descendant(device):
-    stack = [device.id]
-    device_ids = []
-    visited = {device.id}
-    while stack:
-        device_id = stack.pop()
-        device_ids.append(device_id)
-        for d_id, in Device.objects.filter(
-                parent_id=device_id
-            ).values_list('id'):
-            if d_id in visited:
-                # Make sure we don't do the same device twice.
-                continue
-            visited.add(d_id)
-            stack.append(d_id)
-    return device_ids
+    return Pricing().get_auto_price(device)
 
 
 def device_update_cached(device):
-    dc = device
-    while dc and not (dc.model and dc.model.type == DeviceType.data_center):
-        dc = dc.parent
-    rack = device
-    while rack and not (rack.model and rack.model.type == DeviceType.rack):
-        rack = rack.parent
-    device_ids = find_descendant(device)
-    device_ids.reverse()   # Do the children before their parent.
-    step = 10
-    for index in xrange(0, len(device_ids), step):
-        _update_batch(device_ids[index:index + step], rack, dc)
-
-
-@commit_on_success
-def _update_batch(device_ids, rack, dc):
-    for d in Device.objects.filter(id__in=device_ids):
-        name = d.get_name()
-        if name != 'unknown':
-            d.name = name
-        d.cached_price = get_device_price(d)
-        d.cached_cost = get_device_cost(d)
-        d.rack = rack.sn if rack else None
-        d.dc = dc.name.upper() if dc else None
-        d.save()
+    """Updates the cached prices, costs and names of the device and all its
+    descendants. The whole tree is priced at once, see
+    `ralph.util.batch_pricing`."""
+
+    # `ralph.util.batch_pricing` builds on the rules of this module
+    from ralph.util.batch_pricing import update_cached
+    update_cached(device)
 
 
 def details_dev(dev, purchase_only=False, ignore_deprecation=False):
@@ -0,0 +1,413 @@
+# -*- coding: utf-8 -*-
+
+"""
+Incremental repricing of the devices affected by changes.
+
+Changes of components, device and component models, their groups, pricing
+groups and the pricing-related fields of devices mark the changed objects
+as dirty in a set in Redis. A single job at a time, `reprice_dirty`, drains
+the set in batches and updates the cached prices and costs of the affected
+devices, their parents and the devices mounting their disk shares, instead
+of repricing everything synchronously in the request that made the change.
+The events are only recorded when `REPRICING_QUEUE` is set. They are
+written to Redis once the transaction commits, or once a `batched` block,
+e.g. the run of a discovery plugin, ends.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import collections
+import contextlib
+import threading
+
+from django.conf import settings
+from django.db.models import Q
+from django.db.models.signals import (
+    m2m_changed,
+    post_delete,
+    post_save,
+    pre_delete,
+)
+from django.dispatch import receiver
+import django_rq
+
+from ralph.discovery.models import (
+    ComponentModel,
+    ComponentModelGroup,
+    Device,
+    DeviceModel,
+    DeviceType,
+    DeviceModelGroup,
+    DiskShare,
+    DiskShareMount,
+    FibreChannel,
+    GenericComponent,
+    Memory,
+    OperatingSystem,
+    PricingFormula,
+    PricingGroup,
+    PricingValue,
+    PricingVariable,
+    Processor,
+    Software,
+    SplunkUsage,
+    Storage,
+)
+from ralph.util.batch_pricing import COMPONENT_MODELS, chunks, update_prices
+from ralph.util.cache import after_commit
+from ralph.util.jobs import enqueue_once, release_keys
+
+
+REPRICING_QUEUE = getattr(settings, 'REPRICING_QUEUE', None)
+DIRTY_KEY = 'ralph:repricing:dirty'
+IN_FLIGHT_KEY = 'ralph:in-flight:repricing'
+BATCH_SIZE = 1000
+KINDS = (
+    'devices',
+    'device_models',
+    'device_groups',
+    'component_models',
+    'component_groups',
+    'pricing_groups',
+)
+PRICED_COMPONENTS = COMPONENT_MODELS + (DiskShare, SplunkUsage)
+# the fields of devices that their prices and costs depend on
+DEVICE_FIELDS = {
+    'deleted',
+    'deprecation_date',
+    'deprecation_kind_id',
+    'margin_kind_id',
+    'model_id',
+    'parent_id',
+    'price',
+    'purchase_date',
+    'venture_id',
+}
+_local = threading.local()
+
+
+def _get_items(**kwargs):
+    items = set()
+    for kind, ids in kwargs.iteritems():
+        if kind not in KINDS:
+            raise TypeError('Unknown kind of dirty objects: {}.'.format(kind))
+        items.update('{}:{}'.format(kind, id_) for id_ in ids if id_)
+    return items
+
+
+def _enqueue():
+    enqueue_once(
+        django_rq.get_queue(REPRICING_QUEUE),
+        IN_FLIGHT_KEY,
+        reprice_dirty,
+        timeout=3600,
+        result_ttl=0,
+    )
+
+
+def _get_pending():
+    if not hasattr(_local, 'items'):
+        _local.items = set()
+        _local.depth = 0
+    return _local.items
+
+
+def _flush():
+    items = _get_pending()
+    if not items:
+        return
+    _local.items = set()
+    django_rq.get_connection(REPRICING_QUEUE).sadd(DIRTY_KEY, *items)
+    _enqueue()
+
+
+def mark_dirty(**kwargs):
+    """Queues the repricing of the devices affected by the changes of the
+    objects with the given ids, e.g. `mark_dirty(devices=[1, 2])`. See
+    `KINDS`. Does nothing if `REPRICING_QUEUE` isn't set."""
+
+    if not REPRICING_QUEUE:
+        return
+    items = _get_items(**kwargs)
+    if not items:
+        return
+    _get_pending().update(items)
+    if not _local.depth:
+        after_commit(_flush)
+
+
+@contextlib.contextmanager
+def batched():
+    """Collects the objects marked as dirty inside of the block and queues
+    them at once when it ends::
+
+        with batched():
+            ...
+    """
+
+    _get_pending()
+    _local.depth += 1
+    try:
+        yield
+    finally:
+        _local.depth -= 1
+        if not _local.depth and _local.items:
+            after_commit(_flush)
+
+
+def reprice(**kwargs):
+    """Like `mark_dirty`, but if `REPRICING_QUEUE` isn't set, reprices the
+    affected devices at once."""
+
+    if REPRICING_QUEUE:
+        mark_dirty(**kwargs)
+    else:
+        _reprice(_get_items(**kwargs))
+
+
+def get_device_ids(items):
+    """Returns the ids of the devices that the prices of the dirty items
+    are part of."""
+
+    ids = collections.defaultdict(set)
+    for item in items:
+        kind, id_ = item.split(':')
+        ids[kind].add(int(id_))
+    device_ids = set(ids['devices'])
+    for chunk in chunks(ids['component_models'] | ids['component_groups']):
+        for model in PRICED_COMPONENTS:
+            device_ids.update(model.objects.filter(
+                Q(model_id__in=chunk) | Q(model__group_id__in=chunk),
+            ).values_list('device_id', flat=True))
+    for chunk in chunks(ids['device_models'] | ids['device_groups']):
+        device_ids.update(Device.objects.filter(
+            Q(model_id__in=chunk) | Q(model__group_id__in=chunk),
+        ).values_list('id', flat=True))
+    for chunk in chunks(ids['pricing_groups']):
+        device_ids.update(PricingGroup.devices.through.objects.filter(
+            pricinggroup_id__in=chunk,
+        ).values_list('device_id', flat=True))
+    return device_ids
+
+
+def get_affected(device_ids):
+    """Returns the ids of the devices whose prices depend on the devices
+    with the given ids: those devices, the ones mounting their disk shares
+    and all their ancestors."""
+
+    affected = set(device_ids)
+    for chunk in chunks(device_ids):
+        affected.update(DiskShareMount.objects.filter(
+            share__device_id__in=chunk,
+        ).exclude(device=None).values_list('device_id', flat=True))
+    level = affected
+    while level:
+        parents = set()
+        for chunk in chunks(level):
+            parents.update(Device.objects.filter(
+                id__in=chunk,
+            ).exclude(parent=None).values_list('parent_id', flat=True))
+        level = parents - affected
+        affected.update(level)
+    return affected
+
+
+def get_chunks(device_ids, size=BATCH_SIZE):
+    """Splits the ids of the devices into chunks of `size` to reprice.
+    The virtual and blade servers inside the other devices are left out,
+    `update_prices` reprices them in the chunk of their parent, whose price
+    depends on theirs and the other way round."""
+
+    device_ids = set(device_ids)
+    inside = set()
+    for chunk in chunks(device_ids):
+        for device_id, parent_id in Device.objects.filter(
+            id__in=chunk,
+            model__type__in=(
+                DeviceType.virtual_server.id,
+                DeviceType.blade_server.id,
+            ),
+        ).values_list('id', 'parent_id'):
+            if parent_id in device_ids:
+                inside.add(device_id)
+    return chunks(sorted(device_ids - inside), size)
+
+
+def _reprice(items):
+    """Reprices the devices affected by the dirty items, in batches."""
+
+    updated = 0
+    for chunk in get_chunks(get_affected(get_device_ids(items))):
+        updated += update_prices(chunk)
+    return updated
+
+
+def reprice_dirty(batch_size=BATCH_SIZE):
+    """The job repricing the devices affected by the items marked as dirty
+    with `mark_dirty`, until there are none left."""
+
+    connection = django_rq.get_connection(REPRICING_QUEUE)
+    try:
+        while True:
+            pipeline = connection.pipeline()
+            for i in xrange(batch_size):
+                pipeline.spop(DIRTY_KEY)
+            items = [item for item in pipeline.execute() if item]
+            if not items:
+                break
+            try:
+                _reprice(items)
+            except Exception:
+                # left for the next job, marked again rather than only
+                # removed when done, so that the changes made in the
+                # meantime aren't removed with them
+                connection.sadd(DIRTY_KEY, *items)
+                raise
+    finally:
+        release_keys([IN_FLIGHT_KEY])
+    # marked after the last batch, but before the key was released
+    if connection.scard(DIRTY_KEY):
+        _enqueue()
+
+
+def _changed(instance, raw, fields):
+    return (
+        REPRICING_QUEUE and not raw and
+        bool(set(fields) & set(instance.dirty_fields))
+    )
+
+
+@receiver(post_save, sender=DiskShareMount, dispatch_uid='ralph.repricing')
+@receiver(post_save, sender=DiskShare, dispatch_uid='ralph.repricing')
+@receiver(post_save, sender=FibreChannel, dispatch_uid='ralph.repricing')
+@receiver(post_save, sender=GenericComponent, dispatch_uid='ralph.repricing')
+@receiver(post_save, sender=Memory, dispatch_uid='ralph.repricing')
+@receiver(post_save, sender=OperatingSystem, dispatch_uid='ralph.repricing')
+@receiver(post_save, sender=Processor, dispatch_uid='ralph.repricing')
+@receiver(post_save, sender=Software, dispatch_uid='ralph.repricing')
+@receiver(post_save, sender=SplunkUsage, dispatch_uid='ralph.repricing')
+@receiver(post_save, sender=Storage, dispatch_uid='ralph.repricing')
+def component_post_save(sender, instance, created, raw, **kwargs):
+    if raw or not REPRICING_QUEUE or not (created or instance.dirty_fields):
+        return
+    mark_dirty(devices=[
+        instance.device_id,
+        instance.dirty_fields.get('device_id'),
+    ])
+
+
+@receiver(post_delete, sender=DiskShareMount, dispatch_uid='ralph.repricing')
+@receiver(post_delete, sender=DiskShare, dispatch_uid='ralph.repricing')
+@receiver(post_delete, sender=FibreChannel, dispatch_uid='ralph.repricing')
+@receiver(post_delete, sender=GenericComponent,
+          dispatch_uid='ralph.repricing')
+@receiver(post_delete, sender=Memory, dispatch_uid='ralph.repricing')
+@receiver(post_delete, sender=OperatingSystem, dispatch_uid='ralph.repricing')
+@receiver(post_delete, sender=Processor, dispatch_uid='ralph.repricing')
+@receiver(post_delete, sender=Software, dispatch_uid='ralph.repricing')
+@receiver(post_delete, sender=SplunkUsage, dispatch_uid='ralph.repricing')
+@receiver(post_delete, sender=Storage, dispatch_uid='ralph.repricing')
+def component_post_delete(sender, instance, **kwargs):
+    mark_dirty(devices=[instance.device_id])
+
+
+@receiver(post_save, sender=Device, dispatch_uid='ralph.repricing')
+def device_post_save(sender, instance, created, raw, **kwargs):
+    if (created and not raw) or _changed(instance, raw, DEVICE_FIELDS):
+        # the old parent loses the device
+        mark_dirty(devices=[
+            instance.id,
+            instance.parent_id,
+            instance.dirty_fields.get('parent_id'),
+        ])
+
+
+@receiver(post_delete, sender=Device, dispatch_uid='ralph.repricing')
+def device_post_delete(sender, instance, **kwargs):
+    mark_dirty(devices=[instance.parent_id])
+
+
+@receiver(post_save, sender=ComponentModel, dispatch_uid='ralph.repricing')
+def component_model_post_save(sender, instance, raw, **kwargs):
+    if _changed(instance, raw, ('group_id', 'size', 'cores')):
+        mark_dirty(component_models=[instance.id])
+
+
+@receiver(post_save, sender=DeviceModel, dispatch_uid='ralph.repricing')
+def device_model_post_save(sender, instance, raw, **kwargs):
+    if _changed(instance, raw, ('group_id',)):
+        mark_dirty(device_models=[instance.id])
+
+
+@receiver(post_save, sender=ComponentModelGroup,
+          dispatch_uid='ralph.repricing')
+def component_group_post_save(sender, instance, raw, **kwargs):
+    if _changed(instance, raw, ('price', 'per_size', 'size_modifier')):
+        mark_dirty(component_groups=[instance.id])
+
+
+@receiver(post_save, sender=DeviceModelGroup, dispatch_uid='ralph.repricing')
+def device_group_post_save(sender, instance, raw, **kwargs):
+    if _changed(instance, raw, ('price', 'slots')):
+        mark_dirty(device_groups=[instance.id])
+
+
+@receiver(pre_delete, sender=ComponentModelGroup,
+          dispatch_uid='ralph.repricing')
+def component_group_pre_delete(sender, instance, **kwargs):
+    # afterwards the models are left without a group
+    if REPRICING_QUEUE:
+        mark_dirty(component_models=instance.componentmodel_set.values_list(
+            'id', flat=True,
+        ))
+
+
+@receiver(pre_delete, sender=DeviceModelGroup, dispatch_uid='ralph.repricing')
+def device_group_pre_delete(sender, instance, **kwargs):
+    if REPRICING_QUEUE:
+        mark_dirty(device_models=instance.devicemodel_set.values_list(
+            'id', flat=True,
+        ))
+
+
+@receiver(post_save, sender=PricingFormula, dispatch_uid='ralph.repricing')
+@receiver(post_save, sender=PricingVariable, dispatch_uid='ralph.repricing')
+@receiver(post_delete, sender=PricingFormula, dispatch_uid='ralph.repricing')
+@receiver(post_delete, sender=PricingVariable, dispatch_uid='ralph.repricing')
+def pricing_group_changed(sender, instance, **kwargs):
+    mark_dirty(pricing_groups=[instance.group_id])
+
+
+@receiver(post_save, sender=PricingValue, dispatch_uid='ralph.repricing')
+@receiver(post_delete, sender=PricingValue, dispatch_uid='ralph.repricing')
+def pricing_value_changed(sender, instance, **kwargs):
+    if REPRICING_QUEUE:
+        mark_dirty(pricing_groups=[instance.variable.group_id])
+
+
+@receiver(pre_delete, sender=PricingGroup, dispatch_uid='ralph.repricing')
+def pricing_group_pre_delete(sender, instance, **kwargs):
+    if REPRICING_QUEUE:
+        mark_dirty(devices=instance.devices.values_list('id', flat=True))
+
+
+@receiver(
+    m2m_changed,
+    sender=PricingGroup.devices.through,
+    dispatch_uid='ralph.repricing',
+)
+def pricing_group_devices_changed(sender, instance, action, reverse, pk_set,
+                                  **kwargs):
+    if not REPRICING_QUEUE:
+        return
+    if reverse:
+        # the groups of a device changed
+        if action in ('post_add', 'post_remove', 'pre_clear'):
+            mark_dirty(devices=[instance.id])
+    elif action in ('post_add', 'post_remove'):
+        mark_dirty(devices=pk_set)
+    elif action == 'pre_clear':
+        mark_dirty(devices=instance.devices.values_list('id', flat=True))
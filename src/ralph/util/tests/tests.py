@@ -16,14 +16,19 @@ from __future__ import unicode_literals
 
 from datetime import datetime, timedelta, date
 import re
+import socket
 import textwrap
 
 from django.conf import settings
 from django.contrib.auth.models import User
 from django.core.cache import cache
-from django.test import TestCase
+from django.db import transaction
+from django.test import TestCase, TransactionTestCase
 from tastypie.models import ApiKey
 from unittest import skip
+import mock
+import redis
+import rq
 
 from ralph.business.models import Venture
 from ralph.discovery.models import (
@@ -36,6 +41,7 @@ from ralph.discovery.models import (
     DeviceType,
     DiskShare,
     DiskShareMount,
+    IPAddress,
     MarginKind,
     PricingAggregate,
     PricingFormula,
@@ -43,7 +49,11 @@ from ralph.discovery.models import (
     PricingValue,
     PricingVariable,
 )
-from ralph.util import pricing
+from ralph.discovery.models_pricing import invalidate_pricing_cache
+from ralph.scan.metrics import Measurement
+from ralph.util import batch_pricing, benchmark, pricing, repricing
+from ralph.util.cache import VersionedCache, after_commit
+from ralph.util.jobs import enqueue_many, enqueue_once, release_keys
 from ralph.util.pricing import get_device_raw_price
 from ralph.util import api_pricing
 
@@ -81,6 +91,19 @@ class NetworkTest(TestCase):
         # non-pingable host
         self.assertIsNone(ping(NON_EXISTENT_HOST_IP))
 
+    @mock.patch('ralph.util.network.ping')
+    @mock.patch('ralph.util.network.socket.socket')
+    def test_ping_many_without_raw_socket(self, socket_, ping):
+        from ralph.util.network import ping_many
+        socket_.side_effect = socket.error(1, 'Operation not permitted')
+        ping.side_effect = lambda hostname, *args: (
+            0.1 if hostname == '10.0.0.1' else None
+        )
+        self.assertEqual(
+            ping_many(['10.0.0.1', '10.0.0.2']),
+            {'10.0.0.1': 0.1, '10.0.0.2': None},
+        )
+
     @skip('uses external resources')
     def test_hostname(self):
         from ralph.util.network import hostname
@@ -92,6 +115,375 @@ class NetworkTest(TestCase):
         self.assertIsNone(hostname(NON_EXISTENT_HOST_IP))
 
 
+class TTLCacheTest(TestCase):
+    def test_expiry(self):
+        from ralph.util.network import TTLCache
+        cache = TTLCache(ttl=60, negative_ttl=-1)
+        cache.set('found', 'host.example.com')
+        cache.set('not found', None)
+        self.assertEqual(cache.get('found'), (True, 'host.example.com'))
+        self.assertEqual(cache.get('not found'), (False, None))
+
+    def test_size(self):
+        from ralph.util.network import TTLCache
+        cache = TTLCache(max_size=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual(cache.get('b'), (False, None))
+        self.assertEqual(cache.get('a'), (True, 1))
+        self.assertEqual(cache.get('c'), (True, 3))
+
+    def test_resolver_caches_answers(self):
+        from ralph.util.network import Resolver
+        resolver = Resolver()
+        with mock.patch.object(resolver, '_query') as query:
+            query.return_value = ['host.example.com.']
+            self.assertEqual(
+                resolver.hostnames(['10.0.0.1', '10.0.0.2']),
+                {
+                    '10.0.0.1': 'host.example.com',
+                    '10.0.0.2': 'host.example.com',
+                },
+            )
+            self.assertEqual(resolver.hostname('10.0.0.1'), 'host.example.com')
+            self.assertEqual(query.call_count, 2)
+
+    @mock.patch('ralph.util.network.socket.gethostbyaddr')
+    def test_resolver_falls_back_to_system(self, gethostbyaddr):
+        from ralph.util.network import Resolver
+        resolver = Resolver()
+        gethostbyaddr.return_value = ('local.example.com', [], ['10.0.0.1'])
+        with mock.patch.object(resolver, '_query') as query:
+            query.return_value = []
+            self.assertEqual(
+                resolver.hostname('10.0.0.1'),
+                'local.example.com',
+            )
+            gethostbyaddr.side_effect = socket.herror()
+            self.assertIsNone(resolver.hostname('10.0.0.2'))
+
+
+class VersionedCacheTest(TestCase):
+    def setUp(self):
+        cache.delete('ralph.tests.versioned')
+        self.build = mock.Mock(side_effect=[1, 2, 3])
+        self.value = VersionedCache('ralph.tests.versioned', self.build)
+
+    def test_invalidate(self):
+        self.assertEqual(self.value.get(), 1)
+        self.assertEqual(self.value.get(), 1)
+        self.value.invalidate()
+        self.assertEqual(self.value.get(), 2)
+
+    def test_version_change(self):
+        other = VersionedCache('ralph.tests.versioned', mock.Mock())
+        self.assertEqual(self.value.get(), 1)
+        other.invalidate()
+        self.assertEqual(self.value.get(), 1)
+        self.value.checked = 0
+        self.assertEqual(self.value.get(), 2)
+
+    @mock.patch('ralph.util.cache.time')
+    def test_max_age(self, time):
+        time.time.return_value = 1000
+        self.assertEqual(self.value.get(), 1)
+        time.time.return_value = 1000 + self.value.max_age - 1
+        self.assertEqual(self.value.get(), 1)
+        time.time.return_value = 1000 + self.value.max_age
+        self.value.checked = 0
+        self.assertEqual(self.value.get(), 2)
+
+
+class AfterCommitTest(TransactionTestCase):
+    def test_outside_of_transaction(self):
+        func = mock.Mock()
+        after_commit(func)
+        func.assert_called_once_with()
+
+    def test_commit(self):
+        func = mock.Mock()
+        with transaction.commit_on_success():
+            after_commit(func)
+            after_commit(func)
+            transaction.set_dirty()
+            self.assertFalse(func.called)
+        func.assert_called_once_with()
+
+    def test_nothing_to_commit(self):
+        func = mock.Mock()
+        with transaction.commit_on_success():
+            after_commit(func)
+            self.assertFalse(func.called)
+        func.assert_called_once_with()
+
+    def test_rollback(self):
+        func = mock.Mock()
+        with self.assertRaises(ValueError):
+            with transaction.commit_on_success():
+                after_commit(func)
+                transaction.set_dirty()
+                raise ValueError()
+        with transaction.commit_on_success():
+            pass
+        self.assertFalse(func.called)
+
+
+class EnqueueManyTest(TestCase):
+    def test_enqueue_many(self):
+        # nothing is sent to Redis, the executed pipelines are recorded
+        queue = rq.Queue('dc1', connection=redis.StrictRedis())
+        executed = []
+
+        def execute(pipeline):
+            executed.append([args[0] for args, _ in pipeline.command_stack])
+            pipeline.reset()
+
+        with mock.patch.object(
+            redis.client.StrictPipeline,
+            'execute',
+            autospec=True,
+            side_effect=execute,
+        ):
+            jobs = enqueue_many(
+                queue,
+                (('ralph.util.jobs.nothing', (i,), {}) for i in xrange(5)),
+                timeout=60,
+                result_ttl=0,
+                pipeline_size=2,
+            )
+        self.assertEqual([job.args for job in jobs], [(i,) for i in xrange(5)])
+        self.assertEqual(jobs[0].origin, 'dc1')
+        self.assertEqual(jobs[0].timeout, 60)
+        self.assertEqual(jobs[0].connection, queue.connection)
+        self.assertEqual(executed, [
+            ['HMSET', 'RPUSH'] * 2,
+            ['HMSET', 'RPUSH'] * 2,
+            ['HMSET', 'RPUSH'],
+        ])
+
+    def test_enqueue_many_claims_keys(self):
+        queue = rq.Queue('dc1', connection=redis.StrictRedis())
+        executed = []
+        in_flight = {'key-1'}
+
+        def execute(pipeline):
+            commands = [args for args, _ in pipeline.command_stack]
+            executed.append([args[0] for args in commands])
+            pipeline.reset()
+            return [args[1] not in in_flight for args in commands]
+
+        with mock.patch.object(
+            redis.client.StrictPipeline,
+            'execute',
+            autospec=True,
+            side_effect=execute,
+        ):
+            jobs = enqueue_many(
+                queue,
+                (
+                    ('ralph.util.jobs.nothing', (i,), {}, ['key-{}'.format(i)])
+                    for i in xrange(3)
+                ),
+            )
+        self.assertEqual([job.args for job in jobs], [(0,), (2,)])
+        self.assertEqual(executed, [
+            ['SET'] * 3,
+            ['HMSET', 'RPUSH'] * 2,
+        ])
+
+    @mock.patch.object(rq.Queue, 'enqueue_job')
+    @mock.patch.object(redis.StrictRedis, 'get')
+    @mock.patch.object(redis.StrictRedis, 'set')
+    def test_enqueue_once(self, set_, get, enqueue_job):
+        queue = rq.Queue('dc1', connection=redis.StrictRedis())
+        enqueue_job.side_effect = lambda job, timeout: job
+        set_.return_value = True
+        job = enqueue_once(
+            queue, 'key', 'ralph.util.jobs.nothing', (1,), timeout=600,
+        )
+        self.assertEqual(set_.call_args[0], ('key', job.id))
+        self.assertTrue(set_.call_args[1]['nx'])
+        # the key outlives the job timeout
+        self.assertEqual(set_.call_args[1]['ex'], 600 + 3600)
+        self.assertEqual(enqueue_job.call_count, 1)
+        # the same request is collapsed into the job in flight
+        set_.return_value = False
+        get.return_value = job.id
+        self.assertEqual(
+            enqueue_once(queue, 'key', 'ralph.util.jobs.nothing', (1,)).id,
+            job.id,
+        )
+        self.assertEqual(enqueue_job.call_count, 1)
+
+    @mock.patch('ralph.util.jobs.rq')
+    def test_release_keys(self, rq_):
+        job = rq_.get_current_job.return_value
+        job.id = 'job-id'
+        release_keys(['key-1', 'key-2'])
+        script = job.connection.register_script.return_value
+        script.assert_called_once_with(
+            keys=['key-1', 'key-2'],
+            args=['job-id'],
+        )
+        # the keys claimed by the job whose work the current one carries on
+        release_keys(['key-1'], job_id='first-job-id')
+        script.assert_called_with(keys=['key-1'], args=['first-job-id'])
+        # nothing to release outside of workers
+        rq_.get_current_job.return_value = None
+        release_keys(['key-1'])
+        self.assertEqual(script.call_count, 2)
+
+
+class BenchmarkTest(TestCase):
+    def test_run(self):
+        results = benchmark.run(
+            ['lshw', 'merge', 'Device.create', 'IPAddress.save'],
+            scale=2,
+            repeat=2,
+        )
+        self.assertEqual(results['database'], 'sqlite')
+        self.assertEqual(
+            list(results['benchmarks']),
+            ['lshw', 'merge', 'Device.create', 'IPAddress.save'],
+        )
+        self.assertEqual(results['benchmarks']['lshw']['queries'], 0)
+        self.assertGreater(
+            results['benchmarks']['Device.create']['queries'],
+            0,
+        )
+        # every run creates new objects
+        self.assertEqual(
+            Device.objects.filter(sn__startswith='DC').count(),
+            4,
+        )
+        self.assertEqual(IPAddress.objects.count(), 4)
+        rows = benchmark.compare(results, results)
+        self.assertEqual(rows[0][0], 'lshw')
+        self.assertEqual(rows[0][3], 1)
+
+    def test_median(self):
+        durations = iter([3, 1, 2])
+
+        class FakeMeasurement(object):
+            def __enter__(self):
+                return self
+
+            def __exit__(self, exc_type, exc_value, tb):
+                self.duration = next(durations)
+                self.queries = 0
+
+        with mock.patch.dict(
+            benchmark.BENCHMARKS,
+            {'fake': lambda scale: lambda: None},
+        ):
+            with mock.patch.object(benchmark, 'Measurement', FakeMeasurement):
+                results = benchmark.run(['fake'], repeat=3)
+        self.assertEqual(results['benchmarks']['fake']['min'], 1)
+        self.assertEqual(results['benchmarks']['fake']['median'], 2)
+        self.assertEqual(results['benchmarks']['fake']['max'], 3)
+
+
+class SSHPoolTest(TestCase):
+    @mock.patch('ralph.util.network.connect_ssh')
+    def test_reuse(self, connect_ssh):
+        from ralph.util.network import SSHPool
+        connect_ssh.side_effect = lambda *args, **kwargs: mock.Mock()
+        pool = SSHPool()
+        ssh = pool.connect('10.0.0.1', 'root', 'secret')
+        pool.release(ssh)
+        self.assertIs(pool.connect('10.0.0.1', 'root', 'secret'), ssh)
+        self.assertIsNot(pool.connect('10.0.0.1', 'root', 'secret'), ssh)
+        self.assertIsNot(pool.connect('10.0.0.1', 'admin', 'secret'), ssh)
+        self.assertEqual(connect_ssh.call_count, 3)
+        self.assertFalse(ssh.close.called)
+
+    @mock.patch('ralph.util.network.connect_ssh')
+    def test_expiry(self, connect_ssh):
+        from ralph.util.network import SSHPool
+        connect_ssh.side_effect = lambda *args, **kwargs: mock.Mock()
+        pool = SSHPool(idle_timeout=-1)
+        ssh = pool.connect('10.0.0.1', 'root', 'secret')
+        pool.release(ssh)
+        self.assertIsNot(pool.connect('10.0.0.1', 'root', 'secret'), ssh)
+        self.assertTrue(ssh.close.called)
+        dead = mock.Mock()
+        dead.get_transport.return_value.is_active.return_value = False
+        pool.release(dead)
+        self.assertTrue(dead.close.called)
+
+    def _channel(self, stdout, stderr, eof=True):
+        channel = mock.Mock()
+        channel.recv_ready.side_effect = [True, False] * 2
+        channel.recv.return_value = stdout
+        channel.recv_stderr_ready.side_effect = [True, False] * 2
+        channel.recv_stderr.return_value = stderr
+        channel.eof_received = eof
+        return channel
+
+    @mock.patch('ralph.util.network.select')
+    def test_batched_commands(self, select_):
+        from ralph.util.network import BatchedSSH
+        ssh = mock.Mock()
+        open_session = ssh.get_transport.return_value.open_session
+        open_session.side_effect = lambda: self._channel('out', '')
+        batched = BatchedSSH(ssh, ['uname', 'hostname', 'uname'])
+        self.assertEqual(open_session.call_count, 2)
+        stdin, stdout, stderr = batched.exec_command('uname')
+        self.assertEqual(stdout.read(), 'out')
+        self.assertFalse(ssh.exec_command.called)
+        batched.exec_command('uname')
+        self.assertTrue(ssh.exec_command.called)
+
+    @mock.patch('ralph.util.network.select')
+    def test_commands_read_both_streams(self, select_):
+        from ralph.util.network import exec_commands
+        ssh = mock.Mock()
+        channel = self._channel('out', 'err')
+        ssh.get_transport.return_value.open_session.return_value = channel
+        self.assertEqual(exec_commands(ssh, ['uname']), {
+            'uname': ('out', 'err'),
+        })
+        self.assertTrue(channel.close.called)
+
+    @mock.patch('ralph.util.network.select')
+    def test_commands_read_data_with_eof(self, select_):
+        from ralph.util.network import exec_commands
+        ssh = mock.Mock()
+        channel = self._channel('out', '', eof=False)
+        checks = []
+
+        def recv_ready():
+            checks.append(True)
+            if len(checks) == 1:
+                # the data and the end arrive right after the first check
+                channel.eof_received = True
+                return False
+            return len(checks) == 2
+        channel.recv_ready.side_effect = recv_ready
+        channel.recv_stderr_ready.side_effect = None
+        channel.recv_stderr_ready.return_value = False
+        ssh.get_transport.return_value.open_session.return_value = channel
+        self.assertEqual(exec_commands(ssh, ['dmidecode']), {
+            'dmidecode': ('out', ''),
+        })
+
+    @mock.patch('ralph.util.network.select')
+    def test_commands_timeout(self, select_):
+        from ralph.util.network import exec_commands
+        ssh = mock.Mock()
+        channel = self._channel('out', 'err', eof=False)
+        channel.recv_ready.side_effect = None
+        channel.recv_ready.return_value = False
+        channel.recv_stderr_ready.side_effect = None
+        channel.recv_stderr_ready.return_value = False
+        ssh.get_transport.return_value.open_session.return_value = channel
+        with self.assertRaises(socket.timeout):
+            exec_commands(ssh, ['uname'], timeout=0.01)
+        self.assertTrue(channel.close.called)
+
+
 class PricingTest(TestCase):
     def test_rack_server(self):
         dev = Device.create(sn='device', model_type=DeviceType.rack_server,
@@ -105,6 +497,22 @@ class PricingTest(TestCase):
         dev = Device.objects.get(id=dev.id)
         self.assertEquals(dev.cached_price, 1337)
 
+    def test_fallback_groups(self):
+        dev = Device.create(sn='device', model_type=DeviceType.rack_server,
+                            model_name='device')
+        self.assertEqual(pricing.get_device_cpu_price(dev), 0)
+        group = ComponentModelGroup(name='Default CPU', price=10)
+        group.save()
+        self.assertEqual(pricing.get_device_cpu_price(dev), 10)
+        # only the processors of the device are queried
+        with self.assertNumQueries(1):
+            self.assertEqual(pricing.get_device_cpu_price(dev), 10)
+        group.price = 20
+        group.save()
+        self.assertEqual(pricing.get_device_cpu_price(dev), 20)
+        group.delete()
+        self.assertEqual(pricing.get_device_cpu_price(dev), 0)
+
     def test_manual_price(self):
         dev = Device.create(sn='device', model_type=DeviceType.rack_server,
                             model_name='device')
@@ -219,6 +627,57 @@ class PricingTest(TestCase):
 
 
 class PricingGroupsTest(TestCase):
+    def tearDown(self):
+        # the rollback doesn't send the signals invalidating the cache
+        invalidate_pricing_cache()
+
+    def test_cached_evaluation(self):
+        today = date.today()
+        pricing_group = PricingGroup(
+            name='group',
+            date=date(today.year, today.month, 1),
+        )
+        pricing_group.save()
+        share_group = ComponentModelGroup(name='share', price=1)
+        share_group.save()
+        formula = PricingFormula(
+            group=pricing_group,
+            component_group=share_group,
+            formula='size*total',
+        )
+        formula.save()
+        total = PricingVariable(
+            name='total',
+            group=pricing_group,
+            aggregate=PricingAggregate.sum,
+        )
+        total.save()
+        PricingVariable(
+            name='smallest',
+            group=pricing_group,
+            aggregate=PricingAggregate.min,
+        ).save()
+        for value in (2, 3):
+            dev = Device.create(
+                sn='device%d' % value,
+                model_type=DeviceType.storage,
+                model_name='storage device',
+            )
+            PricingValue(device=dev, variable=total, value=value).save()
+        self.assertEqual(formula.get_value(size=2), 10)
+        self.assertEqual(pricing_group.get_variables(), {
+            'total': 5,
+            'smallest': None,
+        })
+        self.assertIs(
+            PricingFormula.compile_formula(formula.formula),
+            PricingFormula.compile_formula(formula.formula),
+        )
+        with self.assertNumQueries(0):
+            self.assertEqual(formula.get_value(size=3), 15)
+        PricingValue.objects.get(variable=total, value=3).delete()
+        self.assertEqual(formula.get_value(size=3), 6)
+
     def test_disk_share(self):
         storage_dev = Device.create(
             sn='device',
@@ -297,6 +756,309 @@ class PricingGroupsTest(TestCase):
         self.assertEqual(mount_price, 3 + 17.0 / 1024 + 11 * 13)
 
 
+class BatchPricingTest(TestCase):
+    def setUp(self):
+        def group(name, price, **kwargs):
+            group = DeviceModelGroup(name=name, price=price, **kwargs)
+            group.save()
+            return group
+
+        def device(sn, model_type, model_name, parent, group=None):
+            dev = Device.create(
+                sn=sn,
+                model_type=model_type,
+                model_name=model_name,
+                parent=parent,
+            )
+            if group:
+                dev.model.group = group
+                dev.model.save()
+            return dev
+
+        self.dc = device('dc', DeviceType.data_center, 'dc', None)
+        self.dc.name = 'dc1'
+        self.dc.save()
+        rack = device('rack', DeviceType.rack, 'rack', self.dc)
+        encl = device(
+            'encl', DeviceType.blade_system, 'encl', rack,
+            group('encl', 65535, slots=4),
+        )
+        blade_group = group('blade', 1337, slots=1)
+        self.blades = [
+            device('blade%d' % i, DeviceType.blade_server, 'blade', encl,
+                   blade_group)
+            for i in xrange(2)
+        ]
+        self.hypervisor = device(
+            'hypervisor', DeviceType.rack_server, 'hypervisor', rack,
+            group('hypervisor', 1000),
+        )
+        self.virtual_group = group('virtual', 100)
+        self.virtuals = [
+            device('virtual%d' % i, DeviceType.virtual_server, 'virtual',
+                   self.hypervisor, self.virtual_group)
+            for i in xrange(2)
+        ]
+        storage = device(
+            'storage', DeviceType.storage, 'storage', rack,
+            group('storage', 500),
+        )
+        ComponentModelGroup(name='Default CPU', price=10).save()
+        cpu_group = ComponentModelGroup(name='cpu', price=7)
+        cpu_group.save()
+        cpu_model, _ = ComponentModel.create(
+            ComponentType.processor,
+            priority=0,
+            family='cpu',
+            group=cpu_group,
+        )
+        for index in xrange(2):
+            self.blades[0].processor_set.create(
+                label='CPU', index=index, model=cpu_model,
+            )
+        share_group = ComponentModelGroup(
+            name='share', price=2, type=ComponentType.share, per_size=True,
+        )
+        share_group.save()
+        share_model, _ = ComponentModel.create(
+            ComponentType.share,
+            priority=0,
+            family='share',
+            group=share_group,
+        )
+        share = DiskShare(
+            device=storage, model=share_model, share_id=1, label='share',
+            size=2048, wwn='share',
+        )
+        share.save()
+        DiskShareMount(share=share, device=self.hypervisor, size=1024).save()
+        DiskShareMount(share=share, device=self.virtuals[0]).save()
+        today = date.today()
+        pricing_group = PricingGroup(
+            name='group',
+            date=date(today.year, today.month, 1),
+        )
+        pricing_group.save()
+        pricing_group.devices.add(storage)
+        PricingFormula(
+            group=pricing_group,
+            component_group=share_group,
+            formula='size*variable',
+        ).save()
+        variable = PricingVariable(name='variable', group=pricing_group)
+        variable.save()
+        PricingValue(device=storage, variable=variable, value=3).save()
+        margin = MarginKind(name='50%', margin=50)
+        margin.save()
+        venture = Venture(name='venture', symbol='venture', margin_kind=margin)
+        venture.save()
+        deprecation = DeprecationKind(name='10 months', months=10)
+        deprecation.save()
+        for dev in [self.hypervisor] + self.virtuals:
+            dev.venture = venture
+            dev.deprecation_kind = deprecation
+            dev.save()
+
+    def tearDown(self):
+        # the rollback doesn't send the signals invalidating the caches
+        ComponentModelGroup.fallbacks.invalidate()
+        invalidate_pricing_cache()
+
+    def test_same_as_single_devices(self):
+        expected = {
+            dev.id: (
+                pricing.get_device_price(dev),
+                pricing.get_device_cost(dev),
+            )
+            for dev in Device.objects.all()
+        }
+        pricing.device_update_cached(self.dc)
+        for dev in Device.objects.all():
+            price, cost = expected[dev.id]
+            self.assertAlmostEqual(dev.cached_price, price)
+            self.assertAlmostEqual(dev.cached_cost, cost)
+            self.assertEqual(dev.dc, 'DC1')
+        self.assertEqual(
+            Device.objects.get(id=self.blades[1].id).cached_price,
+            # a quarter of the chassis and the default CPU
+            65535 / 4 + 1337 + 10,
+        )
+
+    def test_blade_without_its_chassis(self):
+        encl = self.blades[0].parent
+        cpu_model = self.blades[0].processor_set.all()[0].model
+        encl.processor_set.create(label='CPU', index=0, model=cpu_model)
+        blade = self.blades[1]
+        price = batch_pricing.TreePricing([blade.id]).get_price(
+            Device.objects.get(id=blade.id),
+        )
+        self.assertEqual(price, pricing.get_device_price(blade))
+        # a quarter of the chassis with its CPU and the default CPU
+        self.assertEqual(price, (65535 + 7) / 4 + 1337 + 10)
+
+    def test_queries_do_not_depend_on_the_size(self):
+        def count_queries():
+            with Measurement() as measurement:
+                batch_pricing.TreePricing(
+                    batch_pricing.find_descendants(self.dc),
+                )
+            return measurement.queries
+
+        # the formulas and variables are cached by the first run
+        count_queries()
+        queries = count_queries()
+        for i in xrange(2, 10):
+            Device.create(
+                sn='virtual%d' % i,
+                model_type=DeviceType.virtual_server,
+                model_name='virtual',
+                parent=self.hypervisor,
+            )
+        self.assertEqual(count_queries(), queries)
+
+    def test_writes_only_changes(self):
+        pricing.device_update_cached(self.dc)
+        self.assertEqual(batch_pricing.update_cached(self.dc), 0)
+        Device.objects.filter(id=self.virtuals[1].id).update(cached_price=0)
+        self.assertEqual(batch_pricing.update_cached(self.dc), 1)
+
+
+class RepricingTest(TestCase):
+    def setUp(self):
+        self.rack = Device.create(
+            sn='rack',
+            model_type=DeviceType.rack,
+            model_name='rack',
+        )
+        self.server = Device.create(
+            sn='server',
+            model_type=DeviceType.rack_server,
+            model_name='server',
+            parent=self.rack,
+        )
+        self.storage = Device.create(
+            sn='storage',
+            model_type=DeviceType.storage,
+            model_name='storage',
+        )
+        self.group = ComponentModelGroup(
+            name='share', price=1, type=ComponentType.share, per_size=True,
+        )
+        self.group.save()
+        model, _ = ComponentModel.create(
+            ComponentType.share,
+            priority=0,
+            family='share',
+            group=self.group,
+        )
+        share = DiskShare(
+            device=self.storage, model=model, share_id=1, label='share',
+            size=4096, wwn='share',
+        )
+        share.save()
+        DiskShareMount(share=share, device=self.server, size=2048).save()
+
+    def test_get_affected(self):
+        self.assertEqual(
+            repricing.get_affected(repricing.get_device_ids(
+                ['component_groups:{}'.format(self.group.id)],
+            )),
+            {self.storage.id, self.server.id, self.rack.id},
+        )
+
+    @mock.patch('ralph.util.repricing.after_commit', lambda func: func())
+    @mock.patch('ralph.util.repricing.enqueue_once')
+    @mock.patch('ralph.util.repricing.django_rq')
+    def test_mark_dirty(self, django_rq, enqueue_once):
+        with mock.patch('ralph.util.repricing.REPRICING_QUEUE', 'default'):
+            self.group.price = 2
+            self.group.save()
+        django_rq.get_connection.return_value.sadd.assert_called_once_with(
+            repricing.DIRTY_KEY,
+            'component_groups:{}'.format(self.group.id),
+        )
+        self.assertEqual(enqueue_once.call_args[0][1], repricing.IN_FLIGHT_KEY)
+        # nothing is queued by default
+        django_rq.reset_mock()
+        self.group.price = 3
+        self.group.save()
+        self.assertFalse(django_rq.get_connection.called)
+
+    @mock.patch('ralph.util.repricing.after_commit', lambda func: func())
+    @mock.patch('ralph.util.repricing.enqueue_once')
+    @mock.patch('ralph.util.repricing.django_rq')
+    def test_batched(self, django_rq, enqueue_once):
+        with mock.patch('ralph.util.repricing.REPRICING_QUEUE', 'default'):
+            with repricing.batched():
+                self.group.price = 2
+                self.group.save()
+                self.server.price = 10
+                self.server.save()
+                self.assertFalse(django_rq.get_connection.called)
+        django_rq.get_connection.return_value.sadd.assert_called_once_with(
+            repricing.DIRTY_KEY,
+            *{
+                'component_groups:{}'.format(self.group.id),
+                'devices:{}'.format(self.server.id),
+                'devices:{}'.format(self.rack.id),
+            }
+        )
+        self.assertEqual(enqueue_once.call_count, 1)
+
+    def test_get_chunks(self):
+        virtual = Device.create(
+            sn='virtual',
+            model_type=DeviceType.virtual_server,
+            model_name='virtual',
+            parent=self.server,
+        )
+        # priced together with the server by `update_prices`
+        self.assertEqual(
+            list(repricing.get_chunks(
+                [self.rack.id, self.server.id, virtual.id, self.storage.id],
+                size=2,
+            )),
+            [
+                sorted([self.rack.id, self.server.id]),
+                [self.storage.id],
+            ],
+        )
+        self.assertEqual(
+            list(repricing.get_chunks([virtual.id])),
+            [[virtual.id]],
+        )
+
+    @mock.patch('ralph.util.repricing.release_keys')
+    @mock.patch('ralph.util.repricing._reprice')
+    @mock.patch('ralph.util.repricing.django_rq')
+    def test_reprice_dirty_fails(self, django_rq, _reprice, release_keys):
+        connection = django_rq.get_connection.return_value
+        connection.pipeline.return_value.execute.return_value = ['devices:1']
+        _reprice.side_effect = ValueError
+        with self.assertRaises(ValueError):
+            repricing.reprice_dirty(batch_size=1)
+        connection.sadd.assert_called_once_with(
+            repricing.DIRTY_KEY,
+            'devices:1',
+        )
+        release_keys.assert_called_once_with([repricing.IN_FLIGHT_KEY])
+
+    @mock.patch('ralph.util.repricing.django_rq')
+    def test_reprice_dirty(self, django_rq):
+        connection = django_rq.get_connection.return_value
+        connection.pipeline.return_value.execute.side_effect = [
+            ['component_groups:{}'.format(self.group.id), None],
+            [None, None],
+        ]
+        connection.scard.return_value = 0
+        repricing.reprice_dirty(batch_size=2)
+        self.assertEqual(
+            Device.objects.get(id=self.server.id).cached_price,
+            2,
+        )
+        self.assertFalse(django_rq.get_queue.called)
+
+
 class ApiTest(TestCase):
     def setUp(self):
         cache.delete("api_user_accesses")